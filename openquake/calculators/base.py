@@ -20,26 +20,33 @@ import os
 import sys
 import abc
 import pdb
+import inspect
 import math
+import time
 import socket
+import itertools
 import logging
 import operator
+import functools
+import threading
 import traceback
+import contextlib
 import collections
 
 import numpy
+import psutil
 
 from openquake.hazardlib import __version__ as hazardlib_version
 from openquake.hazardlib.geo import geodetic
-from openquake.baselib import general, hdf5
+from openquake.baselib import general, hdf5, parallel
 from openquake.baselib.performance import Monitor
-from openquake.hazardlib.calc.filters import SourceFilter
-from openquake.risklib import riskinput, __version__ as engine_version
+from openquake.risklib import riskinput, scientific
+from openquake.risklib import __version__ as engine_version
 from openquake.commonlib import readinput, datastore, source, calc
 from openquake.commonlib.oqvalidation import OqParam
-from openquake.baselib.parallel import Starmap, executor, wakeup_pool
+from openquake.baselib.parallel import executor, wakeup_pool
 from openquake.baselib.python3compat import with_metaclass
-from openquake.calculators.export import export as exp
+from openquake.calculators.export import export_parallel
 
 get_taxonomy = operator.attrgetter('taxonomy')
 get_weight = operator.attrgetter('weight')
@@ -50,7 +57,10 @@ calculators = general.CallableDict(operator.attrgetter('calculation_mode'))
 
 Site = collections.namedtuple('Site', 'sid lon lat')
 
+U32 = numpy.uint32
 F32 = numpy.float32
+F64 = numpy.float64
+MB = 1024. * 1024.
 
 
 class InvalidCalculationID(Exception):
@@ -66,6 +76,23 @@ class AssetSiteAssociationError(Exception):
 rlz_dt = numpy.dtype([('uid', 'S200'), ('model', 'S200'),
                       ('gsims', 'S100'), ('weight', F32)])
 
+# memory information about the tasks, see :func:`track_memory`
+task_memory_dt = numpy.dtype([('taskno', U32), ('peak_mb', F32),
+                              ('args_mb', F32), ('result_mb', F32),
+                              ('cache_mb', F32), ('args', 'S200')])
+
+# start and stop times of the tasks, see :class:`Starmap`;
+# `received` is the time when the controller received the result
+task_timeline_dt = numpy.dtype([('task', 'S50'), ('taskno', U32),
+                                ('start', F64), ('stop', F64),
+                                ('received', F64), ('host', 'S50'),
+                                ('pid', U32)])
+
+# start and stop times of the phases of the controller and size in MB
+# of the datastore at the end of each phase
+phase_dt = numpy.dtype([('phase', 'S50'), ('start', F64), ('stop', F64),
+                        ('host', 'S50'), ('pid', U32), ('size_mb', F32)])
+
 logversion = True
 
 
@@ -99,6 +126,199 @@ def set_array(longarray, shortarray):
     longarray[len(shortarray):] = numpy.nan
 
 
+class MemoryTracker(object):
+    """
+    Context manager sampling the resident memory of the current process
+    every `interval` seconds in a background thread. Contrarily to the
+    monitors, which measure the memory at the end of a block, it sees
+    the peak even if the memory is released before the end of the block.
+    """
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak = 0  # in bytes
+        self._proc = psutil.Process(os.getpid())
+        self._done = threading.Event()
+
+    def _sample(self):
+        self.peak = max(self.peak, self._proc.memory_info().rss)
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, etype, exc, tb):
+        self._done.set()
+        self._thread.join()
+        self._sample()
+
+
+def get_nbytes(obj, sample=10, depth=3):
+    """
+    Cheap estimate of the size in bytes of an object, without pickling
+    it. Arrays and objects with an integer `nbytes` attribute know their
+    size, strings their length; the sizes of the containers are
+    extrapolated from the sizes of (at most) `sample` elements and the
+    sizes of the other objects are the sums of the sizes of their
+    attributes, down to the given depth.
+
+    >>> get_nbytes(numpy.zeros(10))
+    80
+    >>> get_nbytes([numpy.zeros(10)] * 100)
+    8000
+    """
+    nbytes = getattr(obj, 'nbytes', None)
+    if isinstance(obj, numpy.ndarray) and obj.dtype == object:
+        obj = obj.flat  # estimate the size of the referenced objects
+    elif isinstance(nbytes, (int, numpy.integer)):
+        return int(nbytes)
+    if isinstance(obj, (bytes, str, type(u''))):
+        return len(obj)
+    elif depth == 0:
+        return sys.getsizeof(obj)
+    elif isinstance(obj, dict):
+        items = list(itertools.islice(obj.items(), sample))
+        size = sum(get_nbytes(k, sample, depth - 1) +
+                   get_nbytes(v, sample, depth - 1) for k, v in items)
+        return size * len(obj) // len(items) if items else 0
+    elif isinstance(obj, (list, tuple, set, frozenset, numpy.flatiter)):
+        items = list(itertools.islice(obj, sample))
+        size = sum(get_nbytes(item, sample, depth - 1) for item in items)
+        return size * len(obj) // len(items) if items else 0
+    elif hasattr(obj, '__dict__'):
+        return sum(get_nbytes(v, sample, depth - 1)
+                   for v in vars(obj).values())
+    return sys.getsizeof(obj)
+
+
+def track_memory(task):
+    """
+    Decorator for tasks returning a dictionary. It adds to the result
+    the key `task_memory` with a tuple (peak memory of the worker,
+    estimated sizes of the arguments, estimated size of the result, size
+    of the caches of the task), to be saved by
+    :meth:`BaseCalculator.save_task_memory`.
+    The size of the caches is taken from the key `cache_bytes` of the
+    result, if any. The sizes are estimated with :func:`get_nbytes`,
+    since pickling again the arguments and the result would double the
+    serialization work of the task.
+    """
+    @functools.wraps(task)
+    def wrapper(*args):
+        with MemoryTracker() as tracker:
+            result = task(*args)
+        cache_bytes = result.pop('cache_bytes', 0)
+        argsizes = [(arg.__class__.__name__, get_nbytes(arg))
+                    for arg in args[:-1]]  # the last argument is the monitor
+        nbytes = get_nbytes(result)
+        result['task_memory'] = (tracker.peak, argsizes, nbytes, cache_bytes)
+        return result
+    return wrapper
+
+
+class TimedTask(object):
+    """
+    Wrapper over a task function, returning the result together with a
+    tuple (start time, stop time, host, PID of the worker).
+    The name, the module, the docstring and the other attributes are
+    copied from the wrapped function.
+    """
+    def __init__(self, func):
+        self.func = func
+        functools.update_wrapper(self, func)
+
+    def __call__(self, *args):
+        start = time.time()
+        result = self.func(*args)
+        if inspect.isgenerator(result):
+            result = list(result)
+        return result, (start, time.time(), socket.gethostname(),
+                        os.getpid())
+
+
+class TimedResults(object):
+    """
+    Iterable over the results of a :class:`Starmap`, saving the timeline
+    of the tasks when all the results have been received (or a task has
+    failed).
+
+    :param iresults: the results of the tasks wrapped by :class:`TimedTask`
+    :param name: the name of the tasks
+    :param hdf5path: the path of the datastore, or None
+    """
+    def __init__(self, iresults, name, hdf5path):
+        self.iresults = iresults
+        self.name = name
+        self.hdf5path = hdf5path
+
+    def __iter__(self):
+        records = []
+        try:
+            for taskno, (result, (start, stop, host, pid)) in enumerate(
+                    self.iresults, 1):
+                records.append((self.name[:50], taskno, start, stop,
+                                time.time(), host[:50], pid))
+                yield result
+        finally:
+            if records and self.hdf5path:
+                with hdf5.File(self.hdf5path, 'r+') as f:
+                    datastore.extend(f, 'task_timeline',
+                                     numpy.array(records, task_timeline_dt))
+
+    def reduce(self, agg=operator.add, acc=None):
+        """
+        Aggregate the results as they arrive.
+
+        :param agg: the aggregation function
+        :param acc: the initial accumulator (by default an empty AccumDict)
+        """
+        if acc is None:
+            acc = general.AccumDict()
+        for result in self:
+            acc = agg(acc, result)
+        return acc
+
+
+class Starmap(parallel.Starmap):
+    """
+    A :class:`openquake.baselib.parallel.Starmap` recording the start and
+    stop times of every task, the host and PID of the worker and the time
+    when the controller received the result in the dataset `task_timeline`
+    of the datastore, found in the `hdf5path` of the monitor of the tasks.
+    The tasks are numbered in order of arrival.
+    """
+    def __init__(self, task_func, task_args, name=None):
+        if isinstance(task_args, (list, tuple)):
+            first = task_args[0] if task_args else None
+        else:  # peek the first arguments, but keep the iterator lazy
+            task_args = iter(task_args)
+            first = next(task_args, None)
+            if first is not None:
+                task_args = itertools.chain([first], task_args)
+        self.hdf5path = getattr(first[-1], 'hdf5path', None) if first else None
+        parallel.Starmap.__init__(self, task_func, task_args, name)
+        self.task_func = TimedTask(task_func)
+
+    def submit_all(self):
+        """
+        :returns: a :class:`TimedResults` instance
+        """
+        return TimedResults(parallel.Starmap.submit_all(self), self.name,
+                            self.hdf5path)
+
+    def reduce(self, agg=operator.add, acc=None):
+        """
+        Submit all the tasks and aggregate the results as they arrive.
+        """
+        return self.submit_all().reduce(agg, acc)
+
+
 def gsim_names(rlz):
     """
     Names of the underlying GSIMs separated by spaces
@@ -150,6 +370,7 @@ class BaseCalculator(with_metaclass(abc.ABCMeta)):
         self.monitor.calc_id = self.datastore.calc_id
         self.monitor.hdf5path = self.datastore.hdf5path
         self.datastore.export_dir = oqparam.export_dir
+        self.datastore.set_storage_profiles(oqparam.storage_profiles)
         self.oqparam = oqparam
 
     def save_params(self, **kw):
@@ -193,10 +414,13 @@ class BaseCalculator(with_metaclass(abc.ABCMeta)):
         exported = {}
         try:
             if pre_execute:
-                self.pre_execute()
-            self.result = self.execute()
+                with self.phase('pre_execute'):
+                    self.pre_execute()
+            with self.phase('execute'):
+                self.result = self.execute()
             if self.result is not None:
-                self.post_execute(self.result)
+                with self.phase('post_execute'):
+                    self.post_execute(self.result)
             self.before_export()
             exported = self.export(kw.get('exports', ''))
         except KeyboardInterrupt:
@@ -220,6 +444,40 @@ class BaseCalculator(with_metaclass(abc.ABCMeta)):
                     os.environ['OQ_DISTRIBUTE'] = oq_distribute
         return exported
 
+    def save_task_memory(self, taskname, info):
+        """
+        Append a record to the dataset `task_memory/<taskname>`.
+
+        :param taskname: the name of the task
+        :param info: the `task_memory` returned by a task decorated with
+                     :func:`track_memory`
+        """
+        peak, argsizes, nbytes, cache_bytes = info
+        key = 'task_memory/' + taskname
+        taskno = len(self.datastore[key]) + 1 if key in self.datastore else 1
+        args = ' '.join('%s:%s' % (name, general.humansize(size))
+                        for name, size in argsizes)
+        rec = (taskno, peak / MB, sum(size for _, size in argsizes) / MB,
+               nbytes / MB, cache_bytes / MB, args[:200])
+        self.datastore.extend(key, numpy.array([rec], task_memory_dt))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager appending the start and stop times of a phase of
+        the controller and the size of the datastore at the end of it
+        to the dataset `phase_timeline`.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.datastore.flush()
+            rec = (name, start, time.time(), socket.gethostname(),
+                   os.getpid(), self.datastore.getsize() / MB)
+            self.datastore.extend(
+                'phase_timeline', numpy.array([rec], phase_dt))
+
     def core_task(*args):
         """
         Core routine running on the workers.
@@ -267,17 +525,24 @@ class BaseCalculator(with_metaclass(abc.ABCMeta)):
         has_hcurves = 'hcurves' in self.datastore
         # NB: this is False in the classical precalculator
 
+        ekeys = []
         for fmt in fmts:
             if not fmt:
                 continue
             for key in sorted(keys):  # top level keys
                 if 'rlzs' in key and not individual_curves:
                     continue  # skip individual curves
-                self._export((key, fmt), exported)
+                ekeys.append((key, fmt))
             if has_hcurves and self.oqparam.hazard_maps:
-                self._export(('hmaps', fmt), exported)
+                ekeys.append(('hmaps', fmt))
             if has_hcurves and self.oqparam.uniform_hazard_spectra:
-                self._export(('uhs', fmt), exported)
+                ekeys.append(('uhs', fmt))
+        with self.phase('export'), self.monitor('export'):
+            exported.update(export_parallel(
+                ekeys, self.datastore, self.monitor('export')))
+        for ekey in ekeys:
+            if ekey in exported:
+                logging.info('exported %s: %s', ekey[0], exported[ekey])
 
         if self.close:  # in the engine we close later
             self.result = None
@@ -289,12 +554,6 @@ class BaseCalculator(with_metaclass(abc.ABCMeta)):
                 logging.warn('', exc_info=True)
         return exported
 
-    def _export(self, ekey, exported):
-        if ekey in exp:
-            with self.monitor('export'):
-                exported[ekey] = exp(ekey, self.datastore)
-                logging.info('exported %s: %s', ekey[0], exported[ekey])
-
     def before_export(self):
         """
         Collect the realizations and set the attributes nbytes
@@ -391,7 +650,8 @@ class HazardCalculator(BaseCalculator):
         if 'source' in oq.inputs:
             wakeup_pool()  # fork before reading the source model
             logging.info('Instantiating the source-sites filter')
-            self.src_filter = SourceFilter(self.sitecol, oq.maximum_distance)
+            self.src_filter = source.GridSourceFilter(
+                self.sitecol, oq.maximum_distance)
             if oq.hazard_calculation_id:  # already stored csm
                 logging.info('Reusing composite source model of calc #%d',
                              oq.hazard_calculation_id)
@@ -405,7 +665,8 @@ class HazardCalculator(BaseCalculator):
 
     def read_filter_csm(self):
         with self.monitor('reading composite source model', autoflush=True):
-                csm = readinput.get_composite_source_model(self.oqparam)
+            csm = readinput.get_composite_source_model(
+                self.oqparam, monitor=self.monitor('parse_source_model'))
         if self.is_stochastic:
             # initialize the rupture serial numbers before the
             # filtering; in this way the serials are independent
@@ -593,22 +854,32 @@ class RiskCalculator(HazardCalculator):
     def check_poes(self, curves_by_trt_gsim):
         """Overridden in ClassicalDamage"""
 
-    def make_eps(self, num_ruptures):
+    def make_eps(self, num_events=None):
         """
-        :param num_ruptures: the size of the epsilon array for each asset
+        :param num_events: the number of events, for the matrix of epsilons
+        :returns: an EpsilonGenerator if epsilon_generator is 'counter',
+                  an EpsilonMatrix of shape (A, num_events) otherwise,
+                  or None if ignore_covs is set
         """
         oq = self.oqparam
-        with self.monitor('building epsilons', autoflush=True):
-            return riskinput.make_eps(
-                self.assets_by_site, num_ruptures,
+        if oq.ignore_covs:
+            return
+        if oq.epsilon_generator == 'counter':
+            return scientific.EpsilonGenerator(
                 oq.master_seed, oq.asset_correlation)
+        with self.monitor('building epsilons', autoflush=True):
+            return riskinput.EpsilonMatrix(riskinput.make_eps(
+                self.assets_by_site, num_events,
+                oq.master_seed, oq.asset_correlation))
 
-    def build_riskinputs(self, hazards_by_rlz, eps=numpy.zeros(0)):
+    def build_riskinputs(self, hazards_by_rlz, epsgen=None, num_events=None):
         """
         :param hazards_by_rlz:
             a dictionary rlz -> IMT -> array of length num_sites
-        :param eps:
-            a matrix of epsilons (possibly empty)
+        :param epsgen:
+            an EpsilonGenerator or EpsilonMatrix instance, or None
+        :param num_events:
+            the number of events, if the hazards are (possibly sparse) GMFs
         :returns:
             a list of RiskInputs objects, sorted by IMT.
         """
@@ -632,13 +903,6 @@ class RiskCalculator(HazardCalculator):
             for block in blocks:
                 indices = numpy.array([idx for idx, _weight in block])
                 reduced_assets = self.assets_by_site[indices]
-                # dictionary of epsilons for the reduced assets
-                reduced_eps = collections.defaultdict(F32)
-                if len(eps):
-                    for assets in reduced_assets:
-                        for asset in assets:
-                            reduced_eps[asset.ordinal] = eps[asset.ordinal]
-
                 # collect the hazards into a list of dicts imt -> rlz
                 hdata = [{imt: {} for imt in imtls} for _ in indices]
                 for rlz, hazards_by_imt in hazards_by_rlz.items():
@@ -646,20 +910,30 @@ class RiskCalculator(HazardCalculator):
                         hazards_by_site = hazards_by_imt[imt]
                         for i, haz in enumerate(hazards_by_site[indices]):
                             hdata[i][imt][rlz] = haz
+                # send to the tasks only the epsilons of the reduced assets
+                if isinstance(epsgen, riskinput.EpsilonMatrix):
+                    reduced_eps = epsgen.reduce(
+                        a.ordinal for assets in reduced_assets
+                        for a in assets)
+                else:
+                    reduced_eps = epsgen
                 # build the riskinputs
                 ri = self.riskmodel.build_input(
-                    rlzs, hdata, reduced_assets, reduced_eps)
+                    rlzs, hdata, reduced_assets, reduced_eps, num_events)
                 if ri.weight > 0:
                     riskinputs.append(ri)
             assert riskinputs
             logging.info('Built %d risk inputs', len(riskinputs))
             return riskinputs
 
-    def execute(self):
+    def execute(self, agg=operator.add, acc=None):
         """
         Parallelize on the riskinputs and returns a dictionary of results.
         Require a `.core_task` to be defined with signature
         (riskinputs, riskmodel, rlzs_assoc, monitor).
+
+        :param agg: the function aggregating the outputs of the tasks
+        :param acc: the initial accumulator (by default an empty AccumDict)
         """
         self.monitor.oqparam = self.oqparam
         rlz_ids = getattr(self.oqparam, 'rlz_ids', ())
@@ -668,5 +942,5 @@ class RiskCalculator(HazardCalculator):
         all_args = ((riskinput, self.riskmodel) +
                     self.extra_args + (self.monitor,)
                     for riskinput in self.riskinputs)
-        res = Starmap(self.core_task.__func__, all_args).reduce()
+        res = Starmap(self.core_task.__func__, all_args).reduce(agg, acc)
         return res
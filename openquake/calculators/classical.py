@@ -17,14 +17,14 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import division
+import os
 import logging
 import operator
 import collections
 from functools import partial, reduce
 import numpy
 
-from openquake.baselib import parallel
-from openquake.baselib.python3compat import encode
+from openquake.baselib.python3compat import encode, decode
 from openquake.baselib.general import AccumDict
 from openquake.hazardlib.geo.utils import get_spherical_bounding_box
 from openquake.hazardlib.geo.utils import get_longitudinal_extent
@@ -32,12 +32,13 @@ from openquake.hazardlib.geo.geodetic import npoints_between
 from openquake.hazardlib.calc.hazard_curve import (
     pmap_from_grp, ProbabilityMap)
 from openquake.hazardlib.probability_map import PmapStats
-from openquake.commonlib import datastore, source, calc
+from openquake.commonlib import datastore, source, calc, logictree
 from openquake.calculators import base
 
 U16 = numpy.uint16
 F32 = numpy.float32
 F64 = numpy.float64
+PMAP_CLASS = 'openquake.hazardlib.probability_map.ProbabilityMap'
 
 HazardCurve = collections.namedtuple('HazardCurve', 'location poes')
 
@@ -238,7 +239,8 @@ class PSHACalculator(base.HazardCalculator):
             acc.eff_ruptures += pmap.eff_ruptures
             for bb in getattr(pmap, 'bbs', []):  # for disaggregation
                 acc.bb_dict[bb.lt_model_id, bb.site_id].update_bb(bb)
-            acc[pmap.grp_id] |= pmap
+            acc[pmap.grp_id] = calc.update_pmap(
+                acc[pmap.grp_id], pmap, self.oqparam.pmap_precision)
         self.datastore.flush()
         return acc
 
@@ -295,9 +297,12 @@ class PSHACalculator(base.HazardCalculator):
                 # then the Starmap will understand the case of a single
                 # argument tuple and it will run in core the task
                 iterargs = list(iterargs)
-            res = parallel.Starmap(
+            res = base.Starmap(
                 self.core_task.__func__, iterargs).submit_all()
         acc = reduce(self.agg_dicts, res, self.zerodict())
+        for grp_id, orig_id in getattr(self, 'dupl_groups', {}).items():
+            acc[grp_id] = acc[orig_id]
+            acc.eff_ruptures[grp_id] = acc.eff_ruptures.get(orig_id, 0)
         with self.monitor('store source_info', autoflush=True):
             self.store_source_info(self.csm.infos)
         self.rlzs_assoc = self.csm.info.get_rlzs_assoc(
@@ -315,13 +320,30 @@ class PSHACalculator(base.HazardCalculator):
         """
         oq = self.oqparam
         maxweight = self.csm.get_maxweight(oq.concurrent_tasks)
+        if oq.cache_split_sources:
+            self.csm.split_cache = source.SplitCache(
+                os.path.join(datastore.DATADIR, 'split_cache'))
         logging.info('Using a maxweight of %d', maxweight)
         ngroups = sum(len(sm.src_groups) for sm in csm.source_models)
+        # the groups with the same unmodified sources and the same GSIMs
+        # in different source models are computed only once; this is not
+        # possible for disaggregation and for the stochastic calculators
+        dedup = not (self.is_stochastic or oq.poes_disagg or oq.iml_disagg)
+        self.dupl_groups = {}  # grp_id -> grp_id of the computed group
+        computed = {}
         for sm in csm.source_models:
             for sg in sm.src_groups:
+                gsims = self.rlzs_assoc.gsims_by_grp_id[sg.id]
+                key = (getattr(sg, 'base', None), tuple(map(str, gsims)))
+                if dedup and key[0] is not None:
+                    if key in computed:
+                        self.dupl_groups[sg.id] = computed[key]
+                        logging.info('Source group #%d is the same as #%d',
+                                     sg.id + 1, computed[key] + 1)
+                        continue
+                    computed[key] = sg.id
                 logging.info('Sending source group #%d of %d (%s, %d sources)',
                              sg.id + 1, ngroups, sg.trt, len(sg.sources))
-                gsims = self.rlzs_assoc.gsims_by_grp_id[sg.id]
                 if oq.poes_disagg or oq.iml_disagg:  # only for disaggregation
                     monitor.sm_id = self.rlzs_assoc.sm_ids[sg.id]
                 monitor.samples = self.rlzs_assoc.samples[sg.id]
@@ -358,10 +380,29 @@ class PSHACalculator(base.HazardCalculator):
             for grp_id, pmap in pmap_by_grp_id.items():
                 if pmap:  # pmap can be missing if the group is filtered away
                     key = 'poes/%04d' % grp_id
-                    self.datastore[key] = pmap
+                    if self.oqparam.pmap_precision == 'float64':
+                        self.datastore[key] = pmap
+                    else:  # store 32 bit floats
+                        array, sids = calc.pmap_to_array(pmap, F32)
+                        self.datastore[key] = array
+                        self.datastore.set_attrs(
+                            key, __pyclass__=PMAP_CLASS, sids=sids)
                     self.datastore.set_attrs(key, trt=grp_trt[grp_id])
             if 'poes' in self.datastore:
                 self.datastore.set_nbytes('poes')
+                self.datastore.set_attrs(
+                    'poes', precision=self.oqparam.pmap_precision)
+
+
+def _consecutive(sids):
+    # split a sorted list of site IDs into lists of consecutive IDs
+    runs = []
+    for sid in sids:
+        if runs and sid == runs[-1][-1] + 1:
+            runs[-1].append(sid)
+        else:
+            runs.append([sid])
+    return runs
 
 
 def build_hcurves_and_stats(pmap_by_grp, sids, pstats, rlzs_assoc, monitor):
@@ -378,17 +419,19 @@ def build_hcurves_and_stats(pmap_by_grp, sids, pstats, rlzs_assoc, monitor):
     """
     if sum(len(pmap) for pmap in pmap_by_grp.values()) == 0:  # all empty
         return {}
-    rlzs = rlzs_assoc.realizations
+    rlzis = rlzs_assoc.rlzis.tolist()
     with monitor('combine pmaps'):
+        pmap_by_grp = {grp_id: calc.restore_pmap(pmap, monitor.pmap_precision)
+                       for grp_id, pmap in pmap_by_grp.items()}
         pmap_by_rlz = calc.combine_pmaps(rlzs_assoc, pmap_by_grp)
     pmap_by_kind = {}
-    if len(rlzs) > 1:
+    if len(rlzis) > 1:
         with monitor('compute stats'):
             pmap_by_kind.update(
-                pstats.compute(sids, [pmap_by_rlz[rlz] for rlz in rlzs]))
+                pstats.compute(sids, [pmap_by_rlz[rlzi] for rlzi in rlzis]))
     if monitor.individual_curves:
-        for rlz in rlzs:
-            pmap_by_kind['rlz-%03d' % rlz.ordinal] = pmap_by_rlz[rlz]
+        for rlzi in rlzis:
+            pmap_by_kind['rlz-%03d' % rlzi] = pmap_by_rlz[rlzi]
     return pmap_by_kind
 
 
@@ -407,23 +450,25 @@ class ClassicalCalculator(PSHACalculator):
         if 'poes' not in self.datastore:  # for short report
             return
         oq = self.oqparam
-        rlzs = self.rlzs_assoc.realizations
+        if oq.hazard_calculation_id and 'gsim_logic_tree' in oq.inputs:
+            self.reweight(oq.inputs['gsim_logic_tree'])
+        rlzis = self.rlzs_assoc.rlzis.tolist()
 
         # initialize datasets
         N = len(self.sitecol)
         L = len(oq.imtls.array)
         attrs = dict(
-            __pyclass__='openquake.hazardlib.probability_map.ProbabilityMap',
+            __pyclass__=PMAP_CLASS,
             sids=numpy.arange(N, dtype=numpy.uint32))
         nbytes = N * L * 4  # bytes per realization (32 bit floats)
         totbytes = 0
         if oq.individual_curves:
-            for rlz in rlzs:
+            for rlzi in rlzis:
                 self.datastore.create_dset(
-                    'hcurves/rlz-%03d' % rlz.ordinal, F32,
+                    'hcurves/rlz-%03d' % rlzi, F32,
                     (N, L, 1),  attrs=attrs)
                 totbytes += nbytes
-        if oq.mean_hazard_curves and len(rlzs) > 1:
+        if oq.mean_hazard_curves and len(rlzis) > 1:
             self.datastore.create_dset(
                 'hcurves/mean', F32, (N, L, 1), attrs=attrs)
             totbytes += nbytes
@@ -440,27 +485,73 @@ class ClassicalCalculator(PSHACalculator):
             pmap_by_grp = {
                 int(group_id): self.datastore['poes/' + group_id]
                 for group_id in self.datastore['poes']}
-            res = parallel.Starmap(
+            res = base.Starmap(
                 build_hcurves_and_stats,
                 list(self.gen_args(pmap_by_grp))).submit_all()
         nbytes = reduce(self.save_hcurves, res, AccumDict())
         return nbytes
 
+    def reweight(self, fname):
+        """
+        Recombine the PoEs stored by the parent calculation with the GSIM
+        logic tree in `fname`, which can change the weights of the GSIMs or
+        discard some of them, without recomputing the ground motion.
+        Sets the attribute .gsim_idxs, a dictionary grp_id -> indices
+        of the new GSIMs in the stored probability maps.
+
+        :param fname: the path of a GSIM logic tree file
+        """
+        csm_info = self.datastore['csm_info']
+        gsim_lt = logictree.GsimLogicTree(
+            fname, csm_info.gsim_lt.tectonic_region_types)
+        if str(gsim_lt) == str(csm_info.gsim_lt):
+            return  # same logic tree as the parent
+        old = self.rlzs_assoc
+        csm_info.gsim_lt = gsim_lt
+        for sm in csm_info.source_models:
+            trts = set(sg.trt for sg in sm.src_groups)
+            sm.num_gsim_paths = gsim_lt.reduce(trts).get_num_paths()
+        self.rlzs_assoc = csm_info.get_rlzs_assoc()
+        self.datastore['csm_info'] = self.csm_info = csm_info
+        self.gsim_idxs = {}
+        for grp_id, gsims in self.rlzs_assoc.gsims_by_grp_id.items():
+            stored = [str(gsim) for gsim in old.gsims_by_grp_id[grp_id]]
+            missing = set(map(str, gsims)) - set(stored)
+            if missing:
+                raise ValueError(
+                    'The GSIM(s) %s were not used in the calculation #%d' %
+                    (', '.join(sorted(missing)),
+                     self.oqparam.hazard_calculation_id))
+            self.gsim_idxs[grp_id] = [stored.index(str(gsim))
+                                      for gsim in gsims]
+        logging.info('Recombining %d realizations with the logic tree %s',
+                     self.rlzs_assoc.num_rlzs, fname)
+
     def gen_args(self, pmap_by_grp):
         """
         :param pmap_by_grp: dictionary of ProbabilityMaps keyed by src_grp_id
         :yields: arguments for the function build_hcurves_and_stats
         """
+        # the precision of the PoEs is the one of the parent calculation,
+        # if any, since they may have been stored as log(1-PoE)
+        precision = decode(
+            self.datastore['poes'].attrs.get('precision', 'float64'))
         monitor = self.monitor.new(
             'build_hcurves_and_stats',
-            individual_curves=self.oqparam.individual_curves)
+            individual_curves=self.oqparam.individual_curves,
+            pmap_precision=precision)
         weights = (None if self.oqparam.number_of_logic_tree_samples
-                   else [rlz.weight for rlz in self.rlzs_assoc.realizations])
+                   else self.rlzs_assoc.weights.tolist())
         pstats = PmapStats(self.oqparam.quantile_hazard_curves, weights)
-        num_rlzs = len(self.rlzs_assoc.realizations)
+        num_rlzs = self.rlzs_assoc.num_rlzs
+        gsim_idxs = getattr(self, 'gsim_idxs', {})
         for block in self.sitecol.split_in_tiles(num_rlzs):
             pg = {grp_id: pmap_by_grp[grp_id].filter(block.sids)
                   for grp_id in pmap_by_grp}
+            for grp_id in gsim_idxs:  # only the GSIMs of the new logic tree
+                if grp_id in pg:
+                    pg[grp_id] = calc.select_gsims(
+                        pg[grp_id], gsim_idxs[grp_id])
             yield pg, block.sids, pstats, self.rlzs_assoc, monitor
 
     def save_hcurves(self, acc, pmap_by_kind):
@@ -480,8 +571,12 @@ class ClassicalCalculator(PSHACalculator):
                 if pmap:
                     key = 'hcurves/' + kind
                     dset = self.datastore.getitem(key)
-                    for sid in pmap:
-                        dset[sid] = pmap[sid].array
+                    # write runs of consecutive sites at once, since
+                    # writing a site at the time recompresses the same
+                    # chunk of the dataset over and over
+                    for sids in _consecutive(sorted(pmap)):
+                        dset[sids[0]:sids[-1] + 1] = numpy.array(
+                            [pmap[sid].array for sid in sids])
                     # in the datastore we save 4 byte floats, thus we
                     # divide the memory consumption by 2: pmap.nbytes / 2
                     acc += {kind: pmap.nbytes // 2}
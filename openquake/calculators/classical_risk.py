@@ -70,18 +70,20 @@ def classical_risk(riskinput, riskmodel, monitor):
             weights = [riskinput.rlzs[row.r].weight for row in rows]
             row = rows[0]
             for l in l_idxs:
+                # row is index by the loss type index l and row[l]
+                # is a pair loss_curves, insured_loss_curves
+                # loss_curves[i, 0] are the i-th losses,
+                # loss_curves[i, 1] are the i-th poes; the poes are the
+                # same for all the assets, since they have the same
+                # taxonomy and site, so the stats are computed only once
+                poes_stats = compute_stats(
+                    numpy.array([out[l][0][0, 1] for out in rows]),
+                    oq.quantile_loss_curves, weights)
                 for i, asset in enumerate(assets):
                     avgs = numpy.array([r.average_losses[l][i] for r in rows])
                     avg_stats = compute_stats(
                         avgs, oq.quantile_loss_curves, weights)
-                    # row is index by the loss type index l and row[l]
-                    # is a pair loss_curves, insured_loss_curves
-                    # loss_curves[i, 0] are the i-th losses,
-                    # loss_curves[i, 1] are the i-th poes
                     losses = row[l][0][i, 0]
-                    poes_stats = compute_stats(
-                        numpy.array([row[l][0][i, 1] for row in rows]),
-                        oq.quantile_loss_curves, weights)
                     result['stat_curves'].append(
                         (l, asset.ordinal, losses, poes_stats, avg_stats))
     return result
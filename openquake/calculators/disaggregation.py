@@ -28,7 +28,6 @@ from openquake.baselib import hdf5
 from openquake.baselib.general import split_in_blocks
 from openquake.hazardlib.calc import disagg
 from openquake.hazardlib.calc.filters import SourceFilter
-from openquake.baselib import parallel
 from openquake.hazardlib import sourceconverter
 from openquake.calculators import base, classical
 
@@ -229,7 +228,7 @@ class DisaggregationCalculator(classical.ClassicalCalculator):
                         (src_filter, srcs, src_group.id, self.rlzs_assoc,
                          trt_names, curves_dict, bin_edges, oq, self.monitor))
 
-        results = parallel.Starmap(compute_disagg, all_args).reduce(
+        results = base.Starmap(compute_disagg, all_args).reduce(
             self.agg_result)
         self.save_disagg_results(results)
 
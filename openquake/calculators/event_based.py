@@ -31,7 +31,6 @@ from openquake.hazardlib.calc.filters import FarAwayRupture
 from openquake.hazardlib.probability_map import ProbabilityMap, PmapStats
 from openquake.hazardlib.geo.surface import PlanarSurface
 from openquake.risklib.riskinput import GmfGetter, str2rsi, rsi2str, gmv_dt
-from openquake.baselib import parallel
 from openquake.commonlib import calc, util, datastore
 from openquake.calculators import base
 from openquake.calculators.classical import ClassicalCalculator, PSHACalculator
@@ -334,25 +333,27 @@ def set_random_years(dstore, events_sm, investigation_time):
 
 # ######################## GMF calculator ############################ #
 
+@base.track_memory
 def compute_gmfs_and_curves(getter, rlzs, monitor):
     """
     :param getter:
         a GmfGetter instance
     :param rlzs:
-        realizations for the current source group
+        ordinals of the realizations for the current source group
     :param monitor:
         a Monitor instance
     :returns:
         a dictionary with keys gmfcoll and hcurves
    """
     oq = monitor.oqparam
+    rlzs = list(rlzs)
     with monitor('making contexts', measuremem=True):
-        getter.init()
-    haz = {sid: {} for sid in getter.sids}
-    gmfcoll = {}  # rlz -> gmfa
-    for rlz in rlzs:
-        gmfcoll[rlz] = []
-        for i, gmvdict in enumerate(getter(rlz)):
+        getter.init(rlzs)
+    haz = collections.defaultdict(list)  # (imt, rlzi) -> [(sid, gmvs)...]
+    gmfcoll = {}  # rlzi -> gmfa
+    for rlzi in rlzs:
+        gmfcoll[rlzi] = []
+        for i, gmvdict in enumerate(getter(rlzi)):
             if gmvdict:
                 sid = getter.sids[i]
                 for imti, imt in enumerate(getter.imts):
@@ -363,24 +364,27 @@ def compute_gmfs_and_curves(getter, rlzs, monitor):
                             # no gmv for the given imt, this may happen
                             pass
                         else:
-                            haz[sid][imt, rlz] = gmv
+                            haz[imt, rlzi].append((sid, gmv['gmv']))
                     for rec in gmvdict.get(imt, []):
-                        gmfcoll[rlz].append(
+                        gmfcoll[rlzi].append(
                             (sid, rec['eid'], imti, rec['gmv']))
-    for rlz in gmfcoll:
-        gmfcoll[rlz] = numpy.array(gmfcoll[rlz], gmv_dt)
+    for rlzi in gmfcoll:
+        gmfcoll[rlzi] = numpy.array(gmfcoll[rlzi], gmv_dt)
     result = dict(gmfcoll=gmfcoll if oq.ground_motion_fields else None,
-                  hcurves={})
+                  hcurves={}, cache_bytes=getter.cache_bytes)
     if oq.hazard_curves_from_gmfs:
         with monitor('building hazard curves', measuremem=False):
             duration = oq.investigation_time * oq.ses_per_logic_tree_path
-            for sid, haz_by_imt_rlz in haz.items():
-                for imt, rlz in haz_by_imt_rlz:
-                    gmvs = haz_by_imt_rlz[imt, rlz]['gmv']
-                    poes = calc._gmvs_to_haz_curve(
-                        gmvs, oq.imtls[imt], oq.investigation_time, duration)
-                    key = rsi2str(rlz.ordinal, sid, imt)
-                    result['hcurves'][key] = poes
+            # convert the GMVs of all the sites at once
+            for (imt, rlzi), pairs in haz.items():
+                idxs = numpy.repeat(numpy.arange(len(pairs)),
+                                    [len(gmvs) for sid, gmvs in pairs])
+                gmvs = numpy.concatenate([gmvs for sid, gmvs in pairs])
+                poes = calc.gmvs_to_poes(
+                    idxs, gmvs, oq.imtls[imt], len(pairs),
+                    oq.investigation_time, duration)
+                for (sid, _), curve in zip(pairs, poes):
+                    result['hcurves'][rsi2str(rlzi, sid, imt)] = curve
     return result
 
 
@@ -426,12 +430,15 @@ class EventBasedCalculator(ClassicalCalculator):
         """
         sav_mon = self.monitor('saving gmfs')
         agg_mon = self.monitor('aggregating hcurves')
+        if 'task_memory' in res:
+            self.save_task_memory(
+                self.core_task.__name__, res.pop('task_memory'))
         if res['gmfcoll'] is not None:
             with sav_mon:
-                for rlz, array in res['gmfcoll'].items():
+                for rlzi, array in res['gmfcoll'].items():
                     if len(array):
-                        sm_id = self.sm_id[rlz.sm_lt_path]
-                        key = 'gmf_data/sm-%04d/%04d' % (sm_id, rlz.ordinal)
+                        sm_id = self.sm_id[rlzi]
+                        key = 'gmf_data/sm-%04d/%04d' % (sm_id, rlzi)
                         self.datastore.extend(key, array)
         slicedic = self.oqparam.imtls.slicedic
         with agg_mon:
@@ -464,14 +471,15 @@ class EventBasedCalculator(ClassicalCalculator):
             ruptures = ruptures_by_grp[grp_id]
             if not ruptures:
                 continue
+            trt = self.grp_trt[grp_id]
+            gsims = self.rlzs_assoc.get_gsims(trt)
+            sampleids = self.rlzs_assoc.get_sampleids(grp_id)
+            rlzs = rlzs_by_grp[grp_id].tolist()
             for block in split_in_blocks(ruptures, oq.concurrent_tasks or 1):
-                trt = self.grp_trt[grp_id]
-                gsims = [dic[trt] for dic in self.rlzs_assoc.gsim_by_trt]
-                samples = self.rlzs_assoc.samples[grp_id]
                 getter = GmfGetter(gsims, block, self.sitecol,
                                    imts, min_iml, oq.truncation_level,
-                                   correl_model, samples)
-                yield getter, rlzs_by_grp[grp_id], monitor
+                                   correl_model, sampleids)
+                yield getter, rlzs, monitor
 
     def execute(self):
         """
@@ -486,15 +494,14 @@ class EventBasedCalculator(ClassicalCalculator):
                            else get_ruptures_by_grp(self.datastore.parent))
         if self.oqparam.ground_motion_fields:
             calc.check_overflow(self)
-        self.sm_id = {tuple(sm.path): sm.ordinal
-                      for sm in self.csm.info.source_models}
+        self.sm_id = self.rlzs_assoc.get_sm_id_by_rlz()
         L = len(oq.imtls.array)
-        res = parallel.Starmap(
+        res = base.Starmap(
             self.core_task.__func__, self.gen_args(ruptures_by_grp)
         ).submit_all()
         acc = functools.reduce(self.combine_pmaps_and_save_gmfs, res, {
-            rlz.ordinal: ProbabilityMap(L, 1)
-            for rlz in self.rlzs_assoc.realizations})
+            rlzi: ProbabilityMap(L, 1)
+            for rlzi in self.rlzs_assoc.rlzis.tolist()})
         return acc
 
     def post_execute(self, result):
@@ -507,7 +514,6 @@ class EventBasedCalculator(ClassicalCalculator):
         if not oq.hazard_curves_from_gmfs and not oq.ground_motion_fields:
             return
         elif oq.hazard_curves_from_gmfs:
-            rlzs = self.rlzs_assoc.realizations
             # save individual curves
             if self.oqparam.individual_curves:
                 for i in sorted(result):
@@ -520,7 +526,7 @@ class EventBasedCalculator(ClassicalCalculator):
             # we don't need to parallelize, since event based calculations
             # involves a "small" number of sites (<= 65,536)
             weights = (None if self.oqparam.number_of_logic_tree_samples
-                       else [rlz.weight for rlz in rlzs])
+                       else self.rlzs_assoc.weights.tolist())
             pstats = PmapStats(self.oqparam.quantile_hazard_curves, weights)
             for kind, stat in pstats.compute(
                     self.sitecol.sids, list(result.values())):
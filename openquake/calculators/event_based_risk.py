@@ -24,13 +24,11 @@ import numpy
 from openquake.baselib import hdf5
 from openquake.baselib.python3compat import zip
 from openquake.baselib.general import (
-    AccumDict, humansize, block_splitter, group_array)
+    AccumDict, humansize, block_splitter)
 from openquake.hazardlib.stats import compute_stats, compute_stats2
-from openquake.commonlib import config
+from openquake.commonlib import config, datastore
 from openquake.calculators import base, event_based
-from openquake.baselib import parallel
 from openquake.risklib import riskinput, scientific
-from openquake.baselib.parallel import Starmap
 
 U32 = numpy.uint32
 F32 = numpy.float32
@@ -94,9 +92,8 @@ def build_rcurves(ext5path, rlzname, cbs, assets, monitor):
     with hdf5.File(ext5path, 'r') as f:
         data = f['all_loss_ratios/' + rlzname].value
     result = {'rlzno': int(rlzname[4:])}  # strip rlz-
-    losses_by_aid = group_array(data, 'aid')
     for cb in cbs:
-        aids, curves = cb(assets, losses_by_aid)
+        aids, curves = cb(assets, data)
         if len(aids):
             result[cb.loss_type] = aids, curves
     return result
@@ -143,6 +140,7 @@ def _aggregate(outputs, compositemodel, agg, ass, idx, result, monitor):
             ], monitor.ela_dt))
 
 
+@base.track_memory
 def event_based_risk(riskinput, riskmodel, assetcol, monitor):
     """
     :param riskinput:
@@ -181,6 +179,7 @@ def event_based_risk(riskinput, riskmodel, assetcol, monitor):
 
     # store the size of the GMFs
     result['gmfbytes'] = monitor.gmfbytes
+    result['cache_bytes'] = monitor.cache_bytes
     return result
 
 
@@ -223,7 +222,7 @@ class EbrPostCalculator(base.RiskCalculator):
             with self.datastore.ext5() as ext5:
                 allargs = [(self.datastore.ext5path, rlzname, cbs, assets, mon)
                            for rlzname in ext5['all_loss_ratios']]
-            parallel.Starmap(build_rcurves, allargs).reduce(self.save_rcurves)
+            base.Starmap(build_rcurves, allargs).reduce(self.save_rcurves)
 
         # build rcurves-stats (sequentially)
         # this is a fundamental output, being used to compute loss_maps-stats
@@ -262,7 +261,7 @@ class EbrPostCalculator(base.RiskCalculator):
         cb_inputs = self.cb_inputs('agg_loss_table')
         I = oq.insured_losses + 1
         R = len(self.rlzs_assoc.realizations)
-        result = parallel.Starmap.apply(
+        result = base.Starmap.apply(
             build_agg_curve, (cb_inputs, self.monitor('')),
             concurrent_tasks=self.oqparam.concurrent_tasks).reduce()
         agg_curve = numpy.zeros((I, R), loss_curve_dt)
@@ -301,10 +300,12 @@ class EpsilonMatrix0(object):
 
     :param num_assets: N assets
     :param seeds: E seeds, set before calling numpy.random.normal
+    :param eids: E event IDs, in the same order of the seeds
     """
-    def __init__(self, num_assets, seeds):
+    def __init__(self, num_assets, seeds, eids):
         self.num_assets = num_assets
         self.seeds = seeds
+        self.eid2idx = dict(zip(eids, range(len(eids))))
         self.eps = None
 
     def make_eps(self):
@@ -317,10 +318,11 @@ class EpsilonMatrix0(object):
             eps[:, i] = numpy.random.normal(size=self.num_assets)
         return eps
 
-    def __getitem__(self, item):
+    def __call__(self, aids, eids):
         if self.eps is None:
             self.eps = self.make_eps()
-        return self.eps[item]
+        idxs = [self.eid2idx[eid] for eid in eids]
+        return self.eps[numpy.ix_(aids, idxs)]
 
 
 class EpsilonMatrix1(object):
@@ -330,17 +332,19 @@ class EpsilonMatrix1(object):
 
     :param num_events: number of events
     :param seed: seed used to generate E epsilons
+    :param eids: the event IDs of the block
     """
-    def __init__(self, num_events, seed):
+    def __init__(self, num_events, seed, eids):
         self.num_events = num_events
         self.seed = seed
+        self.eid2idx = dict(zip(eids, range(len(eids))))
         numpy.random.seed(seed)
         self.eps = numpy.random.normal(size=num_events)
 
-    def __getitem__(self, item):
-        # item[0] is the asset index, item[1] the event index
+    def __call__(self, aids, eids):
         # the epsilons are equal for all assets since asset_correlation=1
-        return self.eps[item[1]]
+        idxs = [self.eid2idx[eid] for eid in eids]
+        return numpy.tile(self.eps[idxs], (len(aids), 1))
 
 
 @base.calculators.add('ebrisk')
@@ -376,25 +380,34 @@ class EbriskCalculator(base.RiskCalculator):
             count_ruptures=lambda grp: len(ruptures_by_grp.get(grp.id, [])))
         num_events = sum(ebr.multiplicity for grp in ruptures_by_grp
                          for ebr in ruptures_by_grp[grp])
-        seeds = self.oqparam.random_seed + numpy.arange(num_events)
+        oq = self.oqparam
+        seeds = oq.random_seed + numpy.arange(num_events)
+        if oq.epsilon_generator == 'counter' and self.riskmodel.covs:
+            # the epsilons are generated inside the tasks from the event IDs
+            epsgen = self.make_eps()
+        else:
+            epsgen = None
 
         allargs = []
         # prepare the risk inputs
-        ruptures_per_block = self.oqparam.ruptures_per_block
+        ruptures_per_block = oq.ruptures_per_block
         start = 0
         grp_trt = csm_info.grp_trt()
-        ignore_covs = self.oqparam.ignore_covs
         for grp_id in grp_ids:
             for rupts in block_splitter(
                     ruptures_by_grp.get(grp_id, []), ruptures_per_block):
-                if ignore_covs or not self.riskmodel.covs:
+                eids = numpy.concatenate([r.events['eid'] for r in rupts])
+                if oq.ignore_covs or not self.riskmodel.covs:
                     eps = None
-                elif self.oqparam.asset_correlation:
-                    eps = EpsilonMatrix1(num_events, self.oqparam.master_seed)
+                elif epsgen is not None:
+                    eps = epsgen
+                elif oq.asset_correlation:
+                    eps = EpsilonMatrix1(num_events, oq.master_seed, eids)
                 else:
                     n_events = sum(ebr.multiplicity for ebr in rupts)
                     eps = EpsilonMatrix0(
-                        len(self.assetcol), seeds[start: start + n_events])
+                        len(self.assetcol), seeds[start: start + n_events],
+                        eids)
                     start += n_events
                 ri = riskinput.RiskInputFromRuptures(
                     grp_trt[grp_id], rlzs_assoc, imts, sitecol,
@@ -403,7 +416,8 @@ class EbriskCalculator(base.RiskCalculator):
 
         self.vals = self.assetcol.values()
         taskname = '%s#%d' % (event_based_risk.__name__, sm_id + 1)
-        ires = Starmap(event_based_risk, allargs, name=taskname).submit_all()
+        ires = base.Starmap(
+            event_based_risk, allargs, name=taskname).submit_all()
         ires.num_ruptures = {
             sg_id: len(rupts) for sg_id, rupts in ruptures_by_grp.items()}
         ires.num_events = num_events
@@ -503,10 +517,12 @@ class EbriskCalculator(base.RiskCalculator):
         self.gmfbytes = 0
         for res in allres:
             start, stop = res.rlz_slice.start, res.rlz_slice.stop
+            taskname = '%s#%d' % (event_based_risk.__name__, res.sm_id + 1)
             for dic in res:
                 if avg_losses:
                     self.save_avg_losses(dset, dic.pop('avglosses'), start)
                 self.gmfbytes += dic.pop('gmfbytes')
+                self.save_task_memory(taskname, dic.pop('task_memory'))
                 self.save_losses(
                     dic.pop('agglosses'), dic.pop('asslosses'), start)
             logging.debug(
@@ -540,9 +556,12 @@ class EbriskCalculator(base.RiskCalculator):
             for r in agglosses:
                 key = 'agg_loss_table/rlz-%03d' % (r + offset)
                 self.datastore.extend(key, agglosses[r])
-            for r in asslosses:
-                key = 'all_loss_ratios/rlz-%03d' % (r + offset)
-                hdf5.extend3(self.datastore.ext5path, key, asslosses[r])
+            if asslosses:
+                with self.datastore.ext5('a') as ext5:
+                    for r in asslosses:
+                        key = 'all_loss_ratios/rlz-%03d' % (r + offset)
+                        datastore.extend(ext5, key, asslosses[r],
+                                         self.datastore.get_profile(key))
 
     def post_execute(self, num_events):
         """
@@ -16,7 +16,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
-from openquake.baselib.general import import_all, CallableDict
+import os
+import collections
+from openquake.baselib.general import import_all, CallableDict, AccumDict
+from openquake.baselib.parallel import Starmap, oq_distribute
+from openquake.commonlib import config, datastore
 from openquake.commonlib.writers import write_csv
 
 
@@ -63,4 +67,86 @@ export = CallableDict(keyfunc)
 
 export.from_db = False  # overridden when exporting from db
 
+
+def _export(ekey, dstore, monitor):
+    # export a single output and return a dictionary ekey -> file names
+    with monitor('exporting %s.%s' % keyfunc(ekey), measuremem=True):
+        return {ekey: export(ekey, dstore)}
+
+
+def export_task(ekey, calc_id, datadir, export_dir, monitor):
+    """
+    Export a single output in a task, by opening the datastore in read mode.
+
+    :param ekey: export key, i.e. a pair (datastore key, fmt)
+    :param calc_id: calculation ID
+    :param datadir: directory containing the datastore
+    :param export_dir: directory where to export
+    :param monitor: Monitor instance
+    :returns: a dictionary ekey -> exported file names
+    """
+    with datastore.read(calc_id, datadir=datadir) as dstore:
+        dstore.export_dir = export_dir
+        return _export(ekey, dstore, monitor)
+export_task.shared_dir_on = config.SHARED_DIR_ON
+
+
+def split_ekey(ekey, dstore):
+    """
+    Split an export key into independent export keys. Currently only the
+    event based GMFs in .csv format are split, one key per realization,
+    since they are exported in a file per event and per realization.
+
+    :param ekey: export key, i.e. a pair (datastore key, fmt)
+    :param dstore: datastore object
+    :returns: a list of export keys
+    """
+    if (ekey == ('gmf_data', 'csv') and 'gmf_data' in dstore and
+            'scenario' not in dstore['oqparam'].calculation_mode):
+        return [('gmf_data:%d:*:%d' % (int(sm_id[3:]), int(rlzno)), 'csv')
+                for sm_id in sorted(dstore['gmf_data'])
+                for rlzno in sorted(dstore['gmf_data/' + sm_id])]
+    return [ekey]
+
+
+def export_parallel(ekeys, dstore, monitor):
+    """
+    Export the given outputs in parallel, by splitting them into independent
+    units (see :func:`split_ekey`) and by sending a task per unit. The tasks
+    open the datastore in read mode and write in its export_dir, so the
+    datastore passed in is closed while they run and reopened afterwards.
+    If the calculation is not distributed, the outputs are exported
+    sequentially by using the datastore passed in.
+
+    :param ekeys: a list of export keys
+    :param dstore: datastore object
+    :param monitor: Monitor instance, used also to store the export times
+    :returns: a dictionary export key -> list of exported file names
+    """
+    units = [ek for ekey in ekeys if ekey in export
+             for ek in split_ekey(ekey, dstore)]
+    if not units:
+        return {}
+    elif oq_distribute() == 'no':  # use the already opened datastore
+        acc = AccumDict()
+        for unit in units:
+            acc += _export(unit, dstore, monitor)
+    else:
+        # close the datastore before the tasks open it in read mode
+        mode = dstore.hdf5.mode
+        dstore.close()
+        datadir = os.path.dirname(dstore.hdf5path)
+        try:
+            acc = Starmap(export_task, [
+                (unit, dstore.calc_id, datadir, dstore.export_dir, monitor)
+                for unit in units]).reduce()
+        finally:
+            dstore.open(mode)
+    # collect the file names in the order of the units, not of the tasks
+    exported = collections.OrderedDict()
+    for unit in units:
+        exported.setdefault(keyfunc(unit), []).extend(acc[unit])
+    return exported
+
+
 import_all('openquake.calculators.export')
@@ -743,14 +743,16 @@ def get_sm_id_eid(key):
     ['1', '2']
     >>> get_sm_id_eid('gmf:3')
     ['0', '3']
+    >>> get_sm_id_eid('gmf:1:*:5')
+    ['1', '*']
     >>> get_sm_id_eid('gmf')
     [None, None]
     """
     n = key.count(':')
     if n == 1:  # passed the eid, sm_id assumed to be zero
         return ['0', key.split(':')[1]]
-    elif n == 2:  # passed both eid and sm_id
-        return key.split(':')[1:]
+    elif n in (2, 3):  # passed both eid and sm_id (and maybe the rlz)
+        return key.split(':')[1:3]
     else:  # eid and sm_id both unspecified, exporting nothing
         return [None, None]
 
@@ -766,13 +768,20 @@ def export_gmf_data_csv(ekey, dstore):
         fields = ['%03d' % i for i in range(n_gmfs)]
         dt = numpy.dtype([(f, F32) for f in fields])
         etags, gmfs_ = calc.get_gmfs(dstore)
-        sitemesh = get_mesh(dstore['sitecol'])
+        sitecol = dstore['sitecol']
+        sitemesh = get_mesh(sitecol)
         writer = writers.CsvWriter(fmt='%.5f')
-        for gsim, gmfa in zip(gsims, gmfs_):  # gmfa of shape (N, E)
+        for gsim, gmfa in zip(gsims, gmfs_):  # gmfa is a dict imt -> gmvs
             for imt in imtls:
-                gmfs = numpy.zeros(len(gmfa), dt)
-                for i in range(len(gmfa)):
-                    gmfs[i] = tuple(gmfa[imt][i])
+                # densify the sparse (gmv, eid) arrays, one per site;
+                # the discarded values are exported as zeros
+                dense = numpy.zeros((len(sitecol), n_gmfs), F32)
+                for i, sid in enumerate(sitecol.sids):
+                    gmvs = gmfa[imt][sid]
+                    dense[i, gmvs['eid']] = gmvs['gmv']
+                gmfs = numpy.zeros(len(sitecol), dt)
+                for e, field in enumerate(fields):
+                    gmfs[field] = dense[:, e]
                 dest = dstore.build_fname('gmf', '%s-%s' % (gsim, imt), 'csv')
                 data = util.compose_arrays(sitemesh, gmfs)
                 writer.save(data, dest)
@@ -780,8 +789,11 @@ def export_gmf_data_csv(ekey, dstore):
     else:  # event based
         exporter = GmfExporter(dstore)
         sm_id, eid = get_sm_id_eid(ekey[0])
-        if eid in (None, '*'):
+        if eid is None:
             return exporter.export_all()
+        elif eid == '*':  # all events of a source model, possibly of one rlz
+            rlzno = ekey[0].split(':')[3] if ekey[0].count(':') == 3 else None
+            return exporter.export_all(sm_id, rlzno)
         else:
             return exporter.export_one(int(sm_id), int(eid))
 
@@ -812,15 +824,27 @@ class GmfExporter(object):
             fnames.append(fname)
         return fnames
 
-    def export_all(self):
+    def export_all(self, sm_id=None, rlzno=None):
+        """
+        Export the GMFs of all events, in a file per event and realization.
+
+        :param sm_id: if given, export only the GMFs of that source model
+        :param rlzno: if given, export only the GMFs of that realization
+        """
         fnames = []
         imts = list(self.oq.imtls)
-        for sm_id in self.dstore['gmf_data']:
+        if sm_id is None:
+            sm_ids = list(self.dstore['gmf_data'])
+        else:
+            sm_ids = ['sm-%04d' % int(sm_id)]
+        for sm_id in sm_ids:
             events = self.dstore['events/' + sm_id]
             etag = dict(zip(range(len(events)), build_etags(events)))
-            for rlzno in self.dstore['gmf_data/' + sm_id]:
-                rlz = self.rlzs[int(rlzno)]
-                gmf = self.dstore['gmf_data/%s/%s' % (sm_id, rlzno)].value
+            for rlzi in self.dstore['gmf_data/' + sm_id]:
+                if rlzno is not None and int(rlzi) != int(rlzno):
+                    continue
+                rlz = self.rlzs[int(rlzi)]
+                gmf = self.dstore['gmf_data/%s/%s' % (sm_id, rlzi)].value
                 for eid, array in group_array(gmf, 'eid').items():
                     if eid not in etag:
                         continue
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2017 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+"""
+Extract slices of the datastore arrays without exporting them.
+Contrarily to the exporters, the extractors read only the requested
+hyperslabs of the underlying HDF5 datasets and return numpy arrays,
+which can be sent to a client in .npy or JSON format. For instance
+`extract('hcurves', dstore, kind='mean', sids=numpy.uint32([0, 1]))`
+returns the mean hazard curves for the first two sites.
+"""
+from __future__ import division
+import io
+import json
+import numpy
+
+from openquake.baselib.general import CallableDict
+from openquake.baselib.python3compat import decode
+from openquake.commonlib import calc
+
+U32 = numpy.uint32
+F32 = numpy.float32
+
+#: number of rows read at once when filtering tables by event ID
+BLOCKSIZE = 1000000
+
+# a dictionary of extractors datastore -> array
+extract = CallableDict()
+
+
+def parse_ids(text):
+    """
+    Convert a string into a sorted array of unique indices or into a slice.
+
+    >>> parse_ids('3,1,2,1')
+    array([1, 2, 3], dtype=uint32)
+    >>> parse_ids('10:20')
+    slice(10, 20, None)
+    >>> parse_ids('10:')
+    slice(10, None, None)
+    """
+    if ':' in text:
+        start, stop = text.split(':')
+        return slice(int(start) if start else None,
+                     int(stop) if stop else None)
+    return numpy.unique(numpy.array(text.split(','), U32))
+
+
+def parse_selection(params):
+    """
+    Convert a dictionary of strings (for instance the parameters of a
+    HTTP request) into a dictionary of keyword arguments for the extractors.
+    Empty strings and unknown parameters are ignored.
+
+    >>> sorted(parse_selection(dict(sids='1,2', rlz='3', foo='x')).items())
+    [('rlz', 3), ('sids', array([1, 2], dtype=uint32))]
+    """
+    kw = {}
+    for name, value in params.items():
+        if not value:
+            continue
+        elif name in ('sids', 'aids', 'eids'):
+            kw[name] = parse_ids(value)
+        elif name == 'rlz':
+            kw[name] = int(value)
+        elif name == 'kind':
+            kw[name] = value
+    return kw
+
+
+def _read_rows(dset, ids):
+    # read only the rows in `ids` (a slice or a sorted array of indices);
+    # h5py fancy indexing requires increasing indices
+    if ids is None:
+        return dset.value
+    elif isinstance(ids, slice):
+        return dset[ids]
+    elif len(ids) == 0:
+        return dset[0:0]
+    return dset[list(ids)]
+
+
+def _filter_eids(dset, eids, blocksize=BLOCKSIZE):
+    # read a table with an `eid` field in blocks and keep the rows with
+    # eid in `eids` (a slice or an array of event IDs), without reading
+    # the whole table in memory
+    if eids is None:
+        return dset.value
+    lst = []
+    for start in range(0, len(dset), blocksize):
+        block = dset[start:start + blocksize]
+        if isinstance(eids, slice):
+            ok = block['eid'] >= (eids.start or 0)
+            if eids.stop is not None:
+                ok &= block['eid'] < eids.stop
+        else:
+            ok = numpy.in1d(block['eid'], eids)
+        lst.append(block[ok])
+    if not lst:
+        return dset[0:0]
+    return numpy.concatenate(lst)
+
+
+def _hcurves(dstore, kind, sids):
+    # returns the stored site IDs and the curves for the selected sites
+    dset = dstore.getitem('hcurves/' + kind)
+    allsids = dset.attrs['sids']
+    if sids is None:
+        return allsids, dset.value[:, :, 0]
+    if isinstance(sids, slice):
+        sids = numpy.arange(*sids.indices(int(allsids.max()) + 1))
+    # find the positions of the requested sites, if they have curves
+    idx = numpy.searchsorted(allsids, sids)
+    ok = idx < len(allsids)
+    idx, sids = idx[ok], sids[ok]
+    idx = idx[allsids[idx] == sids]
+    return allsids[idx], _read_rows(dset, idx)[:, :, 0]
+
+
+@extract.add('hcurves')
+def extract_hcurves(what, dstore, kind='mean', sids=None):
+    """
+    Extract the hazard curves for the given sites.
+
+    :param what: the name of the extractor
+    :param dstore: a DataStore instance
+    :param kind: 'mean', 'quantile-XXX' or 'rlz-XXX'
+    :param sids: a slice or an array of site IDs, or None for all sites
+    :returns: a composite array with fields sid, IMT1, ... IMTn
+    """
+    imtls = dstore['oqparam'].imtls
+    sids, curves = _hcurves(dstore, kind, sids)
+    dt = numpy.dtype([('sid', U32)] + [
+        (imt, (F32, len(imtls[imt]))) for imt in imtls])
+    array = numpy.zeros(len(sids), dt)
+    array['sid'] = sids
+    for imt in imtls:
+        array[imt] = curves[:, imtls.slicedic[imt]]
+    return array
+
+
+@extract.add('hmaps')
+def extract_hmaps(what, dstore, kind='mean', sids=None):
+    """
+    Extract the hazard maps for the given sites, by computing them from
+    the hazard curves of the selected sites only.
+
+    :param what: the name of the extractor
+    :param dstore: a DataStore instance
+    :param kind: 'mean', 'quantile-XXX' or 'rlz-XXX'
+    :param sids: a slice or an array of site IDs, or None for all sites
+    :returns: a composite array with fields sid, IMT1, ... IMTn
+    """
+    oq = dstore['oqparam']
+    imtls = oq.imtls
+    sids, curves = _hcurves(dstore, kind, sids)
+    dt = numpy.dtype([('sid', U32)] + [
+        (imt, (F32, len(oq.poes))) for imt in imtls])
+    array = numpy.zeros(len(sids), dt)
+    array['sid'] = sids
+    for imt in imtls:
+        array[imt] = calc.compute_hazard_maps(
+            curves[:, imtls.slicedic[imt]], imtls[imt], oq.poes)
+    return array
+
+
+@extract.add('gmf_data')
+def extract_gmf_data(what, dstore, rlz=0, sids=None, eids=None):
+    """
+    Extract the ground motion values of a realization.
+
+    :param what: the name of the extractor
+    :param dstore: a DataStore instance
+    :param rlz: realization ordinal
+    :param sids: an array of site IDs, or None for all sites
+    :param eids: a slice or an array of event IDs, or None for all events
+    :returns: an array of dtype gmv_dt
+    """
+    for sm_id in dstore['gmf_data']:
+        key = 'gmf_data/%s/%04d' % (sm_id, int(rlz))
+        if key in dstore:
+            gmfa = _filter_eids(dstore.getitem(key), eids)
+            break
+    else:
+        raise KeyError('There are no GMFs for realization %s' % rlz)
+    if sids is None:
+        return gmfa
+    elif isinstance(sids, slice):
+        sids = numpy.arange(*sids.indices(int(gmfa['sid'].max()) + 1))
+    return gmfa[numpy.in1d(gmfa['sid'], sids)]
+
+
+@extract.add('avg_losses-rlzs')
+def extract_avg_losses(what, dstore, rlz=0, aids=None):
+    """
+    Extract the average losses of a realization for the given assets.
+
+    :param what: the name of the extractor
+    :param dstore: a DataStore instance
+    :param rlz: realization ordinal
+    :param aids: a slice or an array of asset ordinals, or None
+    :returns: a composite array with fields aid, loss_type1, ...
+    """
+    loss_types = [decode(lt) for lt in dstore.get_attr(
+        'composite_risk_model', 'loss_types')]
+    dset = dstore.getitem('avg_losses-rlzs')  # shape (A, R, L, I)
+    A = len(dset)
+    if aids is None:
+        aids = numpy.arange(A, dtype=U32)
+        losses = dset[:, int(rlz)]
+    elif isinstance(aids, slice):
+        losses = dset[aids, int(rlz)]
+        aids = numpy.arange(*aids.indices(A))
+    else:
+        aids = aids[aids < A]
+        losses = (dset[list(aids), int(rlz)] if len(aids)
+                  else dset[0:0, int(rlz)])
+    I = losses.shape[-1]  # 2 if there are insured losses, 1 otherwise
+    dt = numpy.dtype([('aid', U32)] + [(lt, (F32, (I,))) for lt in loss_types])
+    array = numpy.zeros(len(aids), dt)
+    array['aid'] = aids
+    for li, lt in enumerate(loss_types):
+        array[lt] = losses[:, li]
+    return array
+
+
+@extract.add('agg_loss_table')
+def extract_agg_loss_table(what, dstore, rlz=0, eids=None):
+    """
+    Extract the aggregate losses of a realization for the given events.
+
+    :param what: the name of the extractor
+    :param dstore: a DataStore instance
+    :param rlz: realization ordinal
+    :param eids: a slice or an array of event IDs, or None for all events
+    :returns: a composite array with fields eid, loss
+    """
+    return _filter_eids(
+        dstore.getitem('agg_loss_table/rlz-%03d' % int(rlz)), eids)
+
+
+def to_npy(array):
+    """
+    :param array: a numpy array
+    :returns: the bytes of the array in .npy format
+    """
+    bio = io.BytesIO()
+    numpy.save(bio, array)
+    return bio.getvalue()
+
+
+def to_json(array):
+    """
+    :param array: a (possibly composite) numpy array
+    :returns: a JSON string with a list of objects, one per row,
+              or a list of lists for a non-composite array
+    """
+    names = array.dtype.names
+    if names is None:
+        return json.dumps(array.tolist())
+    return json.dumps([{name: row[name].tolist() for name in names}
+                       for row in array])
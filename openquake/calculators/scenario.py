@@ -15,12 +15,10 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
-import collections
 import numpy
 
 from openquake.hazardlib.calc import filters
 from openquake.hazardlib.calc.gmf import GmfComputer
-from openquake.risklib.riskinput import gmv_dt
 from openquake.commonlib import readinput, source, calc
 from openquake.calculators import base
 
@@ -72,19 +70,19 @@ class ScenarioCalculator(base.HazardCalculator):
 
     def execute(self):
         """
-        Compute the GMFs and return a dictionary rlzi -> array gmv_dt
+        Compute the GMFs and return a dictionary rlzi -> array gmv_dt,
+        discarding the ground motion values below the minimum intensity
         """
-        res = collections.defaultdict(list)
+        oq = self.oqparam
         sids = self.sitecol.sids
+        min_iml = calc.fix_minimum_intensity(oq.minimum_intensity, oq.imtls)
         self.gmfa = {}
         with self.monitor('computing gmfs', autoflush=True):
-            n = self.oqparam.number_of_ground_motion_fields
+            n = oq.number_of_ground_motion_fields
             for i, gsim in enumerate(self.gsims):
-                gmfa = self.computer.compute(gsim, n)
-                self.gmfa[gsim] = gmfa
-                for (imti, sid, eid), gmv in numpy.ndenumerate(gmfa):
-                    res[i].append((sids[sid], eid, imti, gmv))
-            return {rlzi: numpy.array(res[rlzi], gmv_dt) for rlzi in res}
+                gmfa = self.computer.compute(gsim, n)  # shape (I, N, E)
+                self.gmfa[i] = calc.build_gmv_array(gmfa, sids, min_iml)
+            return self.gmfa
 
     def post_execute(self, gmfa_by_rlzi):
         """
@@ -16,17 +16,35 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
-import itertools
 import numpy
 
+from openquake.baselib.general import AccumDict
 from openquake.commonlib import riskmodels, calc
-from openquake.risklib import scientific
 from openquake.calculators import base
 
 F32 = numpy.float32
 F64 = numpy.float64
 
 
+def mean_std(data, axis):
+    """
+    :param data: an array of values
+    :param axis: the axis of the events
+    :returns: an array with the means and the stddevs along the given axis,
+              stacked along a new axis in the same position
+    """
+    return numpy.stack([data.mean(axis=axis), data.std(axis=axis, ddof=1)],
+                       axis=axis)
+
+
+def _fill(out, data, multi_stat_dt):
+    # data has shape (X, L, R, 2, ...) and out shape (X, R)
+    for l, lt in enumerate(multi_stat_dt.names):
+        out[lt]['mean'] = data[:, l, :, 0]
+        out[lt]['stddev'] = data[:, l, :, 1]
+    return out
+
+
 def dist_by_asset(data, multi_stat_dt):
     """
     :param data: array of shape (N, L, R, 2, ...)
@@ -34,43 +52,30 @@ def dist_by_asset(data, multi_stat_dt):
     :returns: array of shape (N, R) with records of type multi_stat_dt
     """
     N, L, R = data.shape[:3]
-    out = numpy.zeros((N, R), multi_stat_dt)
-    for l, lt in enumerate(multi_stat_dt.names):
-        out_lt = out[lt]
-        for n, r in itertools.product(range(N), range(R)):
-            out_lt[n, r] = data[n, l, r]
-    return out
+    return _fill(numpy.zeros((N, R), multi_stat_dt), data, multi_stat_dt)
 
 
 def dist_by_taxon(data, multi_stat_dt):
     """
-    :param data: array of shape (T, L, R, ...)
+    :param data: array of shape (T, L, R, E, ...)
     :param multi_stat_dt: numpy dtype for statistical outputs
     :returns: array of shape (T, R) with records of type multi_stat_dt
     """
     T, L, R = data.shape[:3]
-    out = numpy.zeros((T, R), multi_stat_dt)
-    for l, lt in enumerate(multi_stat_dt.names):
-        out_lt = out[lt]
-        for t, r in itertools.product(range(T), range(R)):
-            out_lt[t, r] = scientific.mean_std(data[t, l, r])
-    return out
+    return _fill(numpy.zeros((T, R), multi_stat_dt), mean_std(data, 3),
+                 multi_stat_dt)
 
 
 def dist_total(data, multi_stat_dt):
     """
-    :param data: array of shape (T, L, R, ...)
+    :param data: array of shape (T, L, R, E, ...)
     :param multi_stat_dt: numpy dtype for statistical outputs
     :returns: array of shape (R,) with records of type multi_stat_dt
     """
     T, L, R = data.shape[:3]
-    total = data.sum(axis=0)
-    out = numpy.zeros(R, multi_stat_dt)
-    for l, lt in enumerate(multi_stat_dt.names):
-        out_lt = out[lt]
-        for r in range(R):
-            out_lt[r] = scientific.mean_std(total[l, r])
-    return out
+    total = data.sum(axis=0)[None]  # shape (1, L, R, E, ...)
+    return _fill(numpy.zeros((1, R), multi_stat_dt), mean_std(total, 3),
+                 multi_stat_dt)[0]
 
 
 def scenario_damage(riskinput, riskmodel, monitor):
@@ -84,46 +89,48 @@ def scenario_damage(riskinput, riskmodel, monitor):
     :param monitor:
         :class:`openquake.baselib.performance.Monitor` instance
     :returns:
-        a dictionary {'d_asset': [(l, r, a, mean-stddev), ...],
-                      'd_taxonomy': damage array of shape T, L, R, E, D,
-                      'c_asset': [(l, r, a, mean-stddev), ...],
-                      'c_taxonomy': damage array of shape T, L, R, E}
-
-    `d_asset` and `d_taxonomy` are related to the damage distributions
-    whereas `c_asset` and `c_taxonomy` are the consequence distributions.
-    If there is no consequence model `c_asset` is an empty list and
-    `c_taxonomy` is a zero-value array.
+        a dictionary {'d_asset': [(l, r, aids, mean-stddev), ...],
+                      'd_taxon': {(t, l, r): damage array of shape E, D},
+                      'c_asset': [(l, r, aids, mean-stddev), ...],
+                      'c_taxon': {(t, l, r): consequence array of shape E}}
+
+    `d_asset` and `d_taxon` are related to the damage distributions
+    whereas `c_asset` and `c_taxon` are the consequence distributions.
+    If there is no consequence model `c_asset` and `c_taxon` are empty.
+    The statistics by asset are computed here, the ones by taxonomy
+    need the sums over the assets of the taxonomy, event by event.
     """
     c_models = monitor.consequence_models
-    L = len(riskmodel.loss_types)
-    R = len(riskinput.rlzs)
-    D = len(riskmodel.damage_states)
-    E = monitor.oqparam.number_of_ground_motion_fields
-    T = len(monitor.taxonomies)
     taxo2idx = {taxo: i for i, taxo in enumerate(monitor.taxonomies)}
-    result = dict(d_asset=[], d_taxon=numpy.zeros((T, L, R, E, D), F64),
-                  c_asset=[], c_taxon=numpy.zeros((T, L, R, E), F64))
+    result = dict(d_asset=[], d_taxon=AccumDict(),
+                  c_asset=[], c_taxon=AccumDict())
     for outputs in riskmodel.gen_outputs(riskinput, monitor):
         r = outputs.r
-        for l, damages in enumerate(outputs):
+        assets = outputs.assets  # with the same taxonomy
+        taxonomy = assets[0].taxonomy
+        t = taxo2idx[taxonomy]
+        aids = numpy.array([asset.ordinal for asset in assets])
+        numbers = numpy.array([asset.number for asset in assets])
+        for l, fractions in enumerate(outputs):
+            if fractions is None:  # this may happen
+                continue
             loss_type = riskmodel.loss_types[l]
+            fractions = numpy.array(fractions)  # shape (A, E, D)
+            damages = fractions * numbers[:, None, None]
+            result['d_asset'].append((l, r, aids, mean_std(damages, 1)))
+            result['d_taxon'] += {(t, l, r): damages.sum(axis=0)}
             c_model = c_models.get(loss_type)
-            for asset, fraction in zip(outputs.assets, damages):
-                t = taxo2idx[asset.taxonomy]
-                damages = fraction * asset.number
-                if c_model:  # compute consequences
-                    means = [par[0] for par in c_model[asset.taxonomy].params]
-                    # NB: we add a 0 in front for nodamage state
-                    c_ratio = numpy.dot(fraction, [0] + means)
-                    consequences = c_ratio * asset.value(loss_type)
-                    result['c_asset'].append(
-                        (l, r, asset.ordinal,
-                         scientific.mean_std(consequences)))
-                    result['c_taxon'][t, l, r, :] += consequences
-                    # TODO: consequences for the occupants
-                result['d_asset'].append(
-                    (l, r, asset.ordinal, scientific.mean_std(damages)))
-                result['d_taxon'][t, l, r, :] += damages
+            if c_model:  # compute consequences
+                means = [par[0] for par in c_model[taxonomy].params]
+                # NB: we add a 0 in front for nodamage state
+                c_ratios = numpy.dot(fractions, [0] + means)  # shape (A, E)
+                values = numpy.array(
+                    [asset.value(loss_type) for asset in assets])
+                consequences = c_ratios * values[:, None]
+                result['c_asset'].append(
+                    (l, r, aids, mean_std(consequences, 1)))
+                result['c_taxon'] += {(t, l, r): consequences.sum(axis=0)}
+                # TODO: consequences for the occupants
     return result
 
 
@@ -142,13 +149,46 @@ class ScenarioDamageCalculator(base.RiskCalculator):
         base.RiskCalculator.pre_execute(self)
         self.monitor.consequence_models = riskmodels.get_risk_models(
             self.oqparam, 'consequence')
-        self.datastore['etags'], gmfs = calc.get_gmfs(
-            self.datastore, self.precalc)
+        etags, gmfs = calc.get_gmfs(self.datastore, self.precalc)
+        self.datastore['etags'] = etags
         rlzs = self.csm_info.get_rlzs_assoc().realizations
         self.riskinputs = self.build_riskinputs(
-            {rlz: gmf for rlz, gmf in zip(rlzs, gmfs)})
+            {rlz: gmf for rlz, gmf in zip(rlzs, gmfs)},
+            num_events=len(etags))
         self.monitor.taxonomies = sorted(self.taxonomies)
 
+    def execute(self):
+        """
+        Run the scenario_damage tasks and reduce their outputs as they
+        arrive, by storing the statistics by asset and by summing the
+        damages and consequences by taxonomy.
+        """
+        N = len(self.assetcol)
+        T = len(self.monitor.taxonomies)
+        L = len(self.riskmodel.loss_types)
+        R = len(self.rlzs_assoc.realizations)
+        E = self.oqparam.number_of_ground_motion_fields
+        D = len(self.riskmodel.damage_states)
+        acc = dict(d_asset=numpy.zeros((N, L, R, 2, D), F32),
+                   d_taxon=numpy.zeros((T, L, R, E, D), F64))
+        if self.monitor.consequence_models:
+            acc['c_asset'] = numpy.zeros((N, L, R, 2), F32)
+            acc['c_taxon'] = numpy.zeros((T, L, R, E), F64)
+        return base.RiskCalculator.execute(self, self.agg_dicts, acc)
+
+    def agg_dicts(self, acc, result):
+        """
+        :param acc: a dictionary of arrays
+        :param result: a dictionary returned by the scenario_damage task
+        :returns: the updated accumulator
+        """
+        for kind in ('d', 'c'):
+            for l, r, aids, stats in result[kind + '_asset']:
+                acc[kind + '_asset'][aids, l, r] = stats
+            for (t, l, r), array in result[kind + '_taxon'].items():
+                acc[kind + '_taxon'][t, l, r] += array
+        return acc
+
     def post_execute(self, result):
         """
         Compute stats for the aggregated distributions and save
@@ -156,10 +196,7 @@ class ScenarioDamageCalculator(base.RiskCalculator):
         """
         dstates = self.riskmodel.damage_states
         ltypes = self.riskmodel.loss_types
-        L = len(ltypes)
-        R = len(self.rlzs_assoc.realizations)
         D = len(dstates)
-        N = len(self.assetcol)
 
         # damage distributions
         dt_list = []
@@ -167,25 +204,19 @@ class ScenarioDamageCalculator(base.RiskCalculator):
             dt_list.append((ltype, numpy.dtype([('mean', (F32, D)),
                                                 ('stddev', (F32, D))])))
         multi_stat_dt = numpy.dtype(dt_list)
-        d_asset = numpy.zeros((N, L, R, 2, D), F32)
-        for (l, r, a, stat) in result['d_asset']:
-            d_asset[a, l, r] = stat
         self.datastore['dmg_by_asset'] = dist_by_asset(
-            d_asset, multi_stat_dt)
+            result['d_asset'], multi_stat_dt)
         self.datastore['dmg_by_taxon'] = dist_by_taxon(
             result['d_taxon'], multi_stat_dt)
         self.datastore['dmg_total'] = dist_total(
             result['d_taxon'], multi_stat_dt)
 
         # consequence distributions
-        if result['c_asset']:
-            c_asset = numpy.zeros((N, L, R, 2), F32)
-            for (l, r, a, stat) in result['c_asset']:
-                c_asset[a, l, r] = stat
+        if 'c_asset' in result:
             multi_stat_dt = numpy.dtype(
                 [(lt, [('mean', F32), ('stddev', F32)]) for lt in ltypes])
             self.datastore['csq_by_asset'] = dist_by_asset(
-                c_asset, multi_stat_dt)
+                result['c_asset'], multi_stat_dt)
             self.datastore['csq_by_taxon'] = dist_by_taxon(
                 result['c_taxon'], multi_stat_dt)
             self.datastore['csq_total'] = dist_total(
@@ -16,8 +16,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
-import logging
-
 import numpy
 
 from openquake.baselib.general import AccumDict
@@ -94,16 +92,13 @@ class ScenarioRiskCalculator(base.RiskCalculator):
             self.pre_calculator = None
         base.RiskCalculator.pre_execute(self)
 
-        logging.info('Building the epsilons')
-        if self.oqparam.ignore_covs:
-            eps = None
-        else:
-            eps = self.make_eps(self.oqparam.number_of_ground_motion_fields)
-        self.datastore['etags'], gmfs = calc.get_gmfs(
-            self.datastore, self.precalc)
+        eps = self.make_eps(self.oqparam.number_of_ground_motion_fields)
+        etags, gmfs = calc.get_gmfs(self.datastore, self.precalc)
+        self.datastore['etags'] = etags
         hazard_by_rlz = {rlz: gmfs[rlz.ordinal]
                          for rlz in self.rlzs_assoc.realizations}
-        self.riskinputs = self.build_riskinputs(hazard_by_rlz, eps)
+        self.riskinputs = self.build_riskinputs(
+            hazard_by_rlz, eps, num_events=len(etags))
 
     def post_execute(self, result):
         """
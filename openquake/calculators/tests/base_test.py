@@ -16,8 +16,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import pickle
+import tempfile
 import unittest
 import mock
+import numpy
+from openquake.baselib import hdf5
+from openquake.baselib.performance import Monitor
 from openquake.calculators import base
 
 
@@ -50,6 +56,60 @@ class BaseCalculatorTestCase(unittest.TestCase):
         self.assertEqual(critical.call_count, 1)
 
 
+@base.track_memory
+def fake_task(array, monitor):
+    return {'total': array.sum()}
+
+
+class TrackMemoryTestCase(unittest.TestCase):
+    def test_task_memory(self):
+        array = numpy.ones(1000)
+        res = fake_task(array, None)
+        self.assertEqual(res['total'], 1000)
+        peak, argsizes, nbytes, cache_bytes = res['task_memory']
+        self.assertGreater(peak, array.nbytes)
+        [(name, size)] = argsizes  # the monitor is not considered
+        self.assertEqual(name, 'ndarray')
+        self.assertEqual(size, array.nbytes)  # estimated, not pickled
+        self.assertGreater(nbytes, 0)
+        self.assertEqual(cache_bytes, 0)
+
+
+def double(x, monitor):
+    return x * 2
+double.shared_dir_on = False
+
+
+class TimedTaskTestCase(unittest.TestCase):
+    def test_attributes(self):
+        task = base.TimedTask(double)
+        self.assertEqual(task.__name__, 'double')
+        self.assertEqual(task.__module__, __name__)
+        self.assertFalse(task.shared_dir_on)
+        task = pickle.loads(pickle.dumps(task))
+        self.assertEqual(task.__name__, 'double')
+        self.assertEqual(task(1, None)[0], 2)
+
+
+class StarmapTestCase(unittest.TestCase):
+    def test_task_timeline(self):
+        fh, path = tempfile.mkstemp(suffix='.hdf5')
+        os.close(fh)
+        self.addCleanup(os.remove, path)
+        hdf5.File(path, 'w').close()
+        monitor = Monitor()
+        monitor.hdf5path = path
+        res = base.Starmap(double, [(1, monitor), (2, monitor)]).reduce(
+            acc=0)
+        self.assertEqual(res, 6)
+        with hdf5.File(path, 'r') as f:
+            array = f['task_timeline'].value
+        self.assertEqual(sorted(array['taskno']), [1, 2])
+        self.assertEqual(set(array['task']), {b'double'})
+        self.assertTrue((array['start'] <= array['stop']).all())
+        self.assertTrue((array['stop'] <= array['received']).all())
+
+
 class CheckHazardRiskConsistencyTestCase(unittest.TestCase):
     def test_ok(self):
         base.check_precalc_consistency('scenario_risk', 'scenario')
@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
+import numpy
 from nose.plugins.attrib import attr
 from openquake.baselib import parallel
 from openquake.baselib.python3compat import decode
@@ -56,6 +57,15 @@ class ClassicalTestCase(CalculatorTestCase):
         # there is a single source
         self.assertEqual(len(self.calc.datastore['source_info']), 1)
 
+    @attr('qa', 'hazard', 'classical')
+    def test_case_1_reduced_precision(self):
+        for precision in ('float32', 'log'):
+            self.assert_curves_ok(
+                ['hazard_curve-smltp_b1-gsimltp_b1.csv'],
+                case_1.__file__, delta=1E-6, pmap_precision=precision)
+            poes = self.calc.datastore.getitem('poes/0000')
+            self.assertEqual(poes.dtype, 'float32')
+
     @attr('qa', 'hazard', 'classical')
     def test_wrong_smlt(self):
         with self.assertRaises(InvalidFile):
@@ -164,6 +174,68 @@ class ClassicalTestCase(CalculatorTestCase):
         self.assertEqualFiles('expected/hazard_map-mean2.csv', fname,
                               delta=1E-5)
 
+    @attr('qa', 'hazard', 'classical')
+    def test_case_13_reweight(self):
+        # the realizations are (aFault, BA2008), (aFault, CY2008),
+        # (bFault, BA2008), (bFault, CY2008)
+        self.run_calc(case_13.__file__, 'job.ini', individual_curves='true')
+        parent = self.calc.datastore
+        ba2008 = [parent.getitem('hcurves/rlz-%03d' % r).value
+                  for r in (0, 2)]
+
+        # recombine the stored PoEs by discarding the branch CY2008
+        self.run_calc(case_13.__file__, 'job_reweight.ini',
+                      hazard_calculation_id=str(parent.calc_id))
+        dstore = self.calc.datastore
+        self.assertEqual(len(dstore['realizations']), 2)
+        for r in (0, 1):
+            numpy.testing.assert_allclose(
+                dstore.getitem('hcurves/rlz-%03d' % r).value, ba2008[r],
+                rtol=1E-6)
+        numpy.testing.assert_allclose(
+            dstore.getitem('hcurves/mean').value,
+            (ba2008[0] + ba2008[1]) / 2, rtol=1E-5)
+
+    @attr('qa', 'hazard', 'classical')
+    def test_case_13_selection(self):
+        # the realizations are (aFault, BA2008), (aFault, CY2008),
+        # (bFault, BA2008), (bFault, CY2008)
+        self.run_calc(case_13.__file__, 'job.ini', individual_curves='true')
+        full = self.calc.datastore
+        expected = [full.getitem('hcurves/rlz-%03d' % r).value
+                    for r in (2, 3)]
+
+        # select the realizations of bFault, by uid and by ordinal
+        selection = 'bFault_stitched_D2.1_Char~BooreAtkinson2008 3'
+        self.run_calc(case_13.__file__, 'job.ini', individual_curves='true',
+                      selected_realizations=selection)
+        dstore = self.calc.datastore
+        csm_info = dstore['csm_info']
+        self.assertEqual(len(csm_info.source_models), 1)
+        self.assertEqual(csm_info.source_models[0].name,
+                         'bFault_stitched_D2.1_Char.xml')
+        self.assertEqual(len(dstore['realizations']), 2)
+        for r in (0, 1):
+            numpy.testing.assert_allclose(
+                dstore.getitem('hcurves/rlz-%03d' % r).value, expected[r],
+                rtol=1E-6)
+
+        # a realization selected twice, by uid and by ordinal
+        selection = 'bFault_stitched_D2.1_Char~BooreAtkinson2008 2'
+        self.run_calc(case_13.__file__, 'job.ini', individual_curves='true',
+                      selected_realizations=selection)
+        [sm] = self.calc.csm.info.source_models
+        self.assertEqual(sm.num_gsim_paths, 1)
+        self.assertEqual(len(self.calc.datastore['realizations']), 1)
+
+        # select a single realization: only one GSIM is computed
+        self.run_calc(case_13.__file__, 'job.ini',
+                      selected_realizations='1')
+        gsims_by_grp_id = self.calc.rlzs_assoc.gsims_by_grp_id
+        self.assertEqual([list(map(str, gsims))
+                          for gsims in gsims_by_grp_id.values()],
+                         [['ChiouYoungs2008()']])
+
     @attr('qa', 'hazard', 'classical')
     def test_case_14(self):
         self.assert_curves_ok([
@@ -15,6 +15,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+import json
 import unittest
 from nose.plugins.attrib import attr
 
@@ -165,6 +166,17 @@ class EventBasedRiskTestCase(CalculatorTestCase):
         fname = writetmp(view('ruptures_events', self.calc.datastore))
         self.assertEqualFiles('expected/ruptures_events.txt', fname)
 
+        # check the memory information about the tasks
+        tbl = view('task_memory', self.calc.datastore)
+        self.assertIn('event_based_risk#1', tbl)
+        self.assertIn('RiskInputFromRuptures:', tbl)
+
+        # check the timeline of the tasks and of the controller phases
+        trace = json.loads(view('task_timeline', self.calc.datastore))
+        names = set(ev['name'] for ev in trace['traceEvents'])
+        self.assertIn('execute', names)
+        self.assertIn('event_based_risk#1#1', names)
+
         # export a specific eid
         fnames = export(('all_loss_ratios:17179869184', 'csv'),
                         self.calc.datastore)
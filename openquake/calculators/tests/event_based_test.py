@@ -28,6 +28,7 @@ from openquake.baselib.general import group_array
 from openquake.commonlib.datastore import read
 from openquake.commonlib.util import max_rel_diff_index
 from openquake.calculators.export import export
+from openquake.calculators.views import view
 from openquake.calculators.event_based import get_mean_curves
 from openquake.calculators.tests import CalculatorTestCase
 from openquake.qa_tests_data.event_based import (
@@ -214,6 +215,10 @@ gmf-smltp_b3-gsimltp_@_@_@_b4_1.txt'''.split()
         [fname] = export(('ruptures', 'csv'), self.calc.datastore)
         self.assertEqualFiles('expected/ruptures.csv', fname)
 
+        # the size of the GMF cache is reported in the task memory info
+        tbl = view('task_memory:compute_gmfs_and_curves', self.calc.datastore)
+        self.assertIn('cache_mb', tbl)
+
     @attr('qa', 'hazard', 'event_based')
     def test_case_6(self):
         # 2 models x 3 GMPEs, different weights
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2017 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import numpy
+from openquake.calculators.extract import parse_selection, _filter_eids
+
+
+class FilterEidsTestCase(unittest.TestCase):
+    # a table with an eid field, read in blocks of 3 rows
+    table = numpy.array([(eid, eid / 10.) for eid in range(10)],
+                        [('eid', numpy.uint64), ('loss', numpy.float32)])
+
+    def filter(self, eids):
+        kw = parse_selection(dict(eids=eids))
+        return _filter_eids(self.table, kw['eids'], blocksize=3)
+
+    def test_range(self):
+        self.assertEqual(list(self.filter('4:7')['eid']), [4, 5, 6])
+        self.assertEqual(list(self.filter('8:')['eid']), [8, 9])
+
+    def test_comma_separated(self):
+        self.assertEqual(list(self.filter('7,1,5')['eid']), [1, 5, 7])
+        self.assertEqual(len(self.filter('20')), 0)
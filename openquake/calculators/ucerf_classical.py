@@ -25,7 +25,6 @@ import numpy
 import h5py
 
 from openquake.baselib.general import DictArray, AccumDict
-from openquake.baselib import parallel
 from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.hazardlib.calc.hazard_curve import pmap_from_grp, poe_map
 from openquake.hazardlib.calc.filters import SourceFilter
@@ -205,14 +204,14 @@ class UcerfPSHACalculator(classical.PSHACalculator):
             # parallelize on the background sources, small tasks
             args = (bckgnd_sources, self.src_filter, oq.imtls,
                     gsims, self.oqparam.truncation_level, (), monitor)
-            bg_res = parallel.Starmap.apply(
+            bg_res = base.Starmap.apply(
                 pmap_from_grp, args, name='background_sources_%d' % grp_id,
                 concurrent_tasks=ct2).submit_all()
 
             # parallelize by rupture subsets
             rup_sets = numpy.arange(ucerf_source.num_ruptures)
             taskname = 'ucerf_classical_%d' % grp_id
-            acc = parallel.Starmap.apply(
+            acc = base.Starmap.apply(
                 ucerf_classical,
                 (rup_sets, ucerf_source, self.src_filter, gsims, monitor),
                 concurrent_tasks=ct2, name=taskname
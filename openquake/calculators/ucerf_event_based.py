@@ -29,7 +29,6 @@ import numpy
 
 from openquake.baselib.general import AccumDict
 from openquake.baselib.python3compat import zip
-from openquake.baselib import parallel
 from openquake.hazardlib import nrml
 from openquake.risklib import riskinput
 from openquake.commonlib import readinput, source, calc, config, logictree
@@ -776,7 +775,7 @@ class UCERFRuptureCalculator(event_based.EventBasedRuptureCalculator):
         """
         oq = self.oqparam
         allargs = []  # it is better to return a list; if there is single
-        # branch then `parallel.Starmap` will run the task in core
+        # branch then `base.Starmap` will run the task in core
         for sm_id in range(len(csm.source_models)):
             ssm = csm.get_model(sm_id)
             mon = monitor.new(
@@ -882,6 +881,6 @@ class UCERFRiskCalculator(EbriskCalculator):
     def execute(self):
         num_rlzs = len(self.rlzs_assoc.realizations)
         self.grp_trt = self.csm.info.grp_trt()
-        allres = parallel.Starmap(compute_losses, self.gen_args()).submit_all()
+        allres = base.Starmap(compute_losses, self.gen_args()).submit_all()
         num_events = self.save_results(allres, num_rlzs)
         return num_events
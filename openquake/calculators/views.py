@@ -18,6 +18,7 @@
 from __future__ import division
 import io
 import ast
+import json
 import os.path
 import numbers
 import operator
@@ -673,3 +674,102 @@ def view_task_slowest(token, dstore):
     srcs = set(decode(s).split(':', 1)[0] for s in sources)
     return 'taskno=%d, weight=%d, duration=%d s, sources="%s"' % (
         taskno, weight, duration, ' '.join(sorted(srcs)))
+
+
+@view.add('task_memory')
+def view_task_memory(token, dstore):
+    """
+    Display the peak memory of the tasks, the estimated sizes of their
+    arguments and results and the size of their caches, in MB. Without
+    argument it displays the heaviest task of each kind, otherwise the
+    ten heaviest tasks of the given kind, for instance::
+
+      $ oq show task_memory:compute_gmfs_and_curves
+    """
+    if 'task_memory' not in dstore:
+        return 'Not available'
+    args = token.split(':')[1:]  # called as task_memory:task_name
+    if args:
+        [task] = args
+        array = dstore['task_memory/' + task].value
+        array.sort(order='peak_mb')
+        fields = ['taskno', 'peak_mb', 'args_mb', 'result_mb', 'cache_mb',
+                  'args']
+        return rst_table([tuple(rec[f] for f in fields)
+                          for rec in array[::-1][:10]], fields)
+    data = []
+    for task in dstore['task_memory']:
+        array = dstore['task_memory/' + task].value
+        rec = array[array['peak_mb'].argmax()]
+        data.append((task, rec['taskno'], rec['peak_mb'], rec['args_mb'],
+                     rec['result_mb'], rec['cache_mb'], rec['args']))
+    data.sort(key=operator.itemgetter(2), reverse=True)
+    return rst_table(data, ['task', 'taskno', 'peak_mb', 'args_mb',
+                            'result_mb', 'cache_mb', 'args'])
+
+
+def task_timeline(dstore):
+    """
+    Build a list of events in the Trace Event Format from the datasets
+    `task_timeline` and `phase_timeline`: one event for each task, one for
+    each phase of the controller and an instant event for each result
+    received by the controller. The processes are identified by host
+    and PID; the times are in microseconds from the start of the
+    calculation.
+    """
+    empty = numpy.zeros(0, [('start', float)])
+    tasks = (dstore['task_timeline'].value if 'task_timeline' in dstore
+             else empty)
+    phases = (dstore['phase_timeline'].value if 'phase_timeline' in dstore
+              else empty)
+    starts = list(tasks['start']) + list(phases['start'])
+    if not starts:
+        return []
+    t0 = min(starts)
+    events = []
+    procs = {}  # (kind, host, pid) -> process number in the trace
+
+    def proc(kind, host, pid):
+        key = kind, decode(host), int(pid)
+        if key not in procs:
+            procs[key] = len(procs)
+            events.append(dict(name='process_name', ph='M', pid=procs[key],
+                               args=dict(name='%s %s:%d' % key)))
+        return procs[key]
+
+    def usec(t):
+        return int(round((t - t0) * 1E6))
+
+    controller = proc('controller', b'', 0) if len(phases) == 0 else None
+    for rec in phases:
+        controller = proc('controller', rec['host'], rec['pid'])
+        events.append(dict(name=decode(rec['phase']), cat='controller',
+                           ph='X', pid=controller, tid=0,
+                           ts=usec(rec['start']),
+                           dur=usec(rec['stop']) - usec(rec['start'])))
+    for rec in tasks:
+        task = decode(rec['task'])
+        name = '%s#%d' % (task, rec['taskno'])
+        events.append(dict(name=name, cat=task, ph='X',
+                           pid=proc('worker', rec['host'], rec['pid']),
+                           tid=0, ts=usec(rec['start']),
+                           dur=usec(rec['stop']) - usec(rec['start'])))
+        events.append(dict(name='received ' + name, cat=task, ph='i',
+                           s='t', pid=controller, tid=1,
+                           ts=usec(rec['received'])))
+    return events
+
+
+@view.add('task_timeline')
+def view_task_timeline(token, dstore):
+    """
+    Display a trace in JSON format with the timeline of the tasks and of
+    the phases of the controller, which can be loaded in a trace viewer
+    (i.e. chrome://tracing or Perfetto)::
+
+      $ oq show task_timeline <calc_id> > trace.json
+    """
+    events = task_timeline(dstore)
+    if not events:
+        return 'Not available'
+    return json.dumps(dict(traceEvents=events, displayTimeUnit='ms'))
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2015-2017 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+
+# the functions decorated with sap.Script are the subcommands
+SCRIPT = re.compile(r'^@sap\.Script\s*\ndef (\w+)', re.M)
+
+
+def subcommands():
+    """
+    :returns: a dictionary subcommand name -> module name, built by reading
+              the sources of the modules in openquake.commands, without
+              importing them
+    """
+    dirname = os.path.dirname(__file__)
+    dic = {}
+    for mod in os.listdir(dirname):
+        if mod.endswith('.py') and not mod.startswith('_'):
+            with open(os.path.join(dirname, mod)) as f:
+                for name in SCRIPT.findall(f.read()):
+                    dic[name] = 'openquake.commands.' + mod[:-3]
+    return dic
@@ -23,7 +23,7 @@ import importlib
 
 from openquake.baselib import sap
 from openquake.commonlib import __version__
-from openquake import commands
+from openquake.commands import subcommands
 from openquake.commonlib import config
 
 USE_CELERY = config.flag_set('celery', 'use_celery')
@@ -39,9 +39,12 @@ if USE_CELERY and 'run' in sys.argv:
 
 
 def oq():
-    modnames = ['openquake.commands.%s' % mod[:-3]
-                for mod in os.listdir(commands.__path__[0])
-                if mod.endswith('.py') and not mod.startswith('_')]
+    cmds = subcommands()
+    if len(sys.argv) > 1 and sys.argv[1] in cmds:
+        # import only the module of the subcommand, for a fast startup
+        modnames = [cmds[sys.argv[1]]]
+    else:  # oq --help, oq --version or unknown subcommand
+        modnames = sorted(set(cmds.values()))
     for modname in modnames:
         importlib.import_module(modname)
     parser = sap.compose(sap.Script.registry.values(),
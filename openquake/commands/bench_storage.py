@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2017 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division
+import os
+import time
+import shutil
+import tempfile
+import numpy
+import h5py
+
+from openquake.baselib import sap
+from openquake.baselib.general import humansize
+from openquake.commonlib import datastore
+from openquake.calculators.views import rst_table
+
+PROFILES = ['none', 'lzf', 'lzf shuffle', 'gzip', 'gzip shuffle']
+
+
+def read_dataset(dstore, key):
+    """
+    :returns: the dataset associated to the key, read from the datastore
+              or from the .ext5 file
+    """
+    try:
+        return dstore.getitem(key).value
+    except KeyError:
+        if not os.path.exists(dstore.ext5path):
+            raise
+        with dstore.ext5() as ext5:
+            return ext5[key].value
+
+
+def bench_profile(array, profile, tmpdir, nblocks=10, nreads=100):
+    """
+    Store the array in a temporary file with the given profile, by
+    writing it in `nblocks` blocks, and read it back.
+
+    :returns: write throughput in MB/s, file size, time to read the whole
+              array and average time to read a random row, in seconds
+    """
+    fname = os.path.join(tmpdir, 'bench.hdf5')
+    shape = (None,) + array.shape[1:]
+    blocksize = max(1, -(-len(array) // nblocks))
+    t0 = time.time()
+    with h5py.File(fname, 'w') as f:
+        dset = datastore.create(f, 'dset', array.dtype, shape, profile)
+        for start in range(0, len(array), blocksize):
+            block = array[start:start + blocksize]
+            dset.resize((start + len(block),) + array.shape[1:])
+            dset[start:start + len(block)] = block
+    dt_write = time.time() - t0
+    size = os.path.getsize(fname)
+    with h5py.File(fname, 'r') as f:
+        t0 = time.time()
+        f['dset'].value
+        dt_read = time.time() - t0
+    rows = numpy.random.RandomState(42).randint(0, len(array), nreads)
+    with h5py.File(fname, 'r') as f:
+        dset = f['dset']
+        t0 = time.time()
+        for row in rows:
+            dset[row]
+        dt_row = (time.time() - t0) / nreads
+    os.remove(fname)
+    return array.nbytes / dt_write / 1024 ** 2, size, dt_read, dt_row
+
+
+@sap.Script
+def bench_storage(key, calc_id=-1, profiles=''):
+    """
+    Compare the write throughput, the file size and the read latency of
+    a dataset of the datastore stored with different storage profiles.
+    """
+    dstore = datastore.read(calc_id)
+    try:
+        array = read_dataset(dstore, key)
+        current = dstore.get_profile(key)
+    finally:
+        dstore.close()
+    if len(array) == 0:
+        print('%s is empty' % key)
+        return
+    texts = profiles.split(';') if profiles else PROFILES
+    # the profiles to compare, including the one used by the engine
+    pairs = [(text.strip(), datastore.storage_profile(text.strip()))
+             for text in texts] + [('current', current)]
+    tbl = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, profile in pairs:
+            mbs, size, dt_read, dt_row = bench_profile(array, profile, tmpdir)
+            tbl.append((name, '%.1f' % mbs, humansize(size),
+                        '%.4f' % dt_read, '%.3f' % (dt_row * 1000)))
+    finally:
+        shutil.rmtree(tmpdir)
+    print('%s: %d rows, %s' % (key, len(array), humansize(array.nbytes)))
+    print(rst_table(tbl, ['profile', 'write_MB/s', 'file_size',
+                          'read_all_s', 'read_row_ms']))
+
+bench_storage.arg('key', 'dataset key (gmf_data/sm-0000/0000, ...)')
+bench_storage.arg('calc_id', 'calculation ID', type=int)
+bench_storage.opt('profiles', 'profiles separated by semicolons', '-p')
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2017 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import logging
+import tempfile
+import subprocess
+import collections
+
+from openquake.baselib import sap
+from openquake.baselib.general import humansize
+from openquake.baselib.python3compat import decode
+from openquake.baselib.performance import Monitor
+from openquake.hazardlib import nrml
+from openquake.commonlib import readinput, oqvalidation, datastore
+from openquake.calculators import base, views
+from openquake.commands import subcommands
+from openquake import qa_tests_data
+
+QA_DIR = os.path.dirname(qa_tests_data.__file__)
+
+# name -> job file; the names are the directories in qa_tests_data
+BENCHMARKS = collections.OrderedDict([
+    ('classical/case_2', 'job.ini'),
+    ('event_based/case_2', 'job.ini'),
+    ('event_based/case_6', 'job.ini'),  # hazard curves from 6 realizations
+    ('scenario/case_1', 'job.ini'),
+    ('event_based_risk/case_2', 'job.ini'),
+    ('scenario_risk/case_2', 'job_risk.ini'),
+    ('scenario_damage/case_1', 'job_risk.ini'),
+])
+
+# parameters multiplied by the scale factor, when positive
+SCALED_PARAMS = ('ses_per_logic_tree_path', 'number_of_ground_motion_fields',
+                 'number_of_logic_tree_samples')
+
+# the copies of the sites and assets are shifted by this amount in degrees
+OFFSET = 0.001
+
+# operations faster than this (in seconds) are not checked for regressions
+MIN_TIME = 0.5
+
+MB = 1024. * 1024.
+
+Result = collections.namedtuple(
+    'Result', 'time memory size phase_sizes operations')
+
+
+def scale_sites(text, factor):
+    """
+    :param text: a string of coordinates `lon lat[ depth], ...`
+    :param factor: the number of copies of each site
+    :returns: a string with `factor` times more sites, slightly shifted
+
+    >>> scale_sites('1 2, 3 4 5', 2)
+    '1.0 2.0, 3.0 4.0 5, 1.0 2.001, 3.0 4.001 5'
+    """
+    points = [point.split() for point in text.split(',')]
+    out = []
+    for k in range(factor):
+        for point in points:
+            lon, lat = float(point[0]), float(point[1]) + k * OFFSET
+            out.append(' '.join([repr(lon), repr(round(lat, 6))] + point[2:]))
+    return ', '.join(out)
+
+
+def scale_exposure(fname, factor, tmpdir):
+    """
+    Write in `tmpdir` a copy of the exposure in `fname` with `factor`
+    times more assets, slightly shifted.
+
+    :returns: the path of the new exposure file
+    """
+    node = nrml.read(fname)
+    model = node[0]
+    assets = list(model.assets)
+    for k in range(1, factor):
+        for asset in assets:
+            new = copy.deepcopy(asset)
+            new['id'] = '%s_%d' % (asset['id'], k)
+            new.location['lat'] = round(
+                float(asset.location['lat']) + k * OFFSET, 6)
+            model.assets.append(new)
+    dest = os.path.join(tmpdir, os.path.basename(fname))
+    with open(dest, 'wb') as f:
+        nrml.write([model], f, xmlns=node['xmlns'])
+    return dest
+
+
+def scale_params(params, factor, tmpdir):
+    """
+    Scale up the sites, the assets, the number of SES, GMFs and
+    realizations of the given job parameters. When the GMFs are read
+    from a file the sites and the number of GMFs are not scaled.
+
+    :param params: a dictionary of parameters as returned by get_params
+    :param factor: the scale factor (a positive integer)
+    :param tmpdir: the directory where to store the scaled input files
+    :returns: a new dictionary of parameters
+    """
+    params = copy.deepcopy(params)
+    if factor == 1:
+        return params
+    # the GMFs read from a file fix the number of sites and GMFs
+    gmfs_file = 'gmfs' in params['inputs']
+    for name in SCALED_PARAMS:
+        if gmfs_file and name == 'number_of_ground_motion_fields':
+            continue
+        if int(params.get(name, 0)) > 0:
+            params[name] = str(int(params[name]) * factor)
+    if params.get('sites') and not gmfs_file:
+        params['sites'] = scale_sites(params['sites'], factor)
+    if 'exposure' in params['inputs']:
+        params['inputs']['exposure'] = scale_exposure(
+            params['inputs']['exposure'], factor, tmpdir)
+    return params
+
+
+def run_benchmark(name, factor, concurrent_tasks=None):
+    """
+    Run the scaled up variant of a QA test and collect the performance
+    information from its monitors.
+
+    :param name: the name of a benchmark, i.e. a key of BENCHMARKS
+    :param factor: the scale factor
+    :param concurrent_tasks: if 0, run without distribution
+    :returns: a Result instance
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        job_ini = os.path.join(QA_DIR, name, BENCHMARKS[name])
+        params = scale_params(readinput.get_params([job_ini]), factor, tmpdir)
+        oqvalidation.OqParam.calculation_mode.validator.choices = tuple(
+            base.calculators)
+        oq = oqvalidation.OqParam(**params)
+        oq.validate()
+        monitor = Monitor('complete runtime', measuremem=True)
+        calc = base.calculators(oq, monitor)
+        with monitor:
+            calc.run(concurrent_tasks=concurrent_tasks)
+        monitor.flush()
+    finally:
+        shutil.rmtree(tmpdir)
+    dstore = datastore.read(calc.datastore.calc_id)
+    try:
+        perf = views.performance_view(dstore)
+        size = dstore.getsize()
+        # size in bytes of the datastore at the end of each phase
+        phase_sizes = collections.OrderedDict(
+            (decode(rec['phase']), int(rec['size_mb'] * MB))
+            for rec in dstore['phase_timeline'])
+    finally:
+        dstore.close()
+    operations = {decode(op): (float(secs), float(mem))
+                  for op, secs, mem, _counts in perf}
+    memory = max(mem for _time, mem in operations.values())
+    return Result(monitor.duration, memory, size, phase_sizes, operations)
+
+
+def compare(name, result, baseline, tolerance):
+    """
+    Compare the result of a benchmark with the baseline.
+
+    :param name: the name of the benchmark
+    :param result: a Result instance
+    :param baseline: a dictionary with keys time, memory, size, operations
+    :param tolerance: the allowed relative increase
+    :returns: a list of regression messages
+    """
+    msgs = []
+    for metric in ('time', 'memory', 'size'):
+        old, new = baseline[metric], getattr(result, metric)
+        if new > old * (1 + tolerance) and new > 0:
+            msgs.append('%s: %s %.2f -> %.2f' % (name, metric, old, new))
+    for phase, new in result.phase_sizes.items():
+        old = baseline.get('phase_sizes', {}).get(phase)
+        if old is not None and new > old * (1 + tolerance):
+            msgs.append('%s: size after %s %s -> %s' % (
+                name, phase, humansize(old), humansize(new)))
+    for op, (secs, _mem) in sorted(result.operations.items()):
+        if op in baseline['operations'] and secs > MIN_TIME:
+            old = baseline['operations'][op][0]
+            if secs > old * (1 + tolerance):
+                msgs.append('%s: %r %.2fs -> %.2fs' % (name, op, old, secs))
+    return msgs
+
+
+def startup_time(cmd, nruns=3):
+    """
+    :param cmd: the name of a subcommand
+    :param nruns: the number of runs
+    :returns: the minimum time in seconds spent by `oq <cmd> --help`
+    """
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(nruns):
+            t0 = time.time()
+            subprocess.call([sys.executable, '-m', 'openquake.commands',
+                             cmd, '--help'], stdout=devnull, stderr=devnull)
+            times.append(time.time() - t0)
+    return min(times)
+
+
+@sap.Script
+def benchmark(names, scale=2, baseline='', save=False, tolerance=0.2,
+              no_distribute=False, available=False, startup=False):
+    """
+    Run scaled up variants of the QA tests, measuring wall time, peak
+    memory and datastore size, and compare them with a stored baseline.
+    With --startup, measure the startup time of the oq subcommands instead.
+    """
+    if available:
+        for name in BENCHMARKS:
+            print(name)
+        return
+    elif startup:
+        cmds = names or sorted(subcommands())
+        print(views.rst_table([(cmd, '%.2f' % startup_time(cmd))
+                               for cmd in cmds], ['subcommand', 'time_s']))
+        return
+    names = names or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        sys.exit('Unknown benchmark(s): %s' % ', '.join(sorted(unknown)))
+    if save and not baseline:
+        sys.exit('Please specify the baseline file with --baseline')
+    old = {}
+    if baseline and not save:
+        with open(baseline) as f:
+            old = json.load(f)
+    results = collections.OrderedDict()
+    rows = []
+    regressions = []
+    for name in names:
+        logging.info('Running benchmark %s x%d', name, scale)
+        res = results[name] = run_benchmark(
+            name, scale, 0 if no_distribute else None)
+        rows.append((name, '%.2f' % res.time, '%.1f' % res.memory,
+                     humansize(res.size)))
+        for phase, size in res.phase_sizes.items():
+            logging.info('Datastore size after %s: %s',
+                         phase, humansize(size))
+        if name in old:
+            regressions.extend(compare(name, res, old[name], tolerance))
+    print(views.rst_table(rows, ['benchmark', 'time_s', 'peak_memory_mb',
+                                 'datastore_size']))
+    if save:
+        with open(baseline, 'w') as f:
+            json.dump({name: res._asdict() for name, res in results.items()},
+                      f, indent=2, sort_keys=True)
+        print('Saved the baseline in %s' % baseline)
+    elif regressions:
+        sys.exit('Found %d regression(s):\n%s' % (
+            len(regressions), '\n'.join(regressions)))
+    elif old:
+        print('No regressions with respect to %s' % baseline)
+
+benchmark.arg('names', 'benchmarks to run (all by default)', nargs='*')
+benchmark.opt('scale', 'scale factor for sites, assets, SES, GMFs and '
+              'realizations', '-s', type=int)
+benchmark.opt('baseline', 'JSON file with the baseline measures', '-b')
+benchmark.flg('save', 'save the measures as the new baseline', '-S')
+benchmark.opt('tolerance', 'allowed relative increase', '-t', type=float)
+benchmark.flg('no_distribute', 'run without parallelization', '-n')
+benchmark.flg('available', 'list the available benchmarks', '-a')
+benchmark.flg('startup', 'measure the startup time of the subcommands', '-u')
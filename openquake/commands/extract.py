@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2017 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import numpy
+
+from openquake.baselib import general, performance, sap
+from openquake.commonlib import datastore
+from openquake.calculators.export import export
+from openquake.calculators.extract import extract as extract_, parse_selection
+
+
+@sap.Script
+def extract(what, calc_id=-1, sids='', aids='', eids='', rlz='', kind='',
+            compare='', export_dir='.'):
+    """
+    Extract a slice of a datastore array and save it in .npy format;
+    optionally compare the performance with the full export.
+    """
+    dstore = datastore.read(calc_id)
+    kw = parse_selection(dict(sids=sids, aids=aids, eids=eids, rlz=rlz,
+                              kind=kind))
+    with performance.Monitor('extract', measuremem=True) as mon:
+        array = extract_(what, dstore, **kw)
+    fname = os.path.join(os.path.abspath(export_dir),
+                         '%s-%s.npy' % (what, dstore.calc_id))
+    numpy.save(fname, array)
+    print('Extracted %d rows (%s) in %s' % (
+        len(array), general.humansize(array.nbytes), fname))
+    print(mon)
+    if compare:  # time the full export in the given format
+        dstore.export_dir = tempfile.mkdtemp()
+        try:
+            with performance.Monitor('export', measuremem=True) as mon:
+                fnames = export((what, compare), dstore)
+            nbytes = sum(os.path.getsize(f) for f in fnames)
+            print('Exported %s in %d file(s)' % (
+                general.humansize(nbytes), len(fnames)))
+            print(mon)
+        finally:
+            shutil.rmtree(dstore.export_dir)
+    dstore.close()
+
+
+extract.arg('what', 'extractor name (hcurves, gmf_data, ...)')
+extract.arg('calc_id', 'number of the calculation', type=int)
+extract.opt('sids', 'site IDs (comma separated or start:stop)')
+extract.opt('aids', 'asset ordinals (comma separated or start:stop)')
+extract.opt('eids', 'event IDs (comma separated or start:stop)')
+extract.opt('rlz', 'realization ordinal')
+extract.opt('kind', 'mean, quantile-XXX or rlz-XXX')
+extract.opt('compare', 'export format to compare the performance with')
+extract.opt('export_dir', 'export directory', '-d')
@@ -39,6 +39,10 @@ def reset(yes):
 
     if config.flag_set('dbserver', 'multi_user'):
         purge_all()  # remove data of the current user only
+        cachedir = os.path.join(datastore.DATADIR, 'split_cache')
+        if os.path.exists(cachedir):
+            shutil.rmtree(cachedir)  # split sources of the current user
+            print('Removed %s' % cachedir)
         return
 
     # else: fast way of removing everything
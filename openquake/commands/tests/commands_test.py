@@ -22,25 +22,32 @@ import mock
 import shutil
 import tempfile
 import unittest
+import numpy
 import shapefile
 
 from openquake.baselib.python3compat import encode
 from openquake.baselib.general import writetmp
 from openquake import commonlib
+from openquake.commonlib import readinput
 from openquake.commands.info import info
 from openquake.commands.tidy import tidy
 from openquake.commands.show import show
 from openquake.commands.show_attrs import show_attrs
 from openquake.commands.export import export
+from openquake.commands.extract import extract
+from openquake.commands.bench_storage import bench_storage
+from openquake.commands import benchmark
 from openquake.commands.reduce import reduce
 from openquake.commands.db import db
 from openquake.commands.to_shapefile import to_shapefile
 from openquake.commands.from_shapefile import from_shapefile
 from openquake.commands import run
+from openquake.commands import subcommands
 from openquake.commands.upgrade_nrml import get_vulnerability_functions_04
 from openquake.qa_tests_data.classical import case_1
 from openquake.qa_tests_data.classical_risk import case_3
 from openquake.qa_tests_data.scenario import case_4
+from openquake.qa_tests_data import scenario_damage
 from openquake.qa_tests_data.event_based import case_5
 from openquake.server import manage, dbapi
 
@@ -219,6 +226,75 @@ class RunShowExportTestCase(unittest.TestCase):
         self.assertIn(str(fname), str(p))
         shutil.rmtree(tempdir)
 
+    def test_extract_calc(self):
+        tempdir = tempfile.mkdtemp()
+        with Print.patch() as p:
+            extract('hcurves', self.calc_id, sids='0', kind='rlz-000',
+                    compare='csv', export_dir=tempdir)
+        self.assertIn('Extracted 1 rows', str(p))
+        self.assertIn('Exported', str(p))
+        [fname] = os.listdir(tempdir)
+        array = numpy.load(os.path.join(tempdir, fname))
+        self.assertEqual(array['sid'].tolist(), [0])
+        shutil.rmtree(tempdir)
+
+    def test_bench_storage(self):
+        with Print.patch() as p:
+            bench_storage('hcurves/rlz-000', self.calc_id,
+                          profiles='none;gzip shuffle 2')
+        self.assertIn('hcurves/rlz-000: ', str(p))
+        self.assertIn('gzip shuffle 2', str(p))
+        self.assertIn('current', str(p))
+
+
+class SubcommandsTestCase(unittest.TestCase):
+    def test_registry(self):
+        cmds = subcommands()
+        self.assertEqual(cmds['run'], 'openquake.commands.run')
+        # the name of the subcommand can differ from the module name
+        self.assertEqual(cmds['plot_ac'], 'openquake.commands.plot_agg_curve')
+        self.assertNotIn('plot_agg_curve', cmds)
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test_list(self):
+        with Print.patch() as p:
+            benchmark.benchmark([], available=True)
+        self.assertIn('scenario_damage/case_1', str(p))
+
+    def test_scale_params(self):
+        job_ini = os.path.join(os.path.dirname(case_4.__file__), 'job.ini')
+        params = readinput.get_params([job_ini])
+        tempdir = tempfile.mkdtemp()
+        scaled = benchmark.scale_params(params, 3, tempdir)
+        shutil.rmtree(tempdir)
+        ngmfs = int(params['number_of_ground_motion_fields'])
+        self.assertEqual(int(scaled['number_of_ground_motion_fields']),
+                         ngmfs * 3)
+
+    def test_scale_params_gmfs_file(self):
+        # the sites and the GMFs are fixed by the gmfs file
+        job_ini = os.path.join(os.path.dirname(scenario_damage.__file__),
+                               'case_1', 'job_risk.ini')
+        params = readinput.get_params([job_ini])
+        tempdir = tempfile.mkdtemp()
+        scaled = benchmark.scale_params(params, 2, tempdir)
+        shutil.rmtree(tempdir)
+        self.assertEqual(scaled['sites'], params['sites'])
+        self.assertEqual(scaled['number_of_ground_motion_fields'],
+                         params['number_of_ground_motion_fields'])
+
+    def test_compare(self):
+        old = dict(time=10, memory=100, size=1000,
+                   phase_sizes={'execute': 1000},
+                   operations={'computing gmfs': [5, 100]})
+        new = benchmark.Result(11, 200, 1000, {'execute': 2000},
+                               {'computing gmfs': (7, 200)})
+        msgs = benchmark.compare('case', new, old, tolerance=0.2)
+        self.assertEqual(msgs, ['case: memory 100.00 -> 200.00',
+                                'case: size after execute 1000 B -> 1.95 KB',
+                                "case: 'computing gmfs' 5.00s -> 7.00s"])
+
 
 class ReduceTestCase(unittest.TestCase):
     TESTDIR = os.path.dirname(case_3.__file__)
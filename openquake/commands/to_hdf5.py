@@ -1,6 +1,11 @@
 from __future__ import print_function
+import time
 import numpy
 from openquake.baselib import sap, hdf5
+from openquake.baselib.performance import Monitor
+from openquake.hazardlib.sourceconverter import SourceConverter
+from openquake.commonlib import readinput, sourcehdf5
+from openquake.calculators.views import rst_table
 
 
 def convert_npz_hdf5(input_file, output_file):
@@ -11,14 +16,47 @@ def convert_npz_hdf5(input_file, output_file):
     return output_file
 
 
+def bench_loading(fnames, nruns=3):
+    """
+    Measure the time spent in reading and converting the same source
+    model in XML and in HDF5 format, with the default parameters.
+
+    :param fnames: the paths of the source models, in any format
+    :param nruns: the number of runs (the minimum time is returned)
+    :returns: a list of pairs (fname, time in seconds)
+    """
+    # investigation_time, rupture_mesh_spacing, complex_fault_mesh_spacing,
+    # width_of_mfd_bin, area_source_discretization
+    converter = SourceConverter(50., 5., 10., 0.1, 10.)
+    pairs = []
+    for fname in fnames:
+        times = []
+        for _ in range(nruns):
+            t0 = time.time()
+            readinput.parse_source_model(fname, converter, Monitor())
+            times.append(time.time() - t0)
+        pairs.append((fname, min(times)))
+    return pairs
+
+
 @sap.Script
-def to_hdf5(input):
+def to_hdf5(input, bench=False):
     """
-    Convert .npz files to .hdf5 files.
+    Convert .npz files and .xml source models to .hdf5 files.
     """
     for input_file in input:
         if input_file.endswith('.npz'):
             output = convert_npz_hdf5(input_file, input_file[:-3] + 'hdf5')
             print('Generated %s' % output)
+        elif input_file.endswith('.xml'):
+            output = sourcehdf5.convert_xml_hdf5(
+                input_file, input_file[:-3] + 'hdf5')
+            print('Generated %s' % output)
+            if bench:
+                print(rst_table(
+                    [(fname, '%.3f' % secs) for fname, secs in
+                     bench_loading([input_file, output])],
+                    ['source_model', 'loading_time_s']))
 
-to_hdf5.arg('input', '.npz file to convert', nargs='*')
+to_hdf5.arg('input', '.npz file or .xml source model to convert', nargs='*')
+to_hdf5.flg('bench', 'compare the loading times of the source models', '-b')
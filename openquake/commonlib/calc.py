@@ -22,13 +22,14 @@ import numpy
 
 from openquake.baselib import hdf5
 from openquake.baselib.python3compat import encode, decode
-from openquake.baselib.general import get_array, group_array
 from openquake.hazardlib.geo.mesh import RectangularMesh, build_array
 from openquake.hazardlib.gsim.base import ContextMaker
 from openquake.hazardlib.imt import from_string
 from openquake.hazardlib import geo, tom, calc
 from openquake.hazardlib.geo.point import Point
-from openquake.hazardlib.probability_map import ProbabilityMap, get_shape
+from openquake.hazardlib.probability_map import (
+    ProbabilityMap, ProbabilityCurve, get_shape)
+from openquake.risklib.riskinput import gmv_dt
 from openquake.commonlib import readinput, util
 
 
@@ -45,6 +46,8 @@ F64 = numpy.float64
 
 event_dt = numpy.dtype([('eid', U64), ('ses', U32), ('occ', U32),
                         ('sample', U32)])
+# used in the sparse GMFs of the scenario calculators
+gmv_eid_dt = numpy.dtype([('gmv', F32), ('eid', U64)])
 stored_event_dt = numpy.dtype([
     ('eid', U64), ('rupserial', U32), ('year', U32),
     ('ses', U32), ('occ', U32), ('sample', U32), ('grp_id', U16)])
@@ -57,19 +60,107 @@ def combine_pmaps(rlzs_assoc, results):
     """
     :param rlzs_assoc: a :class:`openquake.commonlib.source.RlzsAssoc` instance
     :param results: dictionary src_group_id -> probability map
-    :returns: a dictionary rlz -> aggregate probability map
+    :returns: a dictionary rlz ordinal -> aggregate probability map
     """
     num_levels = get_shape(results.values())[1]
-    acc = {rlz: ProbabilityMap(num_levels, 1)
-           for rlz in rlzs_assoc.realizations}
+    acc = {rlzi: ProbabilityMap(num_levels, 1)
+           for rlzi in rlzs_assoc.rlzis.tolist()}
     for grp_id in results:
         for i, gsim in enumerate(rlzs_assoc.gsims_by_grp_id[grp_id]):
             pmap = results[grp_id].extract(i)
-            for rlz in rlzs_assoc.rlzs_assoc[grp_id, gsim]:
-                if rlz in acc:
-                    acc[rlz] |= pmap
+            for rlzi in rlzs_assoc[grp_id, gsim].tolist():
+                if rlzi in acc:
+                    acc[rlzi] |= pmap
     return acc
 
+
+def convert_pmap(pmap, precision):
+    """
+    Convert a probability map to the given precision.
+
+    :param pmap: a ProbabilityMap with 64 bit PoEs
+    :param precision: 'float64', 'float32' or 'log', i.e. log(1-PoE) stored
+                      as 32 bit floats, which does not lose small PoEs
+    :returns: a new ProbabilityMap, or the original one for 'float64'
+    """
+    if precision == 'float64':
+        return pmap
+    new = ProbabilityMap(pmap.shape_y, pmap.shape_z)
+    for sid in pmap:
+        array = pmap[sid].array
+        if precision == 'log':
+            array = numpy.log1p(-array)
+        new[sid] = ProbabilityCurve(F32(array))
+    return new
+
+
+def update_pmap(acc, pmap, precision):
+    """
+    Compose a probability map with an accumulator, in place.
+
+    :param acc: a ProbabilityMap already converted to the precision
+    :param pmap: a ProbabilityMap with 64 bit PoEs
+    :param precision: 'float64', 'float32' or 'log'
+    :returns: the updated accumulator
+    """
+    if precision == 'float64':
+        acc |= pmap
+        return acc
+    pmap = convert_pmap(pmap, precision)
+    for sid in pmap:
+        if sid not in acc:
+            acc[sid] = pmap[sid]
+        elif precision == 'log':
+            # the composition of independent PoEs is a sum in log(1-PoE)
+            acc[sid].array += pmap[sid].array
+        else:  # compose in place, to keep the 32 bit floats
+            array = acc[sid].array
+            array[:] = 1. - (1. - array) * (1. - pmap[sid].array)
+    return acc
+
+
+def restore_pmap(pmap, precision):
+    """
+    Convert a probability map stored in 'log' precision back to PoEs.
+
+    :param pmap: a ProbabilityMap
+    :param precision: 'float64', 'float32' or 'log'
+    :returns: a ProbabilityMap containing PoEs
+    """
+    if precision != 'log':
+        return pmap
+    new = ProbabilityMap(pmap.shape_y, pmap.shape_z)
+    for sid in pmap:
+        new[sid] = ProbabilityCurve(-numpy.expm1(pmap[sid].array))
+    return new
+
+
+def select_gsims(pmap, idxs):
+    """
+    Extract from a probability map the columns of the given GSIMs.
+
+    :param pmap: a ProbabilityMap of shape (L, G)
+    :param idxs: a list of G' indices in the range 0 .. G - 1
+    :returns: a new ProbabilityMap of shape (L, G')
+    """
+    new = ProbabilityMap(pmap.shape_y, len(idxs))
+    for sid in pmap:
+        new[sid] = ProbabilityCurve(pmap[sid].array[:, idxs])
+    return new
+
+
+def pmap_to_array(pmap, dtype):
+    """
+    :param pmap: a non-empty ProbabilityMap
+    :param dtype: the dtype of the array (F32 for the reduced precisions)
+    :returns: an array of shape (N, L, G) and the corresponding site IDs
+    """
+    sids = numpy.array(sorted(pmap), U32)
+    array = numpy.zeros((len(sids), pmap.shape_y, pmap.shape_z), dtype)
+    for i, sid in enumerate(sids):
+        array[i] = pmap[sid].array
+    return array, sids
+
 # ######################### hazard maps ################################### #
 
 # cutoff value for the poe
@@ -177,6 +268,43 @@ def _gmvs_to_haz_curve(gmvs, imls, invest_time, duration):
     return poes
 
 
+def gmvs_to_poes(idxs, gmvs, imls, num_sites, invest_time, duration):
+    """
+    Vectorized version of :func:`_gmvs_to_haz_curve`, converting the ground
+    motion values of many sites at once. Each value is associated to the
+    number of levels it reaches with a binary search, then the values are
+    counted per site and per number of levels: the number of values
+    exceeding the k-th level is the number of values reaching more than
+    k levels.
+
+    :param idxs: an array of site indices in the range 0..num_sites-1
+    :param gmvs: an array of ground motion values, one per site index
+    :param imls: a list of intensity measure levels
+    :param num_sites: the number of sites
+    :param invest_time: investigation time, in years
+    :param duration: investigation time multiplied by the number of SES
+    :returns: an array of PoEs of shape (num_sites, num_levels)
+
+    >>> poes = gmvs_to_poes([0, 0, 1], [.1, .3, .2], [.1, .2, .3], 2, 1, 1)
+    >>> poes.round(3).tolist()
+    [[0.865, 0.632, 0.632], [0.632, 0.632, 0.0]]
+    """
+    imls = numpy.array(imls)
+    order = numpy.argsort(imls)
+    L = len(imls)
+    # number of levels reached by each value, in the range 0..L
+    levels = numpy.searchsorted(
+        imls[order], numpy.array(gmvs, F64), side='right')
+    counts = numpy.bincount(
+        numpy.array(idxs, numpy.int64) * (L + 1) + levels,
+        minlength=num_sites * (L + 1)).reshape(num_sites, L + 1)
+    # num_exceeding[:, k] = number of values reaching more than k levels
+    num_exceeding = counts[:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:]
+    poes = numpy.zeros((num_sites, L))
+    poes[:, order] = 1 - numpy.exp(- (invest_time / duration) * num_exceeding)
+    return poes
+
+
 # ################## utilities for classical calculators ################ #
 
 def get_imts_periods(imtls):
@@ -246,11 +374,59 @@ def make_uhs(pmap, imtls, poes, nsites):
     return uhs
 
 
+def build_gmv_array(gmfa, sids, min_iml):
+    """
+    Convert a dense array of ground motion values into a sparse array,
+    by discarding the values below the minimum intensity.
+
+    :param gmfa: an array of shape (I, N, E)
+    :param sids: an array of N site IDs
+    :param min_iml: an array of I minimum intensities
+    :returns: an array of dtype gmv_dt, ordered by IMT, site and event
+    """
+    imtis, idxs, eids = numpy.nonzero(gmfa > min_iml[:, None, None])
+    array = numpy.zeros(len(imtis), gmv_dt)
+    array['sid'] = sids[idxs]
+    array['eid'] = eids
+    array['imti'] = imtis
+    array['gmv'] = gmfa[imtis, idxs, eids]
+    return array
+
+
+def sparse_gmfs(gmfa, imts, num_sites, sids=None):
+    """
+    Group an array of ground motion values by IMT and site.
+
+    :param gmfa: an array of dtype gmv_dt
+    :param imts: a list of IMT strings
+    :param num_sites: the total number of sites N
+    :param sids: if not None, the set of site IDs to keep
+    :returns: a dictionary imt -> object array of N arrays (gmv, eid)
+    """
+    gmfa = gmfa[numpy.lexsort((gmfa['eid'], gmfa['sid'], gmfa['imti']))]
+    empty = numpy.zeros(0, gmv_eid_dt)
+    dic = {}
+    for imti, imt in enumerate(imts):
+        dic[imt] = arr = numpy.empty(num_sites, object)
+        for n in range(num_sites):
+            arr[n] = empty
+        data = gmfa[gmfa['imti'] == imti]
+        uniq, start = numpy.unique(data['sid'], return_index=True)
+        for sid, rows in zip(uniq, numpy.split(data, start[1:])):
+            if sids is None or sid in sids:
+                arr[sid] = gmvs = numpy.zeros(len(rows), gmv_eid_dt)
+                gmvs['gmv'] = rows['gmv']
+                gmvs['eid'] = rows['eid']
+    return dic
+
+
 def get_gmfs(dstore, precalc=None):
     """
     :param dstore: a datastore
     :param precalc: a scenario calculator with attribute .gmfa
-    :returns: a dictionary grp_id, gsid -> gmfa
+    :returns: a pair (etags, gmfs) where gmfs is a list of dictionaries
+              imt -> array of GMFs per site, one per realization;
+              the GMFs read from the datastore are sparse
     """
     oq = dstore['oqparam']
     if 'gmfs' in oq.inputs:  # from file
@@ -277,24 +453,16 @@ def get_gmfs(dstore, precalc=None):
         haz_sitecol = sitecol
     risk_indices = set(sitecol.indices)  # N'' values
     N = len(haz_sitecol.complete)
-    imt_dt = numpy.dtype([(str(imt), F32) for imt in oq.imtls])
+    imts = list(oq.imtls)
     E = oq.number_of_ground_motion_fields
     etags = numpy.array(sorted(b'scenario-%010d~ses=1' % i for i in range(E)))
-    gmfs = numpy.zeros((len(rlzs_assoc), N, E), imt_dt)
-    if precalc:
-        for i, gsim in enumerate(precalc.gsims):
-            for imti, imt in enumerate(oq.imtls):
-                gmfs[imt][i, sitecol.sids] = precalc.gmfa[gsim][imti]
-        return etags, gmfs
-
-    # else read from the datastore
+    gmfs = []
     for i, rlz in enumerate(rlzs):
-        data = group_array(dstore['gmf_data/sm-0000/%04d' % i], 'sid')
-        for sid, array in data.items():
-            if sid in risk_indices:
-                for imti, imt in enumerate(oq.imtls):
-                    a = get_array(array, imti=imti)
-                    gmfs[imt][i, sid, a['eid']] = a['gmv']
+        if precalc:
+            gmfa = precalc.gmfa[i]
+        else:  # read from the datastore
+            gmfa = dstore['gmf_data/sm-0000/%04d' % i].value
+        gmfs.append(sparse_gmfs(gmfa, imts, N, risk_indices))
     return etags, gmfs
 
 
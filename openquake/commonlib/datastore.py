@@ -37,6 +37,141 @@ if not DATADIR:
         DATADIR = os.path.join(os.path.expanduser('~'), 'oqdata')
 
 
+#: storage profile of a dataset: the HDF5 compression ('gzip', 'lzf' or
+#: None), the shuffle filter flag and the chunk shape, as a tuple of
+#: integers (the missing dimensions are taken whole) or () for the default
+StorageProfile = collections.namedtuple(
+    'StorageProfile', 'compression shuffle chunks')
+
+NOPROFILE = StorageProfile(None, False, ())
+
+#: default storage profiles, keyed by the first component of the dataset
+#: path; the chunks follow the access patterns of the calculators and
+#: of the extractors, i.e. by blocks of sites/rows for the hazard curves and
+#: the event tables, by realization and loss type for the average losses;
+#: gzip is used since lzf is available only in h5py and the datastore must
+#: be readable by any HDF5 tool
+STORAGE_PROFILES = {
+    'hcurves': 'gzip shuffle 1024',
+    'gmf_data': 'gzip shuffle 32768',
+    'all_loss_ratios': 'gzip shuffle 32768',
+    'avg_losses-rlzs': 'gzip shuffle 16384,1,1',
+}
+
+
+def storage_profile(text):
+    """
+    Convert a string into a StorageProfile; the string contains the
+    compression (none, gzip or lzf), optionally followed by the word
+    `shuffle` and by the chunk shape (comma-separated integers).
+
+    >>> storage_profile('gzip shuffle 1024,1')
+    StorageProfile(compression='gzip', shuffle=True, chunks=(1024, 1))
+    >>> storage_profile('none')
+    StorageProfile(compression=None, shuffle=False, chunks=())
+    """
+    words = text.split()
+    if not words or words[0] not in ('none', 'gzip', 'lzf'):
+        raise ValueError('Invalid storage profile %r: it must start with '
+                         'none, gzip or lzf' % text)
+    compression = None if words[0] == 'none' else words[0]
+    shuffle = 'shuffle' in words[1:]
+    chunks = ()
+    for word in words[1:]:
+        if word == 'shuffle':
+            continue
+        try:
+            chunks = tuple(int(n) for n in word.split(','))
+        except ValueError:
+            raise ValueError('Invalid chunks %r in the storage profile %r'
+                             % (word, text))
+        if min(chunks) <= 0:
+            raise ValueError('The chunks must be positive in %r' % text)
+    return StorageProfile(compression, shuffle, chunks)
+
+
+def get_storage_profiles(*dicts):
+    """
+    :param dicts: dictionaries dataset name -> profile string
+    :returns: a dictionary dataset name -> StorageProfile, built from the
+              defaults, the section [storage] of openquake.cfg and the
+              given dictionaries, in order of precedence
+    """
+    profiles = {}
+    for dic in (STORAGE_PROFILES, config.get_section('storage') or {}
+                ) + dicts:
+        for name, text in dic.items():
+            profiles[name] = storage_profile(text)
+    return profiles
+
+
+def _dset_kw(profile, dtype, shape):
+    # build the keyword arguments for h5py.Group.create_dataset
+    extendable = shape[0] is None
+    if not extendable and 0 in shape:  # empty datasets cannot be chunked
+        return {}
+    kw = {}
+    if profile.compression:
+        kw['compression'] = profile.compression
+    if profile.shuffle:
+        kw['shuffle'] = True
+    if profile.chunks:
+        chunks = []
+        for i, size in enumerate(shape):
+            chunk = profile.chunks[i] if i < len(profile.chunks) else size
+            chunks.append(chunk if size is None else min(chunk, size))
+        kw['chunks'] = tuple(chunks)
+    elif kw or extendable:
+        kw['chunks'] = True
+    return kw
+
+
+def create(hdf5file, key, dtype, shape=(None,), profile=NOPROFILE,
+           fillvalue=0, attrs=None):
+    """
+    Create a HDF5 dataset with the given storage profile.
+
+    :param hdf5file: a h5py.File object
+    :param key: name of the dataset
+    :param dtype: dtype of the dataset
+    :param shape: shape of the dataset; if the first dimension is None
+                  the dataset is extendable
+    :param profile: a StorageProfile instance
+    :param fillvalue: fill value for fixed-shape datasets
+    :param attrs: dictionary of attributes of the dataset
+    :returns: a HDF5 dataset
+    """
+    kw = _dset_kw(profile, dtype, shape)
+    if shape[0] is None:  # extendable dataset
+        dset = hdf5file.create_dataset(
+            key, (0,) + tuple(shape[1:]), dtype, maxshape=shape, **kw)
+    else:  # fixed-shape dataset
+        dset = hdf5file.create_dataset(
+            key, shape, dtype, fillvalue=fillvalue, **kw)
+    for k, v in (attrs or {}).items():
+        dset.attrs[k] = v
+    return dset
+
+
+def extend(hdf5file, key, array, profile=NOPROFILE):
+    """
+    Extend the dataset associated to the given key; create it if needed
+
+    :param hdf5file: a h5py.File object
+    :param key: name of the dataset
+    :param array: array to store
+    :param profile: StorageProfile used if the dataset must be created
+    :returns: the extended dataset
+    """
+    try:
+        dset = hdf5file[key]
+    except KeyError:
+        dset = create(hdf5file, key, array.dtype,
+                      (None,) + array.shape[1:], profile)
+    hdf5.extend(dset, array)
+    return dset
+
+
 def get_nbytes(dset):
     """
     If the dataset has an attribute 'nbytes', return it. Otherwise get the size
@@ -188,6 +323,22 @@ class DataStore(collections.MutableMapping):
         self.attrs = self.hdf5.attrs
         for name, value in params:
             self.attrs[name] = value
+        self.profiles = get_storage_profiles()
+
+    def set_storage_profiles(self, dic):
+        """
+        Override the storage profiles of the datasets.
+
+        :param dic: a dictionary dataset name -> profile string
+        """
+        self.profiles = get_storage_profiles(dic)
+
+    def get_profile(self, key):
+        """
+        :param key: dataset path
+        :returns: the StorageProfile associated to the dataset
+        """
+        return self.profiles.get(key.lstrip('/').split('/')[0], NOPROFILE)
 
     def ext5(self, mode='r'):
         """
@@ -253,27 +404,25 @@ class DataStore(collections.MutableMapping):
         :param key: name of the dataset
         :param dtype: dtype of the dataset (usually composite)
         :param shape: shape of the dataset, possibly extendable
-        :param compression: the kind of HDF5 compression to use
+        :param compression: the kind of HDF5 compression to use; if not
+                            given, use the storage profile of the dataset
         :param attrs: dictionary of attributes of the dataset
         :returns: a HDF5 dataset
         """
-        return hdf5.create(
-            self.hdf5, key, dtype, shape, compression, fillvalue, attrs)
+        profile = self.get_profile(key)
+        if compression:
+            profile = profile._replace(compression=compression)
+        return create(self.hdf5, key, dtype, shape, profile, fillvalue, attrs)
 
     def extend(self, key, array):
         """
         Extend the dataset associated to the given key; create it if needed
+        by using the storage profile of the dataset.
 
         :param key: name of the dataset
         :param array: array to store
         """
-        try:
-            dset = self.hdf5[key]
-        except KeyError:
-            dset = hdf5.create(self.hdf5, key, array.dtype,
-                               shape=(None,) + array.shape[1:])
-        hdf5.extend(dset, array)
-        return dset
+        return extend(self.hdf5, key, array, self.get_profile(key))
 
     def save(self, key, kw):
         """
@@ -331,6 +480,14 @@ class DataStore(collections.MutableMapping):
             self.parent.flush()
         self.hdf5.flush()
 
+    def open(self, mode='r+'):
+        """Open the underlying hdf5 file and the parent, if closed"""
+        if self.parent != ():
+            self.parent.open('r')
+        if not self.hdf5:  # is closed
+            self.hdf5 = hdf5.File(self.hdf5path, mode, libver='latest')
+            self.attrs = self.hdf5.attrs
+
     def close(self):
         """Close the underlying hdf5 file"""
         if self.parent != ():
@@ -351,7 +508,10 @@ class DataStore(collections.MutableMapping):
         If no key is given, returns the total size of all files.
         """
         if key is None:
-            return os.path.getsize(self.hdf5path)
+            size = os.path.getsize(self.hdf5path)
+            if os.path.exists(self.ext5path):
+                size += os.path.getsize(self.ext5path)
+            return size
         return ByteCounter.get_nbytes(h5py.File.__getitem__(self.hdf5, key))
 
     def get(self, key, default):
@@ -22,6 +22,7 @@ Classes for serializing various NRML XML artifacts.
 
 import json
 import operator
+import itertools
 from collections import OrderedDict
 
 
@@ -54,6 +55,32 @@ _ATTR_MAP = OrderedDict([
 
 GML_NS = nrml.SERIALIZE_NS_MAP['gml']
 
+#: Format of the PoEs in the hazard curves; it must be passed explicitly
+#: since the curves are formatted lazily inside `nrml.write`, which
+#: changes the default float format
+POES_FMT = '%13.9E'
+
+
+def _lazy(nodes):
+    """
+    Convert an iterable of nodes into an iterator, or into an empty list if
+    there are no nodes. In this way the subnodes are generated only when
+    the StreamingXMLWriter writes them to the file, but empty elements are
+    still serialized as `<tag/>`, since an empty list is recognized as such
+    while an iterator is always true.
+
+    >>> _lazy(iter([]))
+    []
+    >>> list(_lazy(iter([1, 2])))
+    [1, 2]
+    """
+    nodes = iter(nodes)
+    try:
+        first = next(nodes)
+    except StopIteration:
+        return []
+    return itertools.chain([first], nodes)
+
 
 def _validate_hazard_metadata(md):
     """
@@ -112,7 +139,8 @@ def _set_metadata(element, metadata, attr_map, transform=str):
     Set metadata attributes on a given ``element``.
 
     :param element:
-        :class:`xml.etree.ElementTree.Element` instance
+        :class:`xml.etree.ElementTree.Element` or
+        :class:`openquake.baselib.node.Node` instance
     :param metadata:
         Dictionary of metadata items containing attribute data for ``element``.
     :param attr_map:
@@ -124,7 +152,7 @@ def _set_metadata(element, metadata, attr_map, transform=str):
     for kw, attr in attr_map.items():
         value = metadata.get(kw)
         if value is not None:
-            element.set(attr, transform(value))
+            element.attrib[attr] = transform(value)
 
 
 class BaseCurveWriter(object):
@@ -191,32 +219,31 @@ class HazardCurveXMLWriter(BaseCurveWriter):
               have `x` and `y` to represent lon and lat, respectively.
         """
         with open(self.dest, 'wb') as fh:
-            root = et.Element('nrml')
-            self.add_hazard_curves(root, self.metadata, data)
-            nrml.write(list(root), fh)
+            nrml.write([self.hazard_curves_node(self.metadata, data)], fh)
 
-    def add_hazard_curves(self, root, metadata, data):
+    def hazard_curves_node(self, metadata, data):
         """
-        Add hazard curves stored into `data` as child of the `root`
-        element with `metadata`. See the documentation of the method
+        Build a `hazardCurves` node with `metadata`, generating the curves
+        in `data` lazily. See the documentation of the method
         `serialize` and the constructor for a description of `data`
         and `metadata`, respectively.
         """
-        hazard_curves = et.SubElement(root, 'hazardCurves')
-
+        hazard_curves = Node('hazardCurves')
         _set_metadata(hazard_curves, metadata, _ATTR_MAP)
-
-        imls_elem = et.SubElement(hazard_curves, 'IMLs')
-        imls_elem.text = ' '.join(map(scientificformat, metadata['imls']))
-        gml_ns = nrml.SERIALIZE_NS_MAP['gml']
-
-        for hc in data:
-            hc_elem = et.SubElement(hazard_curves, 'hazardCurve')
-            gml_point = et.SubElement(hc_elem, '{%s}Point' % gml_ns)
-            gml_pos = et.SubElement(gml_point, '{%s}pos' % gml_ns)
-            gml_pos.text = '%s %s' % (hc.location.x, hc.location.y)
-            poes_elem = et.SubElement(hc_elem, 'poEs')
-            poes_elem.text = ' '.join(map(scientificformat, hc.poes))
+        imls = Node('IMLs', text=' '.join(
+            map(scientificformat, metadata['imls'])))
+        hazard_curves.nodes = itertools.chain(
+            [imls], (self._hazard_curve_node(hc) for hc in data))
+        return hazard_curves
+
+    def _hazard_curve_node(self, hc):
+        # build the node for a single hazard curve
+        pos = Node('{%s}pos' % GML_NS,
+                   text='%s %s' % (hc.location.x, hc.location.y))
+        poes = Node('poEs', text=' '.join(
+            scientificformat(poe, POES_FMT) for poe in hc.poes))
+        return Node('hazardCurve', nodes=[
+            Node('{%s}Point' % GML_NS, nodes=[pos]), poes])
 
 
 class HazardCurveGeoJSONWriter(BaseCurveWriter):
@@ -340,7 +367,16 @@ class EventBasedGMFXMLWriter(object):
             * `lon` and `lat` attributes (to indicate the geographical location
               of the ground motion field)
         """
-        gmf_set_nodes = []
+        gmf_container = Node('gmfCollection')
+        gmf_container[SM_TREE_PATH] = self.sm_lt_path
+        gmf_container[GSIM_TREE_PATH] = self.gsim_lt_path
+        gmf_container.nodes = _lazy(self._gen_gmf_sets(data))
+
+        with open(self.dest, 'wb') as dest:
+            nrml.write([gmf_container], dest, fmt)
+
+    def _gen_gmf_sets(self, data):
+        # generate the gmfSet nodes, each one generating its GMFs lazily
         for gmf_set in data:
             gmf_set_node = Node('gmfSet')
             if gmf_set.investigation_time:
@@ -349,15 +385,7 @@ class EventBasedGMFXMLWriter(object):
             gmf_set_node['stochasticEventSetId'] = str(
                 gmf_set.stochastic_event_set_id)
             gmf_set_node.nodes = gen_gmfs(gmf_set)
-            gmf_set_nodes.append(gmf_set_node)
-
-        gmf_container = Node('gmfCollection')
-        gmf_container[SM_TREE_PATH] = self.sm_lt_path
-        gmf_container[GSIM_TREE_PATH] = self.gsim_lt_path
-        gmf_container.nodes = gmf_set_nodes
-
-        with open(self.dest, 'wb') as dest:
-            nrml.write([gmf_container], dest, fmt)
+            yield gmf_set_node
 
 
 def rupture_to_element(rupture, parent=None):
@@ -535,21 +563,23 @@ class SESXMLWriter(object):
 
             Each of these should be a triple of `lon`, `lat`, `depth`.
         """
+        ses_container = Node('stochasticEventSetCollection')
+        ses_container.nodes = _lazy(self._gen_ses(data))
         with open(self.dest, 'wb') as fh:
-            root = et.Element('nrml')
-            ses_container = et.SubElement(
-                root, 'stochasticEventSetCollection')
-            for ses in data:
-                ruptures = list(ses)
-                if not ruptures:  # empty SES, don't export it
-                    continue
-                ses_elem = et.SubElement(
-                    ses_container, 'stochasticEventSet')
-                ses_elem.set('id', str(ses.ordinal or 1))
-                ses_elem.set('investigationTime', str(ses.investigation_time))
-                for rupture in ruptures:
-                    rupture_to_element(rupture, ses_elem)
-            nrml.write(list(root), fh)
+            nrml.write([ses_container], fh)
+
+    def _gen_ses(self, data):
+        # generate the stochasticEventSet nodes, each one converting its
+        # ruptures into elements only when they are written
+        for ses in data:
+            ruptures = _lazy(rupture_to_element(rup) for rup in ses)
+            if not ruptures:  # empty SES, don't export it
+                continue
+            ses_node = Node('stochasticEventSet')
+            ses_node['id'] = str(ses.ordinal or 1)
+            ses_node['investigationTime'] = str(ses.investigation_time)
+            ses_node.nodes = ruptures
+            yield ses_node
 
 
 class HazardMapWriter(object):
@@ -609,18 +639,13 @@ class HazardMapXMLWriter(HazardMapWriter):
         See :meth:`HazardMapWriter.serialize` for details about the expected
         input.
         """
+        hazard_map = Node('hazardMap')
+        _set_metadata(hazard_map, self.metadata, _ATTR_MAP)
+        hazard_map.nodes = _lazy(
+            Node('node', dict(lon=str(lon), lat=str(lat), iml=str(iml)))
+            for lon, lat, iml in data)
         with open(self.dest, 'wb') as fh:
-            root = et.Element('nrml')
-            hazard_map = et.SubElement(root, 'hazardMap')
-            _set_metadata(hazard_map, self.metadata, _ATTR_MAP)
-
-            for lon, lat, iml in data:
-                node = et.SubElement(hazard_map, 'node')
-                node.set('lon', str(lon))
-                node.set('lat', str(lat))
-                node.set('iml', str(iml))
-
-            nrml.write(list(root), fh)
+            nrml.write([hazard_map], fh)
 
 
 class HazardMapGeoJSONWriter(HazardMapWriter):
@@ -34,6 +34,7 @@ import collections
 import operator
 from collections import namedtuple
 from decimal import Decimal
+import numpy
 
 from openquake.baselib import node
 from openquake.baselib.general import groupby
@@ -48,6 +49,7 @@ from openquake.hazardlib.sourceconverter import (
 
 from openquake.baselib.node import (
     node_from_xml, striptag, node_from_elem, Node as N, context)
+from openquake.commonlib import sourcehdf5
 
 #: Minimum value for a seed number
 MIN_SINT_32 = -(2 ** 31)
@@ -475,6 +477,9 @@ class SourceModelLogicTree(object):
         self.basepath = os.path.dirname(filename)
         self.seed = seed
         self.num_samples = num_samples
+        # pairs (source model path, GSIM path) of the selected realizations,
+        # set by readinput.get_composite_source_model; empty means all
+        self.selection = []
         self.branches = {}  # branch_id -> branch
         self.open_ends = set()
         self.source_ids = set()
@@ -603,17 +608,33 @@ class SourceModelLogicTree(object):
 
     def gen_source_models(self, gsim_lt):
         """
-        Yield empty SourceModel instances (one per effective realization)
+        Yield empty SourceModel instances (one per effective realization);
+        if there is a selection of realizations, the source models not
+        contributing to it are discarded.
         """
         samples_by_lt_path = self.samples_by_lt_path()
-        for i, rlz in enumerate(get_effective_rlzs(self)):
+        gsim_paths = collections.defaultdict(list)  # smpath -> GSIM paths
+        for smpath, gsim_path in self.selection:
+            gsim_paths[smpath].append(gsim_path)
+        if self.selection and not self.num_samples:
+            ordinals, _ = gsim_lt.get_effective_paths()
+        i = 0
+        for rlz in get_effective_rlzs(self):
             smpath = rlz.lt_path
+            if self.selection and '_'.join(smpath) not in gsim_paths:
+                continue
             num_samples = samples_by_lt_path[smpath]
-            num_gsim_paths = (num_samples if self.num_samples
-                              else gsim_lt.get_num_paths())
+            if self.num_samples:
+                num_gsim_paths = num_samples
+            elif self.selection:  # count the distinct selected paths
+                num_gsim_paths = int(gsim_lt.select(
+                    ordinals, gsim_paths['_'.join(smpath)]).sum())
+            else:
+                num_gsim_paths = gsim_lt.get_num_paths()
             yield SourceModel(
                 rlz.value, rlz.weight / num_samples, smpath, [],
                 num_gsim_paths, i, num_samples)
+            i += 1
 
     def sample_path(self, rnd):
         """
@@ -1055,9 +1076,15 @@ class SourceModelLogicTree(object):
         information is used then for :meth:`validate_filters` and
         :meth:`validate_uncertainty_value`.
         """
-        smodel = nrml.read(self._get_source_model(source_model)).sourceModel
+        if source_model.endswith('.hdf5'):
+            smodel = sourcehdf5.read_source_model(
+                os.path.join(self.basepath, source_model))
+            nodes = [src_node for sg_node in smodel for src_node in sg_node]
+        else:
+            nodes = nrml.read(
+                self._get_source_model(source_model)).sourceModel
         n = len('Source')
-        for node in smodel:
+        for node in nodes:
             with context(source_model, node):
                 self.tectonic_region_types.add(node['tectonicRegion'])
                 source_id = node['id']
@@ -1092,6 +1119,10 @@ class SourceModelLogicTree(object):
         def apply_uncertainties(source):
             for branchset, value in branchsets_and_uncertainties:
                 branchset.apply_uncertainty(value, source)
+        # the branchsets of the path, used to copy only the sources
+        # passing their filters, i.e. the ones which are modified
+        apply_uncertainties.branchsets = [
+            branchset for branchset, value in branchsets_and_uncertainties]
         return apply_uncertainties
 
     def samples_by_lt_path(self):
@@ -1151,7 +1182,17 @@ class GsimLogicTree(object):
                 ','.join(self.tectonic_region_types))
         self.values = collections.defaultdict(list)  # {trt: gsims}
         self._ltnode = ltnode or node_from_xml(fname).logicTree
+        self._reduced = {}  # trts -> reduced GsimLogicTree
         self.all_trts, self.branches = self._build_trts_branches()
+        # the branches of each TRT, in the order of all_trts; a path in
+        # the tree is a number in the mixed radix system with the numbers
+        # of branches as radixes, the last TRT being the fastest digit
+        self.groups = [[b for b in self.branches
+                        if b.bset['applyToTectonicRegionType'] == trt]
+                       for trt in self.all_trts]
+        self.strides = [1] * len(self.groups)
+        for i in range(len(self.groups) - 2, -1, -1):
+            self.strides[i] = self.strides[i + 1] * len(self.groups[i + 1])
         if tectonic_region_types and not self.branches:
             raise InvalidLogicTree(
                 'Could not find branches with attribute '
@@ -1185,12 +1226,17 @@ class GsimLogicTree(object):
 
     def reduce(self, trts):
         """
-        Reduce the GsimLogicTree.
+        Reduce the GsimLogicTree. The reduced trees are cached, since
+        they are requested for each source model.
 
         :param trts: a subset of tectonic region types
         :returns: a reduced GsimLogicTree instance
         """
-        return self.__class__(self.fname, sorted(trts), ltnode=self._ltnode)
+        key = tuple(sorted(trts))
+        if key not in self._reduced:
+            self._reduced[key] = self.__class__(
+                self.fname, key, ltnode=self._ltnode)
+        return self._reduced[key]
 
     def get_num_branches(self):
         """
@@ -1284,28 +1330,166 @@ class GsimLogicTree(object):
         idx = self.all_trts.index(trt)
         return rlz.value[idx]
 
+    def _realization(self, digits, weight=None):
+        # build the Realization associated to the given path; by default
+        # the weight is the product of the weights of the branches
+        branches = [group[d] for group, d in zip(self.groups, digits)]
+        if weight is None:
+            weight = 1
+            for branch in branches:
+                weight *= branch.weight
+        ordinal = sum(d * stride for d, stride in zip(digits, self.strides))
+        return Realization(
+            tuple(b.uncertainty for b in branches), weight,
+            tuple(b.id for b in branches), ordinal,
+            tuple(b.id if b.effective else '@' for b in branches))
+
+    def get_rlz(self, ordinal):
+        """
+        :param ordinal: an integer in the range 0 .. number of paths - 1
+        :returns: the Realization with the given ordinal, built without
+                  enumerating the other paths
+        """
+        digits = [ordinal // stride % len(group)
+                  for group, stride in zip(self.groups, self.strides)]
+        return self._realization(digits)
+
+    def parse_path(self, text):
+        """
+        Parse a GSIM path as it appears in the unique identifiers of the
+        realizations, i.e. a branch ID per tectonic region type (or '@'
+        for any branch) separated by underscores.
+
+        :param text: a string like 'b1_@_b3'
+        :returns: a tuple of branch IDs, in the order of .all_trts
+        """
+        path = []
+        rest = text
+        for group in self.groups:
+            # try the longest IDs first, since they can contain underscores
+            for brid in sorted(['@'] + [br.id for br in group],
+                               key=len, reverse=True):
+                if rest == brid or rest.startswith(brid + '_'):
+                    path.append(brid)
+                    rest = rest[len(brid) + 1:]
+                    break
+            else:
+                raise ValueError('Invalid GSIM path %r in %s' %
+                                 (text, self.fname))
+        if rest:
+            raise ValueError('Invalid GSIM path %r in %s' %
+                             (text, self.fname))
+        return tuple(path)
+
+    def get_digits(self, ordinals):
+        """
+        :param ordinals: an array of N path ordinals
+        :returns: an array of shape (T, N) with the indices of the branches
+                  of each path, one row per tectonic region type
+        """
+        ordinals = numpy.array(ordinals, numpy.int64)
+        return numpy.array(
+            [ordinals // stride % len(group)
+             for group, stride in zip(self.groups, self.strides)],
+            numpy.int64).reshape(len(self.groups), len(ordinals))
+
+    def get_effective_paths(self):
+        """
+        Enumerate the effective realizations, i.e. the paths differing
+        only for the branches of the effective tectonic region types, by
+        enumerating only such branches and without building Realization
+        objects; the non-effective TRTs take their first branch.
+
+        :returns: a pair (ordinals, weights) of arrays sorted by uid, where
+                  the weight of a path is the (Decimal) product of the
+                  weights of its effective branches
+        """
+        ordinals = numpy.zeros(1, numpy.int64)
+        weights = numpy.ones(1, object)
+        ids = []  # the branch IDs of each TRT, '@' for the non-effective
+        for group, stride in zip(self.groups, self.strides):
+            if group and group[0].effective:
+                ordinals = (ordinals[:, None] +
+                            numpy.arange(len(group)) * stride).ravel()
+                weights = (weights[:, None] * numpy.array(
+                    [br.weight for br in group], object)).ravel()
+                ids.append([br.id for br in group])
+            else:
+                ids.append(['@'])
+        if all(brids == ['@'] for brids in ids):  # no effective TRTs
+            return numpy.zeros(0, numpy.int64), numpy.zeros(0, object)
+        uids = ['_'.join(path) for path in itertools.product(*ids)]
+        order = sorted(range(len(uids)), key=uids.__getitem__)
+        return ordinals[order], weights[order]
+
+    def select(self, ordinals, gsim_paths):
+        """
+        :param ordinals: an array of N path ordinals
+        :param gsim_paths: a list of GSIM paths, i.e. tuples with a branch
+                           ID per tectonic region type, where '@' means
+                           any branch
+        :returns: a boolean array with N elements, True for the paths
+                  matching at least one of the GSIM paths; the branches of
+                  the non-effective tectonic region types are ignored
+        """
+        digits = self.get_digits(ordinals)
+        selected = numpy.zeros(len(digits[0]), bool)
+        for gsim_path in gsim_paths:
+            ok = numpy.ones(len(selected), bool)
+            for t, (group, brid) in enumerate(zip(self.groups, gsim_path)):
+                if brid != '@' and group[0].effective:
+                    ok &= digits[t] == [br.id for br in group].index(brid)
+            selected |= ok
+        return selected
+
+    def get_effective_rlzs(self):
+        """
+        Build the effective realizations from the ordinals returned by
+        :meth:`get_effective_paths`. The result is the same as
+        `get_effective_rlzs(list(self))`, without building the paths
+        with non-effective branches, which can be millions.
+        """
+        ordinals, weights = self.get_effective_paths()
+        return [self._realization(digits, weight) for digits, weight in
+                zip(self.get_digits(ordinals).T.tolist(), weights)]
+
+    def sample(self, num_samples, rnd):
+        """
+        Sample the paths of the tree, with the same draws as
+        `sample(list(self), num_samples, rnd)`: the cumulative weights of
+        the paths are computed arithmetically, by walking down the tree
+        one TRT at the time instead of enumerating all the paths.
+
+        :param num_samples: the number of samples to return
+        :param rnd: a random.Random instance
+        :returns: a list of Realization instances
+        """
+        rlzs = []
+        for _ in range(num_samples):
+            diceroll = rnd.random()
+            acc = 0  # cumulative weight of the paths before the current one
+            weight = 1  # weight of the current path prefix
+            digits = []
+            for group in self.groups:
+                for d, branch in enumerate(group):
+                    if acc + weight * branch.weight >= diceroll:
+                        break
+                    acc += weight * branch.weight
+                # NB: if the weights do not sum up exactly to 1 because of
+                # rounding errors the last branch is taken
+                weight *= branch.weight
+                digits.append(d)
+            rlzs.append(self._realization(digits))
+        return rlzs
+
     def __iter__(self):
         """
         Yield :class:`openquake.commonlib.logictree.Realization` instances
         """
-        groups = []
-        # NB: branches are already sorted
-        for trt in self.all_trts:
-            groups.append([b for b in self.branches
-                           if b.bset['applyToTectonicRegionType'] == trt])
         # with T tectonic region types there are T groups and T branches
-        for i, branches in enumerate(itertools.product(*groups)):
-            weight = 1
-            lt_path = []
-            lt_uid = []
-            value = []
-            for trt, branch in zip(self.all_trts, branches):
-                lt_path.append(branch.id)
-                lt_uid.append(branch.id if branch.effective else '@')
-                weight *= branch.weight
-                value.append(branch.uncertainty)
-            yield Realization(tuple(value), weight, tuple(lt_path),
-                              i, tuple(lt_uid))
+        for digits in itertools.product(
+                *[range(len(group)) for group in self.groups]):
+            yield self._realization(digits)
 
     def __repr__(self):
         lines = ['%s,%s,%s,w=%s' % (b.bset['applyToTectonicRegionType'],
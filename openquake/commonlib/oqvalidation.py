@@ -25,12 +25,25 @@ from openquake.baselib.general import DictArray
 from openquake.hazardlib.imt import from_string
 from openquake.hazardlib import correlation
 from openquake.hazardlib import valid
-from openquake.commonlib import logictree
+from openquake.commonlib import logictree, datastore
 from openquake.commonlib.riskmodels import get_risk_files
 
 GROUND_MOTION_CORRELATION_MODELS = ['JB2009']
 
 
+def rlz_selection(value):
+    """
+    Parse a selection of realizations, given as ordinals or as unique
+    identifiers `<source model path>~<GSIM path>`, separated by spaces
+    or commas.
+
+    >>> rlz_selection('3, b1~BooreAtkinson2008')
+    [3, 'b1~BooreAtkinson2008']
+    """
+    return [int(item) if item.isdigit() else item
+            for item in value.replace(',', ' ').split()]
+
+
 class OqParam(valid.ParamSet):
     siteparam = dict(
         vs30measured='reference_vs30_type',
@@ -46,6 +59,7 @@ class OqParam(valid.ParamSet):
     asset_life_expectancy = valid.Param(valid.positivefloat)
     avg_losses = valid.Param(valid.boolean, False)
     base_path = valid.Param(valid.utf8, '.')
+    cache_split_sources = valid.Param(valid.boolean, False)
     calculation_mode = valid.Param(valid.Choice(), '')  # -> get_oqparam
     coordinate_bin_width = valid.Param(valid.positivefloat)
     compare_with_classical = valid.Param(valid.boolean, False)
@@ -55,6 +69,8 @@ class OqParam(valid.ParamSet):
     continuous_fragility_discretization = valid.Param(valid.positiveint, 20)
     description = valid.Param(valid.utf8_not_empty)
     distance_bin_width = valid.Param(valid.positivefloat)
+    epsilon_generator = valid.Param(
+        valid.Choice('matrix', 'counter'), 'matrix')
     mag_bin_width = valid.Param(valid.positivefloat)
     export_dir = valid.Param(valid.utf8, '.')
     export_multi_curves = valid.Param(valid.boolean, False)
@@ -92,6 +108,8 @@ class OqParam(valid.ParamSet):
     number_of_ground_motion_fields = valid.Param(valid.positiveint)
     number_of_logic_tree_samples = valid.Param(valid.positiveint, 0)
     num_epsilon_bins = valid.Param(valid.positiveint)
+    pmap_precision = valid.Param(
+        valid.Choice('float64', 'float32', 'log'), 'float64')
     poes = valid.Param(valid.probabilities, [])
     poes_disagg = valid.Param(valid.probabilities, [])
     quantile_hazard_curves = valid.Param(valid.probabilities, [])
@@ -116,12 +134,14 @@ class OqParam(valid.ParamSet):
     complex_fault_mesh_spacing = valid.Param(
         valid.NoneOr(valid.positivefloat), None)
     save_ruptures = valid.Param(valid.boolean, False)
+    selected_realizations = valid.Param(rlz_selection, [])
     ses_per_logic_tree_path = valid.Param(valid.positiveint, 1)
     ses_seed = valid.Param(valid.positiveint, 42)
     sites = valid.Param(valid.NoneOr(valid.coordinates), None)
     sites_disagg = valid.Param(valid.NoneOr(valid.coordinates), [])
     sites_slice = valid.Param(valid.simple_slice, (None, None))
     specific_assets = valid.Param(valid.namelist, [])
+    storage_profiles = valid.Param(valid.dictionary, {})
     taxonomies_from_model = valid.Param(valid.boolean, False)
     time_event = valid.Param(str, None)
     truncation_level = valid.Param(valid.NoneOr(valid.positivefloat), None)
@@ -348,6 +368,17 @@ class OqParam(valid.ParamSet):
         else:
             return True
 
+    def is_valid_storage_profiles(self):
+        """
+        The storage_profiles must be a dictionary dataset name -> profile,
+        where the profile is a string like 'gzip shuffle 1024'
+        """
+        try:
+            datastore.get_storage_profiles(self.storage_profiles)
+        except (ValueError, TypeError, AttributeError):
+            return False
+        return True
+
     def is_valid_region(self):
         """
         If there is a region a region_grid_spacing must be given
@@ -464,6 +495,14 @@ class OqParam(valid.ParamSet):
         else:
             return True
 
+    def is_valid_selected_realizations(self):
+        """
+        The option `selected_realizations` cannot be used together with
+        `number_of_logic_tree_samples`.
+        """
+        return not (self.selected_realizations and
+                    self.number_of_logic_tree_samples)
+
     def is_valid_hazard_curves(self):
         """
         You must set `hazard_curves_from_gmfs` if `mean_hazard_curves`
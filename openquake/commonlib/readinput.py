@@ -19,6 +19,7 @@
 from __future__ import division
 import os
 import csv
+import copy
 import gzip
 import zipfile
 import logging
@@ -29,6 +30,8 @@ import numpy
 from shapely import wkt, geometry
 
 from openquake.baselib.general import groupby, AccumDict, writetmp
+from openquake.baselib.parallel import Starmap
+from openquake.baselib.performance import Monitor
 from openquake.baselib.python3compat import configparser, encode
 from openquake.baselib.node import Node, context
 from openquake.baselib import hdf5
@@ -40,7 +43,7 @@ from openquake.commonlib import datastore
 from openquake.commonlib.oqvalidation import OqParam
 from openquake.commonlib import logictree
 from openquake.commonlib.riskmodels import get_risk_models
-from openquake.commonlib import source
+from openquake.commonlib import source, sourcehdf5
 
 read_nrml.update_validators()
 
@@ -339,6 +342,85 @@ def get_source_model_lt(oqparam):
         num_samples=oqparam.number_of_logic_tree_samples)
 
 
+def get_rlz_selection(oqparam, gsim_lt, source_model_lt):
+    """
+    :param oqparam:
+        an :class:`openquake.commonlib.oqvalidation.OqParam` instance
+    :param gsim_lt:
+        a :class:`openquake.commonlib.logictree.GsimLogicTree` instance
+    :param source_model_lt:
+        a :class:`openquake.commonlib.logictree.SourceModelLogicTree` instance
+    :returns:
+        a list of pairs (source model path, GSIM path), one for each
+        realization in `selected_realizations`; the ordinals refer to
+        the full enumeration of the logic tree
+    """
+    selection = []
+    if not oqparam.selected_realizations:
+        return selection
+    smpaths = ['_'.join(rlz.lt_path)
+               for rlz in logictree.get_effective_rlzs(source_model_lt)]
+    gsim_ordinals = None
+    for item in oqparam.selected_realizations:
+        if isinstance(item, int):
+            if gsim_ordinals is None:
+                gsim_ordinals, _ = gsim_lt.get_effective_paths()
+            num_rlzs = len(smpaths) * len(gsim_ordinals)
+            if item >= num_rlzs:
+                raise ValueError('Realization #%d does not exist, there are '
+                                 '%d realizations' % (item, num_rlzs))
+            smpath = smpaths[item // len(gsim_ordinals)]
+            gsim_path = gsim_lt.get_rlz(
+                gsim_ordinals[item % len(gsim_ordinals)]).lt_path
+        else:
+            try:
+                smpath, text = item.split('~')
+            except ValueError:
+                raise ValueError('Invalid realization %r: the format is '
+                                 '<source model path>~<GSIM path>' % item)
+            if smpath not in smpaths:
+                raise ValueError('Unknown source model path %r in %s' %
+                                 (smpath, source_model_lt.filename))
+            gsim_path = gsim_lt.parse_path(text)
+        selection.append((smpath, gsim_path))
+    return selection
+
+
+def apply_overlay(fname, src_groups, apply_unc):
+    """
+    Build the source groups of a logic tree branch as an overlay of the
+    groups parsed from the source model file, which are shared between
+    the branches: only the sources affected by the uncertainties are
+    deep copied and modified, the others are shallow copies sharing the
+    geometry and the MFD with the parsed sources.
+
+    :param fname: the path of the source model file
+    :param src_groups: the SourceGroups parsed from the file
+    :param apply_unc: a function returned by make_apply_uncertainties
+    :returns: a list of new SourceGroups; the groups without modified
+              sources have an attribute .base = (fname, group index),
+              the other groups have .base = None
+    """
+    groups = []
+    for i, src_group in enumerate(src_groups):
+        sources = []
+        modified = False
+        for src in src_group:
+            if any(bset.filter_source(src) for bset in apply_unc.branchsets):
+                src = copy.deepcopy(src)
+                apply_unc(src)
+                src.num_ruptures = src.count_ruptures()
+                modified = True
+            else:
+                src = copy.copy(src)
+            sources.append(src)
+        grp = copy.copy(src_group)
+        grp.sources = sources
+        grp.base = None if modified else (fname, i)
+        groups.append(grp)
+    return groups
+
+
 def possibly_gunzip(fname):
     """
     A file can be .gzipped to save space (this happens
@@ -355,9 +437,40 @@ def possibly_gunzip(fname):
     return fname
 
 
-def get_source_models(oqparam, gsim_lt, source_model_lt, in_memory=True):
+def parse_source_model(fname, converter, monitor):
     """
-    Build all the source models generated by the logic tree.
+    Parse a source model file, possibly gzipped; used as a task to parse
+    the source model files in parallel.
+
+    :param fname: the path of the source model file
+    :param converter: a SourceConverter instance
+    :param monitor: a Monitor instance
+    :returns: a dictionary fname -> list of SourceGroups
+    """
+    try:
+        if fname.endswith('.hdf5'):  # binary format, no XML parsing
+            return {fname: sourcehdf5.read_source_groups(fname, converter)}
+        parser = nrml.SourceModelParser(converter)
+        return {fname: parser.parse_src_groups(possibly_gunzip(fname))}
+    except ValueError as e:
+        if str(e) in ('Surface does not conform with Aki & '
+                      'Richards convention',
+                      'Edges points are not in the right order'):
+            raise InvalidFile('''\
+    %s: %s. Probably you are using an obsolete model.
+    In that case you can fix the file with the command
+    python -m openquake.engine.tools.correct_complex_sources %s
+    ''' % (fname, e, fname))
+        else:
+            raise
+
+
+def get_source_models(oqparam, gsim_lt, source_model_lt, in_memory=True,
+                      monitor=None):
+    """
+    Build all the source models generated by the logic tree. The source
+    model files are parsed in parallel, once each; the source groups
+    inside a file are parsed by the same task.
 
     :param oqparam:
         an :class:`openquake.commonlib.oqvalidation.OqParam` instance
@@ -367,39 +480,43 @@ def get_source_models(oqparam, gsim_lt, source_model_lt, in_memory=True):
         a :class:`openquake.commonlib.logictree.SourceModelLogicTree` instance
     :param in_memory:
         if True, keep in memory the sources, else just collect the TRTs
+    :param monitor:
+        a :class:`openquake.baselib.performance.Monitor` instance or None
     :returns:
         an iterator over :class:`openquake.commonlib.logictree.SourceModel`
         tuples
     """
+    monitor = monitor or Monitor()
     converter = sourceconverter.SourceConverter(
         oqparam.investigation_time,
         oqparam.rupture_mesh_spacing,
         oqparam.complex_fault_mesh_spacing,
         oqparam.width_of_mfd_bin,
         oqparam.area_source_discretization)
-    parser = nrml.SourceModelParser(converter)
     gsim_file = oqparam.inputs.get('gsim_logic_tree')
-
     # consider only the effective realizations
-    for sm in source_model_lt.gen_source_models(gsim_lt):
-        fname = possibly_gunzip(os.path.join(oqparam.base_path, sm.name))
+    smodels = list(source_model_lt.gen_source_models(gsim_lt))
+    fname_hits = collections.Counter(
+        os.path.join(oqparam.base_path, sm.name) for sm in smodels)
+    if in_memory:
+        # the parsed groups, shared between the branches; the tasks
+        # return dictionaries fname -> groups, so the order in which
+        # they complete does not matter
+        groups_by_fname = Starmap(parse_source_model, [
+            (fname, converter, monitor)
+            for fname in sorted(fname_hits)]).reduce()
+
+    for sm in smodels:
+        fname = os.path.join(oqparam.base_path, sm.name)
         if in_memory:
             apply_unc = source_model_lt.make_apply_uncertainties(sm.path)
-            try:
-                src_groups = parser.parse_src_groups(fname, apply_unc)
-            except ValueError as e:
-                if str(e) in ('Surface does not conform with Aki & '
-                              'Richards convention',
-                              'Edges points are not in the right order'):
-                    raise InvalidFile('''\
-    %s: %s. Probably you are using an obsolete model.
-    In that case you can fix the file with the command
-    python -m openquake.engine.tools.correct_complex_sources %s
-    ''' % (fname, e, fname))
-                else:
-                    raise
+            src_groups = apply_overlay(
+                fname, groups_by_fname[fname], apply_unc)
         else:  # just collect the TRT models
-            smodel = nrml.read(fname).sourceModel
+            if fname.endswith('.hdf5'):
+                smodel = sourcehdf5.read_source_model(fname)
+            else:
+                smodel = nrml.read(possibly_gunzip(fname)).sourceModel
             src_groups = []
             if smodel[0].tag.endswith('sourceGroup'):  # NRML 0.5 format
                 for sg_node in smodel:
@@ -422,12 +539,12 @@ def get_source_models(oqparam, gsim_lt, source_model_lt, in_memory=True):
         yield sm
 
     # log if some source file is being used more than once
-    for fname, hits in parser.fname_hits.items():
+    for fname, hits in fname_hits.items():
         if hits > 1:
             logging.info('%s has been considered %d times', fname, hits)
 
 
-def get_composite_source_model(oqparam, in_memory=True):
+def get_composite_source_model(oqparam, in_memory=True, monitor=None):
     """
     Parse the XML and build a complete composite source model in memory.
 
@@ -435,6 +552,8 @@ def get_composite_source_model(oqparam, in_memory=True):
         an :class:`openquake.commonlib.oqvalidation.OqParam` instance
     :param in_memory:
         if False, just parse the XML without instantiating the sources
+    :param monitor:
+        a :class:`openquake.baselib.performance.Monitor` instance or None
     """
     source_model_lt = get_source_model_lt(oqparam)
     smodels = []
@@ -447,8 +566,10 @@ def get_composite_source_model(oqparam, in_memory=True):
         except:
             return src['id']
     gsim_lt = get_gsim_lt(oqparam)
+    source_model_lt.selection = get_rlz_selection(
+        oqparam, gsim_lt, source_model_lt)
     for source_model in get_source_models(
-            oqparam, gsim_lt, source_model_lt, in_memory=in_memory):
+            oqparam, gsim_lt, source_model_lt, in_memory, monitor):
         for src_group in source_model.src_groups:
             src_group.sources = sorted(src_group, key=getid)
             src_group.id = grp_id
@@ -17,21 +17,27 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import division
+import os
 import re
 import copy
 import math
+import hashlib
 import logging
 import operator
 import collections
 import random
+from decimal import Decimal
 
 import numpy
 
 from openquake.baselib import hdf5, node
-from openquake.baselib.python3compat import decode
+from openquake.baselib.python3compat import decode, pickle
 from openquake.baselib.general import (
     groupby, group_array, block_splitter, writetmp)
-from openquake.hazardlib import nrml, sourceconverter, InvalidFile
+from openquake.hazardlib import (
+    nrml, site, sourceconverter, InvalidFile,
+    __version__ as hazardlib_version)
+from openquake.hazardlib.calc.filters import SourceFilter
 from openquake.commonlib import logictree
 
 
@@ -42,6 +48,9 @@ U32 = numpy.uint32
 I32 = numpy.int32
 F32 = numpy.float32
 
+# source attributes depending on the calculation, not on the source model
+CALC_ATTRS = ('src_group_id', 'serial', 'nsites', 'weight', 'id', 'indices')
+
 
 class LtRealization(object):
     """
@@ -93,10 +102,19 @@ class RlzsAssoc(collections.Mapping):
     but only via the method :meth:
     `openquake.commonlib.source.CompositeSourceModel.get_rlzs_assoc`.
 
+    :attr gsim_paths: dictionary {sm_id: (gsim_lt, rlzis, path ordinals)}
+    :attr rlzis: array with the ordinals of the realizations
+    :attr weights: array with the weights of the realizations
     :attr realizations: list of :class:`LtRealization` objects
     :attr gsim_by_trt: list of dictionaries {trt: gsim}
     :attr rlzs_assoc: dictionary {src_group_id, gsim: rlzs}
-    :attr rlzs_by_smodel: list of lists of realizations
+    :attr rlzs_by_smodel: dictionary {sm_id: realizations}
+
+    The realizations are stored as ordinals of the paths of the GSIM logic
+    tree, i.e. numbers in the mixed radix system with the numbers of
+    branches per tectonic region type as radixes; the weights and the
+    GSIMs are computed from the digits, while the realization objects
+    (and the attributes built on top of them) are built only on demand.
 
     For instance, for the non-trivial logic tree in
     :mod:`openquake.qa_tests_data.classical.case_15`, which has 4 tectonic
@@ -115,12 +133,17 @@ class RlzsAssoc(collections.Mapping):
     def __init__(self, csm_info):
         self.seed = csm_info.seed
         self.num_samples = csm_info.num_samples
-        self.rlzs_assoc = collections.defaultdict(list)
-        self.gsim_by_trt = []  # rlz.ordinal -> {trt: gsim}
-        self.rlzs_by_smodel = {sm.ordinal: [] for sm in csm_info.source_models}
+        self.smodels = {sm.ordinal: sm for sm in csm_info.source_models}
+        self.gsim_paths = {}
+        self.gsim_weights = {}  # sm_id -> weights of the GSIM paths
+        self.indices = {}  # src_group_id, gsim -> rlz ordinals
+        self.rlzis = numpy.zeros(0, U32)
+        self.weights = numpy.zeros(0)
         self.gsims_by_grp_id = {}
         self.sm_ids = {}
         self.samples = {}
+        self._rlzs_by_smodel = None
+        self._rlz = None  # rlz ordinal -> LtRealization
         for sm in csm_info.source_models:
             for sg in sm.src_groups:
                 self.sm_ids[sg.id] = sm.ordinal
@@ -129,37 +152,98 @@ class RlzsAssoc(collections.Mapping):
     def _init(self):
         """
         Finalize the initialization of the RlzsAssoc object by setting
-        the (reduced) weights of the realizations and the attribute
-        gsims_by_grp_id.
+        the ordinals and the (reduced) weights of the realizations and the
+        attribute gsims_by_grp_id.
         """
+        self.rlzis = numpy.concatenate([
+            self.gsim_paths[sm_id][1] for sm_id in sorted(self.gsim_paths)])
+        weights = numpy.concatenate([
+            float(self.smodels[sm_id].weight) * self.gsim_weights[sm_id]
+            for sm_id in sorted(self.gsim_paths)])
         if self.num_samples:
-            assert len(self.realizations) == self.num_samples, (
-                len(self.realizations), self.num_samples)
-            for rlz in self.realizations:
-                rlz.weight = 1. / self.num_samples
+            assert len(weights) == self.num_samples, (
+                len(weights), self.num_samples)
+            weights[:] = 1. / self.num_samples
         else:
-            tot_weight = sum(rlz.weight for rlz in self.realizations)
+            tot_weight = sum(weights)
             if tot_weight == 0:
                 raise ValueError('All realizations have zero weight??')
             elif abs(tot_weight - 1) > 1E-8:
                 # this may happen for rounding errors or because of the
                 # logic tree reduction; we ensure the sum of the weights is 1
-                for rlz in self.realizations:
-                    rlz.weight = rlz.weight / tot_weight
-
+                weights /= tot_weight
+        self.weights = weights
+        self._rlzs_by_smodel = self._rlz = None
         self.gsims_by_grp_id = groupby(
-            self.rlzs_assoc, operator.itemgetter(0),
+            self.indices, operator.itemgetter(0),
             lambda group: sorted(gsim for grp_id, gsim in group))
 
+    @property
+    def rlzs_by_smodel(self):
+        """Dictionary sm_id -> realizations, built on demand"""
+        if self._rlzs_by_smodel is None:
+            self._rlzs_by_smodel = {sm_id: [] for sm_id in self.smodels}
+            weights = iter(self.weights.tolist())
+            for sm_id in sorted(self.gsim_paths):
+                sm = self.smodels[sm_id]
+                gsim_lt, idx, ordinals = self.gsim_paths[sm_id]
+                digits = gsim_lt.get_digits(ordinals).T.tolist()
+                gsim_weights = self.gsim_weights[sm_id].tolist()
+                for i, rlzi in enumerate(idx.tolist()):
+                    gsim_rlz = gsim_lt._realization(
+                        digits[i], gsim_weights[i])
+                    self._rlzs_by_smodel[sm_id].append(LtRealization(
+                        rlzi, sm.path, gsim_rlz, next(weights), i))
+        return self._rlzs_by_smodel
+
+    def _get_rlzs(self, rlzis):
+        # the realizations with the given ordinals, built on demand
+        if self._rlz is None:
+            self._rlz = {rlz.ordinal: rlz for rlzs in
+                         self.rlzs_by_smodel.values() for rlz in rlzs}
+        return [self._rlz[rlzi] for rlzi in rlzis]
+
     @property
     def realizations(self):
         """Flat list with all the realizations"""
-        return sum(self.rlzs_by_smodel.values(), [])
+        return sum((self.rlzs_by_smodel[sm_id]
+                    for sm_id in sorted(self.rlzs_by_smodel)), [])
 
     @property
-    def weights(self):
-        """Array with the weight of the realizations"""
-        return numpy.array([rlz.weight for rlz in self.realizations])
+    def num_rlzs(self):
+        """The number of realizations, without building them"""
+        return sum(len(idx) for _, idx, _ in self.gsim_paths.values())
+
+    @property
+    def gsim_by_trt(self):
+        """List of dictionaries {trt: gsim}, one per realization"""
+        dicts = []
+        for sm_id in sorted(self.gsim_paths):
+            gsim_lt, idx, ordinals = self.gsim_paths[sm_id]
+            for path in gsim_lt.get_digits(ordinals).T.tolist():
+                dicts.append({trt: group[d].uncertainty for trt, group, d in
+                              zip(gsim_lt.all_trts, gsim_lt.groups, path)})
+        return dicts
+
+    def get_gsims(self, trt):
+        """
+        :param trt: a tectonic region type
+        :returns: the GSIMs associated to the given TRT, one per realization
+        """
+        gsims = []
+        for sm_id in sorted(self.gsim_paths):
+            gsim_lt, idx, ordinals = self.gsim_paths[sm_id]
+            t = gsim_lt.all_trts.index(trt)
+            branches = gsim_lt.groups[t]
+            gsims.extend(branches[d].uncertainty
+                         for d in gsim_lt.get_digits(ordinals)[t])
+        return gsims
+
+    @property
+    def rlzs_assoc(self):
+        """Dictionary (src_group_id, gsim) -> realizations"""
+        return {key: self._get_rlzs(idx.tolist())
+                for key, idx in self.indices.items()}
 
     def get_rlz(self, rlzstr):
         """
@@ -172,29 +256,54 @@ class RlzsAssoc(collections.Mapping):
 
     def get_rlzs_by_grp_id(self):
         """
-        Returns a dictionary grp_id > [sorted rlzs]
+        Returns a dictionary grp_id > sorted array of realization ordinals
+        """
+        indices_by_grp_id = collections.defaultdict(list)
+        for (grp_id, gsim), idx in self.indices.items():
+            indices_by_grp_id[grp_id].append(idx)
+        return {grp_id: numpy.unique(numpy.concatenate(arrays))
+                for grp_id, arrays in indices_by_grp_id.items()}
+
+    def get_sampleids(self, grp_id):
+        """
+        :param grp_id: a source group ID
+        :returns: a dictionary rlz ordinal -> index of the sample in the
+                  source model of the group, or an empty dictionary if the
+                  source model is not sampled more than once
+        """
+        sm_id = self.sm_ids[grp_id]
+        if self.samples[grp_id] <= 1 or sm_id not in self.gsim_paths:
+            return {}
+        idx = self.gsim_paths[sm_id][1]
+        return dict(zip(idx.tolist(), range(len(idx))))
+
+    def get_sm_id_by_rlz(self):
+        """
+        :returns: a dictionary rlz ordinal -> source model ordinal
         """
-        rlzs_by_grp_id = collections.defaultdict(set)
-        for (grp_id, gsim), rlzs in self.rlzs_assoc.items():
-            rlzs_by_grp_id[grp_id].update(rlzs)
-        return {grp_id: sorted(rlzs)
-                for grp_id, rlzs in rlzs_by_grp_id.items()}
+        return {rlzi: sm_id for sm_id, (_, idx, _) in self.gsim_paths.items()
+                for rlzi in idx.tolist()}
 
-    def _add_realizations(self, idx, lt_model, gsim_lt, gsim_rlzs):
+    def _add_realizations(self, idx, lt_model, gsim_lt, ordinals, weights):
+        # store the ordinals of the GSIM paths and associate each source
+        # group to the realizations using each of the GSIMs of its TRT
         trts = gsim_lt.tectonic_region_types
-        rlzs = []
-        for i, gsim_rlz in enumerate(gsim_rlzs):
-            weight = float(lt_model.weight) * float(gsim_rlz.weight)
-            rlz = LtRealization(idx[i], lt_model.path, gsim_rlz, weight, i)
-            self.gsim_by_trt.append(
-                dict(zip(gsim_lt.all_trts, gsim_rlz.value)))
-            for src_group in lt_model.src_groups:
-                if src_group.trt in trts:
-                    # ignore the associations to discarded TRTs
-                    gs = gsim_lt.get_gsim_by_trt(gsim_rlz, src_group.trt)
-                    self.rlzs_assoc[src_group.id, gs].append(rlz)
-            rlzs.append(rlz)
-        self.rlzs_by_smodel[lt_model.ordinal] = rlzs
+        idx = numpy.array(idx)
+        ordinals = numpy.array(ordinals, numpy.int64)
+        self.gsim_paths[lt_model.ordinal] = gsim_lt, idx, ordinals
+        self.gsim_weights[lt_model.ordinal] = numpy.array(weights, float)
+        digits = gsim_lt.get_digits(ordinals)
+        for src_group in lt_model.src_groups:
+            if src_group.trt in trts:
+                # ignore the associations to discarded TRTs
+                if src_group.trt == '*':  # assume a single TRT
+                    t = 0
+                else:
+                    t = gsim_lt.all_trts.index(src_group.trt)
+                for d in numpy.unique(digits[t]):
+                    gsim = gsim_lt.groups[t][d].uncertainty
+                    self.indices[src_group.id, gsim] = idx[digits[t] == d]
+        self._rlzs_by_smodel = self._rlz = None
 
     def extract(self, rlz_indices, csm_info):
         """
@@ -203,39 +312,39 @@ class RlzsAssoc(collections.Mapping):
         :param rlz_indices: a list of realization indices from 0 to R - 1
         """
         assoc = self.__class__(csm_info)
-        if len(rlz_indices) == 1:
-            realizations = [self.realizations[rlz_indices[0]]]
-        else:
-            realizations = operator.itemgetter(*rlz_indices)(self.realizations)
-        rlzs_smpath = groupby(realizations, operator.attrgetter('sm_lt_path'))
-        smodel_from = {sm.path: sm for sm in csm_info.source_models}
-        for smpath, rlzs in rlzs_smpath.items():
-            sm = smodel_from[smpath]
-            trts = set(sg.trt for sg in sm.src_groups)
-            assoc._add_realizations(
-                [r.ordinal for r in rlzs], sm,
-                csm_info.gsim_lt.reduce(trts), [rlz.gsim_rlz for rlz in rlzs])
+        start = 0
+        for sm_id in sorted(self.gsim_paths):
+            gsim_lt, idx, ordinals = self.gsim_paths[sm_id]
+            sel = [i - start for i in rlz_indices
+                   if start <= i < start + len(idx)]
+            start += len(idx)
+            if sel:
+                assoc._add_realizations(
+                    idx[sel], self.smodels[sm_id], gsim_lt, ordinals[sel],
+                    self.gsim_weights[sm_id][sel])
         assoc._init()
         return assoc
 
     def __iter__(self):
-        return iter(self.rlzs_assoc)
+        return iter(self.indices)
 
     def __getitem__(self, key):
-        return self.rlzs_assoc[key]
+        # the ordinals of the realizations associated to (grp_id, gsim)
+        return self.indices[key]
 
     def __len__(self):
-        return len(self.rlzs_assoc)
+        return len(self.indices)
 
     def __repr__(self):
         pairs = []
-        for key in sorted(self.rlzs_assoc):
-            rlzs = list(map(str, self.rlzs_assoc[key]))
+        rlzs_assoc = self.rlzs_assoc
+        for key in sorted(rlzs_assoc):
+            rlzs = list(map(str, rlzs_assoc[key]))
             if len(rlzs) > 10:  # short representation
                 rlzs = ['%d realizations' % len(rlzs)]
             pairs.append(('%s,%s' % key, rlzs))
         return '<%s(size=%d, rlzs=%d)\n%s>' % (
-            self.__class__.__name__, len(self), len(self.realizations),
+            self.__class__.__name__, len(self), self.num_rlzs,
             '\n'.join('%s: %s' % pair for pair in pairs))
 
 
@@ -263,6 +372,8 @@ class CompositionInfo(object):
 
     :param source_model_lt: a SourceModelLogicTree object
     :param source_models: a list of SourceModel instances
+    :param selection: a list of pairs (source model path, GSIM path)
+                      of the selected realizations, or an empty list
     """
     @classmethod
     def fake(cls, gsimlt=None):
@@ -280,12 +391,14 @@ class CompositionInfo(object):
         return cls(gsim_lt, seed=0, num_samples=0, source_models=[fakeSM],
                    tot_weight=0)
 
-    def __init__(self, gsim_lt, seed, num_samples, source_models, tot_weight):
+    def __init__(self, gsim_lt, seed, num_samples, source_models, tot_weight,
+                 selection=()):
         self.gsim_lt = gsim_lt
         self.seed = seed
         self.num_samples = num_samples
         self.source_models = source_models
         self.tot_weight = tot_weight
+        self.selection = list(selection)
 
     def get_info(self, sm_id):
         """
@@ -295,7 +408,8 @@ class CompositionInfo(object):
         sm = self.source_models[sm_id]
         num_samples = sm.samples if self.num_samples else 0
         return self.__class__(
-            self.gsim_lt, self.seed, num_samples, [sm], self.tot_weight)
+            self.gsim_lt, self.seed, num_samples, [sm], self.tot_weight,
+            self.selection)
 
     def __getnewargs__(self):
         # with this CompositionInfo instances will be unpickled correctly
@@ -314,20 +428,30 @@ class CompositionInfo(object):
         lst = [(sm.name, sm.weight, '_'.join(sm.path),
                 sm.num_gsim_paths, sm.samples)
                for i, sm in enumerate(self.source_models)]
-        return (dict(
-            sg_data=numpy.array(data, src_group_dt),
-            sm_data=numpy.array(lst, source_model_dt)),
-                dict(seed=self.seed, num_samples=self.num_samples,
+        attrs = dict(seed=self.seed, num_samples=self.num_samples,
                      trts=hdf5.array_of_vstr(trts),
                      gsim_lt_xml=str(self.gsim_lt),
                      gsim_fname=self.gsim_lt.fname,
-                     tot_weight=self.tot_weight))
+                     tot_weight=self.tot_weight)
+        if self.selection:
+            # the branch IDs of the GSIM path are separated by spaces,
+            # since they can contain underscores
+            attrs['selection'] = hdf5.array_of_vstr(
+                ['%s~%s' % (smpath, ' '.join(gsim_path))
+                 for smpath, gsim_path in self.selection])
+        return (dict(
+            sg_data=numpy.array(data, src_group_dt),
+            sm_data=numpy.array(lst, source_model_dt)), attrs)
 
     def __fromh5__(self, dic, attrs):
         sg_data = group_array(dic['sg_data'], 'sm_id')
         sm_data = dic['sm_data']
         vars(self).update(attrs)
         self.gsim_fname = decode(self.gsim_fname)
+        self.selection = []
+        for item in attrs.get('selection', []):
+            smpath, gsim_path = decode(item).split('~')
+            self.selection.append((smpath, tuple(gsim_path.split())))
         if self.gsim_fname.endswith('.xml'):
             trts = sorted(self.trts)
             if 'gmpe_table' in self.gsim_lt_xml:
@@ -372,6 +496,18 @@ class CompositionInfo(object):
         trts = set(sg.trt for sg in source_model.src_groups)
         return self.gsim_lt.reduce(trts).get_num_paths()
 
+    def is_selected(self, smpath, gsim_lt, ordinals):
+        """
+        :param smpath: the path of a source model, as a string
+        :param gsim_lt: the (reduced) GsimLogicTree of the source model
+        :param ordinals: an array of GSIM path ordinals
+        :returns: a boolean array, True for the paths in the selection;
+                  '@' in the selection means any branch and the branches
+                  of the non-effective tectonic region types are ignored
+        """
+        return gsim_lt.select(ordinals, [gsim_path for path, gsim_path in
+                                         self.selection if path == smpath])
+
     def get_rlzs_assoc(self, count_ruptures=None):
         """
         Return a RlzsAssoc with fields realizations, gsim_by_trt,
@@ -404,18 +540,25 @@ class CompositionInfo(object):
             if self.num_samples:  # sampling
                 # the int is needed on Windows to convert numpy.uint32 objects
                 rnd = random.Random(int(random_seed + idx))
-                rlzs = logictree.sample(gsim_lt, smodel.samples, rnd)
+                rlzs = gsim_lt.sample(smodel.samples, rnd)
+                ordinals = numpy.array([rlz.ordinal for rlz in rlzs])
+                weights = numpy.array([rlz.weight for rlz in rlzs], object)
             else:  # full enumeration
-                rlzs = logictree.get_effective_rlzs(gsim_lt)
-            if rlzs:
-                indices = numpy.arange(idx, idx + len(rlzs))
+                ordinals, weights = gsim_lt.get_effective_paths()
+            if self.selection:
+                smpath = '_'.join(smodel.path)
+                ok = self.is_selected(smpath, gsim_lt, ordinals)
+                ordinals, weights = ordinals[ok], weights[ok]
+            if len(ordinals):
+                indices = numpy.arange(idx, idx + len(ordinals))
                 idx += len(indices)
-                assoc._add_realizations(indices, smodel, gsim_lt, rlzs)
+                assoc._add_realizations(
+                    indices, smodel, gsim_lt, ordinals, weights)
             elif trts:
                 logging.warn('No realizations for %s, %s',
                              '_'.join(smodel.path), smodel.name)
         # NB: realizations could be filtered away by logic tree reduction
-        if assoc.realizations:
+        if assoc.gsim_paths:
             assoc._init()
         return assoc
 
@@ -477,6 +620,242 @@ class CompositionInfo(object):
             self.__class__.__name__, '\n'.join(summary))
 
 
+def _update(md5, obj):
+    # feed the digest with a canonical representation of the object,
+    # walking recursively the containers and the attributes of the objects
+    # in sorted order, so that the result depends neither on the insertion
+    # order of the attributes nor on the hash seed
+    if isinstance(obj, numpy.ndarray):
+        md5.update(('array %s %s' % (obj.dtype.str, obj.shape)).encode())
+        if obj.dtype.hasobject:
+            for item in obj.flat:
+                _update(md5, item)
+        else:
+            md5.update(numpy.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, numpy.generic):
+        _update(md5, obj.item())
+    elif obj is None or isinstance(obj, (bool, int, float, str, bytes,
+                                         type(u''), Decimal)):
+        md5.update(('%s %r' % (type(obj).__name__, obj)).encode('utf8'))
+    elif isinstance(obj, (list, tuple)):
+        md5.update(('%s %d' % (type(obj).__name__, len(obj))).encode())
+        for item in obj:
+            _update(md5, item)
+    elif isinstance(obj, dict):
+        md5.update(('dict %d' % len(obj)).encode())
+        for key in sorted(obj, key=repr):
+            _update(md5, key)
+            _update(md5, obj[key])
+    elif isinstance(obj, (set, frozenset)):
+        md5.update(('set %d' % len(obj)).encode())
+        for item in sorted(obj, key=repr):
+            _update(md5, item)
+    elif hasattr(obj, '__dict__') or hasattr(obj, '__slots__'):
+        attrs = getattr(obj, '__dict__', None)
+        if attrs is None:  # object with __slots__
+            attrs = {name: getattr(obj, name) for name in obj.__slots__
+                     if hasattr(obj, name)}
+        md5.update(obj.__class__.__name__.encode('utf8'))
+        _update(md5, attrs)
+    else:  # other scalars, like the long integers in Python 2
+        md5.update(('%s %r' % (type(obj).__name__, obj)).encode('utf8'))
+
+
+def get_checksum(src):
+    """
+    :param src: a hazardlib source
+    :returns: a hex digest of the parameters of the source, excluding the
+              attributes depending on the calculation, like the source
+              group ID and the number of affected sites; it is the same
+              in every run, since the attributes are walked in sorted order
+    """
+    md5 = hashlib.md5()
+    _update(md5, src.__class__.__name__)
+    _update(md5, {name: value for name, value in vars(src).items()
+                  if name not in CALC_ATTRS})
+    return md5.hexdigest()
+
+
+class SplitCache(object):
+    """
+    A directory of pickle files containing the results of
+    :func:`openquake.hazardlib.sourceconverter.split_source`, keyed by
+    the checksum of the original source and the version of hazardlib.
+    The discretization parameters (mesh spacings, area source
+    discretization, width of the MFD bins) are attributes of the sources,
+    so they enter in the checksum. When the size of the files exceeds
+    `maxsize` the least recently used ones are removed; the files which
+    cannot be unpickled are removed and written again.
+
+    :param dirname: the directory of the cache, created if missing
+    :param maxsize: the maximum size of the cache in bytes
+    """
+    def __init__(self, dirname, maxsize=1024 ** 3):
+        self.dirname = dirname
+        self.maxsize = maxsize
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.evict()
+
+    def get_path(self, src):
+        """
+        :returns: the path of the cache file of the given source
+        """
+        key = hashlib.md5(('%s %s' % (
+            get_checksum(src), hazardlib_version)).encode('utf8'))
+        return os.path.join(self.dirname, key.hexdigest() + '.pik')
+
+    def evict(self):
+        """
+        Compute the size of the cache and remove the least recently used
+        files until it is not larger than `maxsize`.
+
+        :returns: the number of removed files
+        """
+        files = []  # (mtime, size, path)
+        for fname in os.listdir(self.dirname):
+            if fname.endswith('.pik'):  # skip the files being written
+                path = os.path.join(self.dirname, fname)
+                try:
+                    st = os.stat(path)
+                except OSError:  # removed by another calculation
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        self.size = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if self.size <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # removed by another calculation
+                pass
+            self.size -= size
+            removed += 1
+        return removed
+
+    def split(self, src):
+        """
+        :param src: a hazardlib source
+        :returns: the list of split sources, read from the cache if possible
+        """
+        path = self.get_path(src)
+        splits = None
+        try:
+            with open(path, 'rb') as f:
+                splits = pickle.load(f)
+            os.utime(path, None)  # mark the file as recently used
+        except (IOError, OSError):  # not cached or evicted in the meantime
+            pass
+        except (EOFError, pickle.UnpicklingError):  # truncated or corrupted
+            logging.warning('Removing the corrupted cache file %s', path)
+            try:
+                self.size -= os.path.getsize(path)
+                os.remove(path)
+            except OSError:  # removed by another calculation
+                pass
+        if splits is None:
+            splits = list(sourceconverter.split_source(src))
+            # write on a temporary file and rename it, since calculations
+            # running at the same time may use the same cache
+            tmp = '%s.%d' % (path, os.getpid())
+            with open(tmp, 'wb') as f:
+                pickle.dump(splits, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+            self.size += os.path.getsize(path)
+            if self.size > self.maxsize:
+                self.evict()
+        for split in splits:  # the cached sources may come from another group
+            split.src_group_id = src.src_group_id
+        return splits
+
+
+class GridSourceFilter(SourceFilter):
+    """
+    A SourceFilter with a grid index over the site collection, built once
+    per calculation. For each source only the sites in the cells touched
+    by its bounding box, enlarged by the integration distance, are
+    checked, so the cost of the filtering depends on the number of sites
+    close to the source and not on the total number of sites. If the
+    parent class has built an R-tree index (i.e. rtree is installed) the
+    R-tree filtering is used instead and the grid is not built.
+
+    :param sitecol: a SiteCollection instance
+    :param integration_distance: the maximum distance dictionary
+    :param cell_size: the size of the cells of the grid, in degrees
+    """
+    def __init__(self, sitecol, integration_distance, cell_size=1.):
+        SourceFilter.__init__(self, sitecol, integration_distance)
+        self.cell_size = cell_size
+        self.ncols = int(math.ceil(360. / cell_size))
+        self.grid = {}  # (col, row) -> indices of the sites in the cell
+        if sitecol is not None and getattr(self, 'index', None) is None:
+            cols = self._col(sitecol.lons)
+            rows = self._row(sitecol.lats)
+            for idx, cell in enumerate(zip(cols, rows)):
+                self.grid.setdefault(cell, []).append(idx)
+            for cell in self.grid:
+                self.grid[cell] = numpy.array(self.grid[cell], U32)
+
+    def _col(self, lons):
+        # lons -> column indices in the range 0..ncols-1
+        return numpy.int64(
+            numpy.floor((numpy.array(lons) + 180.) % 360. / self.cell_size)
+        ) % self.ncols
+
+    def _row(self, lats):
+        # lats -> row indices
+        return numpy.int64(numpy.floor(
+            (numpy.array(lats) + 90.) / self.cell_size))
+
+    def get_site_indices(self, src):
+        """
+        :param src: a seismic source
+        :returns: the sorted indices of the sites inside the bounding box
+                  of the source, enlarged by the integration distance
+        """
+        (west, south), width, height = self.get_rectangle(src)
+        if width >= 360.:
+            cols = range(self.ncols)
+        else:
+            start = int(math.floor((west + 180.) % 360. / self.cell_size))
+            stop = int(math.floor(
+                ((west + 180.) % 360. + width) / self.cell_size))
+            cols = set(col % self.ncols for col in range(start, stop + 1))
+        rows = range(int(self._row(south)), int(self._row(south + height)) + 1)
+        arrays = [self.grid[cell] for cell in
+                  ((col, row) for col in cols for row in rows)
+                  if cell in self.grid]
+        if not arrays:
+            return numpy.zeros(0, U32)
+        idxs = numpy.concatenate(arrays)
+        lons = self.sitecol.lons[idxs]
+        lats = self.sitecol.lats[idxs]
+        ok = (((lons - west) % 360. <= width) &
+              (lats >= south) & (lats <= south + height))
+        return numpy.sort(idxs[ok])
+
+    def __call__(self, sources, sites=None):
+        if sites is not None or not getattr(self, 'grid', None) or (
+                not self.integration_distance):
+            for src, s_sites in SourceFilter.__call__(self, sources, sites):
+                yield src, s_sites
+            return
+        for src in sources:
+            idxs = self.get_site_indices(src)
+            if len(idxs) == 0:
+                continue
+            elif len(idxs) == len(self.sitecol):
+                sites = self.sitecol
+            else:  # the positions are converted into site IDs, since
+                # the site collection can be itself a filtered one
+                sites = site.FilteredSiteCollection(
+                    self.sitecol.sids[idxs], self.sitecol.complete)
+            # the exact check on the few sites close to the source
+            for pair in SourceFilter.__call__(self, [src], sites):
+                yield pair
+
+
 class CompositeSourceModel(collections.Sequence):
     """
     :param source_model_lt:
@@ -492,6 +871,7 @@ class CompositeSourceModel(collections.Sequence):
         self.source_models = source_models
         self.source_info = ()
         self.split_map = {}
+        self.split_cache = None  # SplitCache instance used by split_sources
         if set_weight:
             self.set_weights()
         else:
@@ -501,7 +881,7 @@ class CompositeSourceModel(collections.Sequence):
             gsim_lt, self.source_model_lt.seed,
             self.source_model_lt.num_samples,
             [sm.get_skeleton() for sm in self.source_models],
-            self.weight)
+            self.weight, self.source_model_lt.selection)
         # dictionary src_group_id, source_id -> SourceInfo,
         # populated by the split_sources method
         self.infos = {}
@@ -627,6 +1007,10 @@ class CompositeSourceModel(collections.Sequence):
         :param src_filter: SourceFilter instance
         :param maxweight: weight used to decide if a source is light
         :yields: blocks of sources of weight around maxweight
+
+        If the attribute .split_cache is set, the heavy sources without
+        rupture serials are split once and for all and the split sources
+        are read from the cache in the following calculations.
         """
         light = [src for src in sources if src.weight <= maxweight]
         for src in light:
@@ -637,7 +1021,11 @@ class CompositeSourceModel(collections.Sequence):
         heavy = [src for src in sources if src.weight > maxweight]
         for src in heavy:
             self.infos[src.src_group_id, src.source_id] = SourceInfo(src)
-            srcs = sourceconverter.split_filter_source(src, src_filter)
+            if self.split_cache and getattr(src, 'serial', None) is None:
+                srcs = [split for split, _sites in src_filter(
+                    self.split_cache.split(src))]
+            else:
+                srcs = sourceconverter.split_filter_source(src, src_filter)
             if len(srcs) > 1:
                 logging.info(
                     'Splitting %s "%s" in %d sources', src.__class__.__name__,
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2017 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+"""
+A binary format for the source models, which can be read without
+parsing XML. A source model in NRML format can be converted with the
+command `oq to_hdf5 source_model.xml`; the generated file
+`source_model.hdf5` can be used in the source model logic tree in place
+of the original one. The layout of the file is the following::
+
+  /                       attributes `xmlns` and `name` of the source model
+  /grp-XX                 a group per source group, with the attributes
+                          of the `<sourceGroup>` node
+  /grp-XX/<type>-YY       a table of sources of the same type and structure
+
+For NRML 0.4 files, which have no `<sourceGroup>` nodes, the sources are
+grouped by tectonic region type. Each table contains the sources with the
+same *signature*, i.e. with the same nodes and attributes: for instance
+all the point sources with two nodal planes and one hypocentral depth
+end up in the same table. A field of the table stores a leaf of the
+XML tree, i.e. the text of a node or one of its attributes, and its name
+is the path to the leaf: `@id` is the ID of the source, `magScaleRel` the
+text of the magnitude scaling relationship node and
+`nodalPlaneDist/nodalPlane~1@strike` the strike of the second nodal
+plane. Numbers are stored in float64, int64 and bool fields, strings in
+variable length string fields and lists of floats (like `posList` or
+`occurRates`) in variable length float64 fields. The field `ordinal`
+contains the position of the source in its group, so that the original
+order is preserved.
+"""
+import operator
+import collections
+import numpy
+import h5py
+
+from openquake.baselib import hdf5
+from openquake.baselib.node import Node, striptag
+from openquake.baselib.python3compat import decode
+from openquake.hazardlib import nrml
+
+U32 = numpy.uint32
+F64 = numpy.float64
+vfloat64 = h5py.special_dtype(vlen=F64)
+
+
+def _leaves(node, path=''):
+    # yield pairs (path, value) for the attributes and the texts of the
+    # node and of its subnodes, in document order
+    for name, value in node.attrib.items():
+        yield '%s@%s' % (path, name), value
+    if node.text is not None and not (
+            isinstance(node.text, str) and not node.text.strip()):
+        yield path, node.text
+    counts = collections.Counter()
+    for child in node:
+        tag = striptag(child.tag)
+        step = '%s~%d' % (tag, counts[tag]) if counts[tag] else tag
+        counts[tag] += 1
+        for pair in _leaves(child, path + '/' + step if path else step):
+            yield pair
+
+
+def _get_dtype(path, value):
+    # the type of the field storing the given value
+    if isinstance(value, (bool, numpy.bool_)):
+        return numpy.bool_
+    elif isinstance(value, (int, numpy.integer)):
+        return numpy.int64
+    elif isinstance(value, (float, numpy.floating)):
+        return F64
+    elif isinstance(value, (str, bytes, type(u''))):
+        return hdf5.vstr
+    elif isinstance(value, (list, tuple, numpy.ndarray)) and all(
+            isinstance(x, (int, float, numpy.number)) for x in value):
+        return vfloat64
+    raise ValueError('Cannot store %s=%r' % (path, value))
+
+
+def _pyvalue(value):
+    # convert a value read from HDF5 into a Python object
+    if isinstance(value, bytes):
+        return decode(value)
+    elif hasattr(value, 'tolist'):
+        return value.tolist()
+    return value
+
+
+def _get_source_groups(smodel):
+    # returns a list of <sourceGroup> nodes, also for NRML 0.4 files
+    if smodel[0].tag.endswith('sourceGroup'):  # NRML 0.5 format
+        return list(smodel)
+    groups = collections.OrderedDict()
+    for src_node in smodel:
+        trt = src_node['tectonicRegion']
+        if trt not in groups:
+            groups[trt] = Node('sourceGroup',
+                               dict(name=trt, tectonicRegion=trt), nodes=[])
+        groups[trt].nodes.append(src_node)
+    return list(groups.values())
+
+
+def convert_xml_hdf5(input_file, output_file):
+    """
+    Convert a source model in NRML format into the HDF5 format.
+
+    :param input_file: the path of the XML file
+    :param output_file: the path of the HDF5 file
+    :returns: the path of the HDF5 file
+    """
+    root = nrml.read(input_file)
+    smodel = root.sourceModel
+    with hdf5.File(output_file, 'w') as out:
+        out.attrs['xmlns'] = root['xmlns']
+        out.attrs['name'] = smodel.attrib.get('name', '')
+        for i, sg_node in enumerate(_get_source_groups(smodel)):
+            grp = out.create_group('grp-%02d' % i)
+            for name, value in sg_node.attrib.items():
+                grp.attrs[name] = value
+            # signature -> list of (ordinal, values)
+            tables = collections.OrderedDict()
+            for ordinal, src_node in enumerate(sg_node):
+                leaves = list(_leaves(src_node))
+                signature = (striptag(src_node.tag),) + tuple(
+                    (path, _get_dtype(path, value)) for path, value in leaves)
+                tables.setdefault(signature, []).append(
+                    (ordinal, [value for path, value in leaves]))
+            for j, (signature, rows) in enumerate(tables.items()):
+                tag, fields = signature[0], signature[1:]
+                array = numpy.zeros(
+                    len(rows), [('ordinal', U32)] + list(fields))
+                array['ordinal'] = [ordinal for ordinal, values in rows]
+                for f, (path, dt) in enumerate(fields):
+                    column = array[path]
+                    for r, (ordinal, values) in enumerate(rows):
+                        column[r] = (numpy.array(values[f], F64)
+                                     if dt is vfloat64 else values[f])
+                dset = grp.create_dataset('%s-%02d' % (tag, j), data=array)
+                dset.attrs['tag'] = tag
+    return output_file
+
+
+def _build_node(tag, leaves):
+    # build a node from a list of pairs (path, value), the inverse of _leaves
+    root = Node(tag, {}, nodes=[])
+    nodes = {'': root}
+    for name, value in leaves:
+        path, _, attr = name.partition('@')
+        if path not in nodes:
+            parent = ''
+            for step in path.split('/'):
+                current = parent + '/' + step if parent else step
+                if current not in nodes:
+                    nodes[current] = node = Node(
+                        step.split('~')[0], {}, nodes=[])
+                    nodes[parent].nodes.append(node)
+                parent = current
+        if attr:
+            nodes[path].attrib[attr] = value
+        else:
+            nodes[path].text = value
+    return root
+
+
+def read_source_model(fname):
+    """
+    Read a source model in HDF5 format as a tree of nodes, like the one
+    returned by `nrml.read(fname).sourceModel` for a NRML 0.5 file.
+
+    :param fname: the path of the HDF5 file
+    :returns: a sourceModel node containing sourceGroup nodes
+    """
+    sg_nodes = []
+    with hdf5.File(fname, 'r') as f:
+        smodel = Node('sourceModel', dict(name=_pyvalue(f.attrs['name'])))
+        for key in sorted(f, key=lambda k: int(k.split('-')[1])):
+            grp = f[key]
+            pairs = []  # (ordinal, source node)
+            for dkey in grp:
+                dset = grp[dkey]
+                tag = _pyvalue(dset.attrs['tag'])
+                array = dset[()]
+                names = array.dtype.names[1:]
+                columns = [[_pyvalue(x) for x in array[name]]
+                           for name in names]
+                for r, ordinal in enumerate(array['ordinal']):
+                    leaves = [(name, col[r])
+                              for name, col in zip(names, columns)]
+                    pairs.append((ordinal, _build_node(tag, leaves)))
+            pairs.sort(key=operator.itemgetter(0))
+            attrib = {name: _pyvalue(value)
+                      for name, value in grp.attrs.items()}
+            sg_nodes.append(Node('sourceGroup', attrib,
+                                 nodes=[node for _, node in pairs]))
+    smodel.nodes = sg_nodes
+    return smodel
+
+
+def read_source_groups(fname, converter):
+    """
+    Read a source model in HDF5 format and convert it into source groups.
+
+    :param fname: the path of the HDF5 file
+    :param converter: a SourceConverter instance
+    :returns: a list of SourceGroups
+    """
+    converter.fname = fname
+    return [converter.convert_node(sg_node)
+            for sg_node in read_source_model(fname)]
@@ -118,3 +118,37 @@ class HazardMapsTestCase(unittest.TestCase):
         ]
         actual = calc.compute_hazard_maps(numpy.array(curves), imls, poes)
         aaae(expected, actual.T)
+
+
+class GmvsToPoesTestCase(unittest.TestCase):
+
+    def test_same_as_single_site(self):
+        rng = numpy.random.RandomState(42)
+        imls = [0.005, 0.01, 0.05, 0.1, 0.2, 0.5]
+        # the GMVs of 10 sites, with a level repeated exactly
+        gmvs_by_site = [numpy.float32(rng.lognormal(-3, 1, rng.randint(1, 30)))
+                        for _ in range(10)]
+        gmvs_by_site[0][0] = 0.05
+        idxs = numpy.repeat(numpy.arange(10), list(map(len, gmvs_by_site)))
+        poes = calc.gmvs_to_poes(
+            idxs, numpy.concatenate(gmvs_by_site), imls, 10, 50., 500.)
+        for i, gmvs in enumerate(gmvs_by_site):
+            numpy.testing.assert_equal(
+                poes[i], calc._gmvs_to_haz_curve(gmvs, imls, 50., 500.))
+
+
+class SparseGmfsTestCase(unittest.TestCase):
+    def test_build_and_group(self):
+        gmfa = numpy.array([[[0.1, 0.01, 0.2], [0.02, 0.3, 0.4]]],
+                           numpy.float32)  # shape (I, N, E) = (1, 2, 3)
+        sids = numpy.array([3, 5], numpy.uint32)
+        min_iml = numpy.array([0.05], numpy.float32)
+        array = calc.build_gmv_array(gmfa, sids, min_iml)
+        self.assertEqual(array['sid'].tolist(), [3, 3, 5, 5])
+        self.assertEqual(array['eid'].tolist(), [0, 2, 1, 2])
+        aaae(array['gmv'], [0.1, 0.2, 0.3, 0.4])
+
+        gmfs = calc.sparse_gmfs(array[::-1], ['PGA'], 6, sids={3})
+        self.assertEqual(len(gmfs['PGA']), 6)
+        self.assertEqual(gmfs['PGA'][3]['eid'].tolist(), [0, 2])
+        self.assertEqual(len(gmfs['PGA'][5]), 0)  # discarded site
@@ -21,7 +21,7 @@ import os
 import unittest
 import tempfile
 import numpy
-from openquake.commonlib.datastore import DataStore, read
+from openquake.commonlib.datastore import DataStore, read, storage_profile
 
 
 class DataStoreTestCase(unittest.TestCase):
@@ -78,6 +78,36 @@ class DataStoreTestCase(unittest.TestCase):
         attrs = sorted(self.dstore.attrs.items())
         self.assertEqual(attrs, [('a', 2), ('b', 2)])
 
+    def test_storage_profiles(self):
+        # the default profile of avg_losses-rlzs is chunked by column
+        dset = self.dstore.create_dset(
+            'avg_losses-rlzs', numpy.float32, (10, 3, 2))
+        self.assertEqual(dset.compression, 'gzip')
+        self.assertTrue(dset.shuffle)
+        self.assertEqual(dset.chunks, (10, 1, 1))
+
+        # extendable datasets are created with the profile of the group
+        array = numpy.arange(5, dtype=numpy.float32)
+        dset = self.dstore.extend('gmf_data/sm-0000/0000', array)
+        self.assertEqual(dset.compression, 'gzip')
+        numpy.testing.assert_equal(dset.value, array)
+
+        # the profiles can be overridden, as from the job.ini
+        self.dstore.set_storage_profiles({'gmf_data': 'none 100'})
+        dset = self.dstore.extend('gmf_data/sm-0000/0001', array)
+        self.assertIsNone(dset.compression)
+        self.assertEqual(dset.chunks, (100,))
+
+        # datasets without a profile are not compressed nor chunked
+        dset = self.dstore.create_dset('other', numpy.float32, (4,))
+        self.assertIsNone(dset.compression)
+        self.assertIsNone(dset.chunks)
+
+        with self.assertRaises(ValueError):
+            storage_profile('zip 1000')
+        with self.assertRaises(ValueError):
+            storage_profile('gzip 0,1')
+
     def test_export_path(self):
         path = self.dstore.export_path('hello.txt')
         mo = re.match('\./hello_\d+', path)
@@ -270,6 +270,17 @@ class HazardCurveWriterSerializeTestCase(HazardCurveWriterTestCase):
         writer.serialize(self.data)
         check_equal(__file__, 'expected_hazard_curves.xml', path)
 
+    def test_serialize_generator(self):
+        # the curves are consumed lazily while writing the file
+        metadata = dict(
+            investigation_time=self.TIME, imt='SA', imls=self.IMLS,
+            sa_period=0.025, sa_damping=5.0, smlt_path='b1_b2_b4',
+            gsimlt_path='b1_b4_b5'
+        )
+        writer = writers.HazardCurveXMLWriter(path, **metadata)
+        writer.serialize(hc for hc in self.data)
+        check_equal(__file__, 'expected_hazard_curves.xml', path)
+
     def test_serialize_geojson(self):
         expected = {
             u'features': [
@@ -414,6 +425,15 @@ class HazardMapWriterTestCase(HazardWriterTestCase):
         writer.serialize(self.data)
         check_equal(__file__, 'expected_hazard_map.xml',  path)
 
+    def test_serialize_xml_generator(self):
+        metadata = dict(
+            investigation_time=50.0, imt='SA', poe=0.1, sa_period=0.025,
+            sa_damping=5.0, smlt_path='b1_b2_b4', gsimlt_path='b1_b4_b5'
+        )
+        writer = writers.HazardMapXMLWriter(path, **metadata)
+        writer.serialize(iter(self.data))
+        check_equal(__file__, 'expected_hazard_map.xml',  path)
+
     def test_serialize_geojson(self):
         expected = {
             'type': 'FeatureCollection',
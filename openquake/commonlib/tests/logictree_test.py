@@ -2208,6 +2208,53 @@ class GsimLogicTreeTestCase(unittest.TestCase):
         effective_rlzs = set(rlz.uid for rlz in fs_bg_model_lt)
         self.assertEqual(len(effective_rlzs), 5 * 4)
 
+    def test_mixed_radix(self):
+        xml = codecs.open(
+            os.path.join(DATADIR, 'gmpe_logic_tree_share_reduced.xml'),
+            encoding='utf8').read().encode('utf8')
+        gsim_lt = self.parse_valid(
+            xml, ['Active Shallow Crust', 'Stable Shallow Crust'])
+        rlzs = list(gsim_lt)
+        for rlz in rlzs:
+            self.assertEqual(gsim_lt.get_rlz(rlz.ordinal), rlz)
+        # the effective realizations are built without enumerating all paths
+        self.assertEqual(gsim_lt.get_effective_rlzs(),
+                         logictree.get_effective_rlzs(rlzs))
+        ordinals, weights = gsim_lt.get_effective_paths()
+        self.assertEqual(list(ordinals), [rlz.ordinal for rlz in
+                                          gsim_lt.get_effective_rlzs()])
+        # the sampling is the same as sampling the list of all paths
+        for seed in range(10):
+            self.assertEqual(
+                gsim_lt.sample(5, random.Random(seed)),
+                logictree.sample(rlzs, 5, random.Random(seed)))
+
+    def test_parse_path(self):
+        xml = codecs.open(
+            os.path.join(DATADIR, 'gmpe_logic_tree_share_reduced.xml'),
+            encoding='utf8').read().encode('utf8')
+        gsim_lt = self.parse_valid(xml, ['Active Shallow Crust'])
+        # the branch IDs contain underscores, like b1_1
+        for rlz in gsim_lt.get_effective_rlzs():
+            self.assertEqual(gsim_lt.parse_path(rlz.uid), rlz.lt_uid)
+        with self.assertRaises(ValueError):
+            gsim_lt.parse_path('b1_1_b2_1')
+
+    def test_select(self):
+        xml = codecs.open(
+            os.path.join(DATADIR, 'gmpe_logic_tree_share_reduced.xml'),
+            encoding='utf8').read().encode('utf8')
+        gsim_lt = self.parse_valid(xml, ['Active Shallow Crust'])
+        ordinals, weights = gsim_lt.get_effective_paths()
+        rlzs = gsim_lt.get_effective_rlzs()
+        # '@' means any branch
+        anypath = ('@',) * len(gsim_lt.all_trts)
+        self.assertEqual(gsim_lt.select(ordinals, [anypath]).sum(), len(rlzs))
+        # a path selected twice is counted once
+        path = rlzs[1].lt_uid
+        selected = gsim_lt.select(ordinals, [path, path])
+        self.assertEqual(list(selected.nonzero()[0]), [1])
+
     def test_sampling(self):
         xml = _make_nrml("""\
         <logicTree logicTreeID="lt1">
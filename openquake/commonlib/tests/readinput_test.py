@@ -29,7 +29,7 @@ from numpy.testing import assert_allclose
 from openquake.hazardlib import valid
 from openquake.commonlib import readinput, writers
 from openquake.baselib import general
-from openquake.qa_tests_data.classical import case_1, case_2
+from openquake.qa_tests_data.classical import case_1, case_2, case_15
 
 TMP = tempfile.gettempdir()
 DATADIR = os.path.join(os.path.dirname(__file__), 'data')
@@ -806,3 +806,33 @@ class GetCompositeSourceModelTestCase(unittest.TestCase):
         csm = readinput.get_composite_source_model(oq, in_memory=False)
         srcs = csm.get_sources()  # a single PointSource
         self.assertEqual(len(srcs), 1)
+
+    def test_shared_sources(self):
+        # the uncertainty on the maximum magnitude is applied only to src01
+        oq = readinput.get_oqparam(
+            os.path.join(DATADIR, 'classical_job_overlay.ini'))
+        csm = readinput.get_composite_source_model(oq)
+        sm1, sm2 = csm.source_models
+        srcs1 = {src.source_id: src for sg in sm1.src_groups for src in sg}
+        srcs2 = {src.source_id: src for sg in sm2.src_groups for src in sg}
+        self.assertAlmostEqual(srcs1['src01'].mfd.max_mag, 7.2)
+        self.assertAlmostEqual(srcs2['src01'].mfd.max_mag, 6.8)
+        # the other sources share the MFD and the geometry
+        for src_id in ('src02', 'src03'):
+            self.assertIsNot(srcs1[src_id], srcs2[src_id])
+            self.assertIs(srcs1[src_id].mfd, srcs2[src_id].mfd)
+        # the group of src03 is unmodified
+        self.assertEqual([sg.base is None for sg in sm1.src_groups],
+                         [True, False])
+        self.assertEqual(sm1.src_groups[1].base, sm2.src_groups[1].base)
+
+    def test_parallel_parsing(self):
+        # the two files are parsed by different tasks, but the source
+        # models and the sources are numbered in the logic tree order
+        oq = readinput.get_oqparam('job.ini', case_15)
+        csm = readinput.get_composite_source_model(oq)
+        self.assertEqual([sm.name for sm in csm.source_models],
+                         ['source_model_1.xml', 'source_model_2.xml',
+                          'source_model_2.xml'])
+        ids = [src.id for src in csm.get_sources()]
+        self.assertEqual(ids, list(range(len(ids))))
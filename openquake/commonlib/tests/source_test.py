@@ -18,6 +18,8 @@
 
 import os
 import mock
+import shutil
+import tempfile
 import unittest
 from io import BytesIO
 
@@ -31,10 +33,11 @@ from openquake.hazardlib import pmf
 from openquake.hazardlib import scalerel
 from openquake.hazardlib import source, sourceconverter as s
 from openquake.hazardlib.tom import PoissonTOM
-from openquake.hazardlib.calc.filters import context
+from openquake.hazardlib.calc.filters import context, SourceFilter
 from openquake.commonlib import tests, nrml_examples, readinput
-from openquake.commonlib.source import CompositionInfo
-from openquake.hazardlib import nrml
+from openquake.commonlib.source import (
+    CompositionInfo, GridSourceFilter, SplitCache, get_checksum)
+from openquake.hazardlib import nrml, valid
 from openquake.baselib.general import assert_close
 
 # directory where the example files are
@@ -690,6 +693,22 @@ class SourceGroupTestCase(unittest.TestCase):
         self.check('Stable Continental Crust', 'min_mag', 5.5)
         self.check('Active Shallow Crust', 'min_mag', 5.0)
 
+    def test_grid_filter(self):
+        # the grid index must not change the result of the filtering,
+        # also for a site collection which is itself filtered
+        filtered = self.sitecol.filter(numpy.array([1, 0, 1, 1, 0], bool))
+        for sitecol in (self.sitecol, filtered):
+            for maxdist in ('10', '200', '5000'):
+                idist = valid.maximum_distance(maxdist)
+                for sc in self.source_collector.values():
+                    expected = [(src.source_id, list(sites.sids))
+                                for src, sites in SourceFilter(
+                                    sitecol, idist)(sc)]
+                    actual = [(src.source_id, list(sites.sids))
+                              for src, sites in GridSourceFilter(
+                                  sitecol, idist)(sc)]
+                    self.assertEqual(actual, expected)
+
     def test_repr(self):
         self.assertEqual(
             repr(self.source_collector['Volcanic']),
@@ -766,6 +785,8 @@ Subduction Interface,b3,SadighEtAl1997(),w=1.0>''')
         self.assertEqual(assoc.gsim_by_trt[rlz.ordinal],
                          {'Subduction Interface': 'SadighEtAl1997()',
                           'Active Shallow Crust': 'ChiouYoungs2008()'})
+        self.assertEqual(assoc.get_gsims('Active Shallow Crust'),
+                         ['ChiouYoungs2008()'])
         # ignoring the end of the tuple, with the uid field
         self.assertEqual(rlz.ordinal, 0)
         self.assertEqual(rlz.sm_lt_path, ('b1', 'b5', 'b8'))
@@ -802,6 +823,14 @@ Subduction Interface,b3,SadighEtAl1997(),w=1.0>''')
 1,ChiouYoungs2008(): ['<1,b1_b3_b6~b2_b3,w=0.5>']
 4,SadighEtAl1997(): ['<5,b1_b3_b8~b2_b3,w=0.5>']
 5,ChiouYoungs2008(): ['<5,b1_b3_b8~b2_b3,w=0.5>']>""")
+        # the realizations are given as ordinals, without building them
+        self.assertEqual(list(assoc.rlzis), [1, 5])
+        self.assertEqual(
+            {grp_id: list(rlzis)
+             for grp_id, rlzis in assoc.get_rlzs_by_grp_id().items()},
+            {0: [1], 1: [1], 4: [5], 5: [5]})
+        self.assertEqual(assoc.get_sm_id_by_rlz(), {1: 0, 5: 2})
+        self.assertEqual(assoc.get_sampleids(0), {})  # no sampling
 
         # removing 9 src_groups out of 18
         def count_ruptures(src_group):
@@ -847,6 +876,66 @@ Subduction Interface,b3,SadighEtAl1997(),w=1.0>''')
         self.assertEqual(repr(new), repr(csm.info))
 
 
+class SplitCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dirname)
+
+    def test(self):
+        parser = nrml.SourceModelParser(s.SourceConverter(
+            investigation_time=50.,
+            rupture_mesh_spacing=1,  # km
+            complex_fault_mesh_spacing=1,  # km
+            width_of_mfd_bin=1.,  # for Truncated GR MFDs
+            area_source_discretization=1.))
+        [_, _, [area, _], _] = parser.parse_groups(MIXED_SRC_MODEL)
+        area.src_group_id = 1
+        expected = [(split.source_id, split.num_ruptures)
+                    for split in s.split_source(area)]
+        cache = SplitCache(self.dirname)
+        for _ in range(2):  # the second time the cache is used
+            splits = cache.split(area)
+            self.assertEqual([(split.source_id, split.num_ruptures)
+                              for split in splits], expected)
+        self.assertEqual(len(os.listdir(self.dirname)), 1)
+
+        # the group ID does not enter in the checksum
+        area.src_group_id = 2
+        splits = cache.split(area)
+        self.assertEqual(set(split.src_group_id for split in splits), {2})
+        self.assertEqual(len(os.listdir(self.dirname)), 1)
+
+        # while the discretization does
+        first = cache.get_path(area)
+        area.area_discretization *= 2
+        cache.split(area)
+        self.assertEqual(len(os.listdir(self.dirname)), 2)
+
+        # the checksum does not depend on the order of the attributes
+        clone = object.__new__(area.__class__)
+        for name in reversed(list(vars(area))):
+            setattr(clone, name, getattr(area, name))
+        self.assertEqual(get_checksum(clone), get_checksum(area))
+
+        # when the cache is full the least recently used files are removed
+        os.utime(first, (0, 0))
+        cache.maxsize = cache.size - 1
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual(os.listdir(self.dirname),
+                         [os.path.basename(cache.get_path(area))])
+
+        # a truncated file is removed and written again
+        path = cache.get_path(area)
+        expected = len(cache.split(area))
+        with open(path, 'r+b') as f:
+            f.truncate(10)
+        self.assertEqual(len(cache.split(area)), expected)
+        with open(path, 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertEqual(len(cache.split(area)), expected)
+
+
 class FilterSourceTestCase(unittest.TestCase):
     bad_source = BytesIO(b'''\
 <?xml version="1.0" encoding="utf-8"?>
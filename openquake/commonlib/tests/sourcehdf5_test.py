@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2017 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+from openquake.baselib.general import assert_close
+from openquake.hazardlib.nrml import SourceModelParser
+from openquake.hazardlib.sourceconverter import SourceConverter
+from openquake.commonlib import nrml_examples, sourcehdf5
+from openquake.qa_tests_data.classical import case_10
+
+MIXED = os.path.join(os.path.dirname(nrml_examples.__file__),
+                     'source_model/mixed.xml')
+
+# a NRML 0.4 source model, without source groups
+NRML04 = os.path.join(os.path.dirname(case_10.__file__), 'source_model.xml')
+
+
+class SourceHdf5TestCase(unittest.TestCase):
+
+    def convert(self, xmlfile):
+        fh, hdf5file = tempfile.mkstemp(suffix='.hdf5')
+        os.close(fh)
+        self.addCleanup(os.remove, hdf5file)
+        return sourcehdf5.convert_xml_hdf5(xmlfile, hdf5file)
+
+    def check_roundtrip(self, xmlfile):
+        converter = SourceConverter(50., 1., 1., 0.1, 10.)
+        expected = SourceModelParser(converter).parse_src_groups(xmlfile)
+        groups = sourcehdf5.read_source_groups(
+            self.convert(xmlfile), converter)
+        self.assertEqual([grp.trt for grp in groups],
+                         [grp.trt for grp in expected])
+        for grp, exp in zip(groups, expected):
+            self.assertEqual([src.source_id for src in grp],
+                             [src.source_id for src in exp])
+            for src, e in zip(grp, exp):
+                self.assertEqual(src.__class__, e.__class__)
+                self.assertEqual(src.count_ruptures(), e.count_ruptures())
+                assert_close(src.mfd.get_annual_occurrence_rates(),
+                             e.mfd.get_annual_occurrence_rates())
+
+    def test_nrml05(self):
+        self.check_roundtrip(MIXED)
+
+    def test_nrml04(self):
+        self.check_roundtrip(NRML04)
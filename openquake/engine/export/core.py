@@ -26,7 +26,8 @@ import sys
 import zipfile
 import traceback
 
-from openquake.calculators.export import export
+from openquake.baselib.performance import Monitor
+from openquake.calculators.export import export, export_parallel
 from openquake.commonlib import datastore, logs, __version__
 
 
@@ -70,7 +71,6 @@ def export_from_db(output_key, calc_id, datadir, target):
     """
     makedirs(target)
     export.from_db = True
-    ds_key, fmt = output_key
     with datastore.read(calc_id, datadir=datadir) as dstore:
         dstore.export_dir = target
         try:
@@ -82,21 +82,27 @@ def export_from_db(output_key, calc_id, datadir, target):
             raise DataStoreExportError(
                 'Could not export %s in %s%s\n%s%s' %
                 (output_key + (version, tb_str, err)))
-        if not exported:
-            raise DataStoreExportError(
-                'Nothing to export for %s' % ds_key)
-        elif len(exported) > 1:
-            # NB: I am hiding the archive by starting its name with a '.',
-            # to avoid confusing the users, since the unzip files are
-            # already in the target directory; the archive is used internally
-            # by the WebUI, so it must be there; it would be nice not to
-            # generate it when not using the Web UI, but I will leave that
-            # feature for after the removal of the old calculators
-            archname = '.' + ds_key + '-' + fmt + '.zip'
-            zipfiles(exported, os.path.join(target, archname))
-            return os.path.join(target, archname)
-        else:  # single file
-            return exported[0]
+        return _archive(exported, output_key, target)
+
+
+def _archive(exported, output_key, target):
+    # return the exported file or an archive containing the exported files
+    ds_key, fmt = output_key
+    if not exported:
+        raise DataStoreExportError(
+            'Nothing to export for %s' % ds_key)
+    elif len(exported) > 1:
+        # NB: I am hiding the archive by starting its name with a '.',
+        # to avoid confusing the users, since the unzip files are
+        # already in the target directory; the archive is used internally
+        # by the WebUI, so it must be there; it would be nice not to
+        # generate it when not using the Web UI, but I will leave that
+        # feature for after the removal of the old calculators
+        archname = '.' + ds_key + '-' + fmt + '.zip'
+        zipfiles(exported, os.path.join(target, archname))
+        return os.path.join(target, archname)
+    else:  # single file
+        return exported[0]
 
 #: Used to separate node labels in a logic tree path
 LT_PATH_JOIN_TOKEN = '_'
@@ -117,14 +123,41 @@ def makedirs(path):
 
 
 def export_outputs(job_id, target_dir, export_types):
+    """
+    Export all the outputs of the given job in parallel, by using
+    :func:`openquake.calculators.export.export_parallel`, and yield
+    a summary of files exported.
+    """
     # make it possible commands like `oq engine --eos -1 /tmp`
     datadir, dskeys = logs.dbcmd('get_results', job_id)
     if not dskeys:
         yield('Found nothing to export for job %s' % job_id)
+    outkeys = []
     for dskey in dskeys:
-        yield('Exporting %s...' % dskey)
-        for line in export_output(
-                dskey, job_id, datadir, target_dir, export_types):
+        outkey = get_outkey(dskey, export_types.split(','))
+        if not outkey:
+            yield 'There is no exporter for %s, %s' % (dskey, export_types)
+        else:
+            outkeys.append(outkey)
+    if not outkeys:
+        return
+    makedirs(target_dir)
+    export.from_db = True
+    with datastore.read(job_id, datadir=datadir) as dstore:
+        dstore.export_dir = target_dir
+        try:
+            exported = export_parallel(outkeys, dstore, Monitor('export'))
+        except Exception:
+            etype, err, tb = sys.exc_info()
+            tb_str = ''.join(traceback.format_tb(tb))
+            version = check_version(dstore)
+            raise DataStoreExportError(
+                'Could not export %s in %s%s\n%s%s' %
+                (outkeys, job_id, version, tb_str, err))
+    for outkey in outkeys:
+        yield('Exporting %s...' % outkey[0])
+        the_file = _archive(exported.get(outkey, []), outkey, target_dir)
+        for line in _summary(the_file):
             yield line
 
 
@@ -148,6 +181,12 @@ def export_output(dskey, calc_id, datadir, target_dir, export_types):
         yield 'There is no exporter for %s, %s' % (dskey, export_types)
         return
     the_file = export_from_db(outkey, calc_id, datadir, target_dir)
+    for line in _summary(the_file):
+        yield line
+
+
+def _summary(the_file):
+    # yield the names of the exported files
     if the_file.endswith('.zip'):
         dname = os.path.dirname(the_file)
         fnames = zipfile.ZipFile(the_file).namelist()
@@ -393,15 +393,18 @@ class CompositeRiskModel(collections.Mapping):
     def __len__(self):
         return len(self._riskmodels)
 
-    def build_input(self, rlzs, hazards_by_site, assetcol, eps_dict):
+    def build_input(self, rlzs, hazards_by_site, assetcol, epsgen=None,
+                    num_events=None):
         """
         :param rlzs: a list of realizations
         :param hazards_by_site: an array of hazards per each site
         :param assetcol: AssetCollection instance
-        :param eps_dict: a dictionary of epsilons
+        :param epsgen: an EpsilonGenerator instance or None
+        :param num_events: the number of events, for sparse GMFs
         :returns: a :class:`RiskInput` instance
         """
-        return RiskInput(rlzs, hazards_by_site, assetcol, eps_dict)
+        return RiskInput(rlzs, hazards_by_site, assetcol, epsgen,
+                         num_events)
 
     def gen_outputs(self, riskinput, monitor, assetcol=None):
         """
@@ -416,13 +419,18 @@ class CompositeRiskModel(collections.Mapping):
         mon_context = monitor('building context')
         mon_hazard = monitor('building hazard')
         mon_risk = monitor('computing risk', measuremem=False)
+        # the curves cached by the classical riskmodels are valid
+        # only for the sites of the current riskinput
+        for riskmodel in self.values():
+            if hasattr(riskmodel, 'cache'):
+                riskmodel.cache.clear()
         with mon_context:
             assets_by_site = (riskinput.assets_by_site if assetcol is None
                               else assetcol.assets_by_site())
             hazard_getter = riskinput.hazard_getter(
                 mon_hazard(measuremem=False))
             if hasattr(hazard_getter, 'init'):  # expensive operation
-                hazard_getter.init()
+                hazard_getter.init(riskinput.rlzs)
 
         # group the assets by taxonomy
         taxonomies = set()
@@ -436,6 +444,8 @@ class CompositeRiskModel(collections.Mapping):
                     dic[taxonomy].append((i, group[taxonomy], epsgetter))
                     taxonomies.add(taxonomy)
         for rlz in riskinput.rlzs:
+            # the realizations of RiskInputFromRuptures are ordinals
+            r = getattr(rlz, 'ordinal', rlz)
             with mon_hazard:
                 hazard = list(hazard_getter(rlz))
             for taxonomy in sorted(taxonomies):
@@ -450,11 +460,12 @@ class CompositeRiskModel(collections.Mapping):
                                 out = riskmodel(lt, assets, haz, epsgetter)
                                 outs[self.lti[lt]] = out
                         row = MultiLoss(self.loss_types, outs)
-                        row.r = rlz.ordinal
+                        row.r = r
                         row.assets = assets
                         yield row
         if hasattr(hazard_getter, 'gmfbytes'):  # for event based risk
             monitor.gmfbytes = hazard_getter.gmfbytes
+            monitor.cache_bytes = hazard_getter.cache_bytes
 
     def __toh5__(self):
         loss_types = hdf5.array_of_vstr(self._get_loss_types())
@@ -481,15 +492,42 @@ class PoeGetter(object):
 gmv_dt = numpy.dtype([('sid', U32), ('eid', U64), ('imti', U8), ('gmv', F32)])
 
 
+class GmvGetter(object):
+    """
+    Callable yielding dictionaries {imt: gmvs} when called on a realization,
+    where gmvs is an array of E ground motion values. The hazard can be
+    stored as sparse arrays with fields 'gmv' and 'eid', containing only
+    the ground motion values above the minimum intensity; the missing
+    values are zeros. A site at the time is densified.
+    """
+    def __init__(self, hazard_by_site, num_events):
+        self.hazard_by_site = hazard_by_site
+        self.num_events = num_events
+
+    def __call__(self, rlz):
+        for haz in self.hazard_by_site:
+            dic = {}
+            for imt in haz:
+                gmvs = haz[imt][rlz]
+                if gmvs.dtype.names:  # sparse array
+                    dic[imt] = dense = numpy.zeros(self.num_events, F32)
+                    dense[gmvs['eid']] = gmvs['gmv']
+                else:
+                    dic[imt] = gmvs
+            yield dic
+
+
 class GmfGetter(object):
     """
     Callable yielding dictionaries {imt: array(gmv, eid)} when called
-    on a realization.
+    on the ordinal of a realization. If the source model is sampled
+    more than once, `sampleids` is a dictionary rlz ordinal -> sample
+    index, used to select the events of the realization.
     """
     dt = numpy.dtype([('gmv', F32), ('eid', U64)])
 
     def __init__(self, gsims, ebruptures, sitecol, imts, min_iml,
-                 truncation_level, correlation_model, samples):
+                 truncation_level, correlation_model, sampleids):
         self.gsims = gsims
         self.ebruptures = ebruptures
         self.sitecol = sitecol
@@ -497,33 +535,83 @@ class GmfGetter(object):
         self.min_iml = min_iml
         self.truncation_level = truncation_level
         self.correlation_model = correlation_model
-        self.samples = samples
+        self.sampleids = sampleids
 
-    def init(self):
+    def init(self, rlzs=None):
         """
         Initialize the computers. Should be called on the workers
+
+        :param rlzs:
+            the ordinals of the realizations that will be passed to the
+            getter, by default all the realizations
         """
         self.sids = self.sitecol.sids
-        self.computers = []
+        # rupture serial -> GmfComputer; the contexts of a rupture are
+        # built only once, when instantiating its computer
+        self.computers = collections.OrderedDict()
         for ebr in self.ebruptures:
             sites = site.FilteredSiteCollection(
                 ebr.sids, self.sitecol.complete)
             computer = calc.gmf.GmfComputer(
                 ebr, sites, self.imts, self.gsims,
                 self.truncation_level, self.correlation_model)
-            self.computers.append(computer)
+            self.computers[ebr.serial] = computer
+        # GSIM -> {(rupture serial, number of events): GMF array}; the
+        # GMFs depend only on the rupture seed, the GSIM and the number
+        # of events, so they are computed once for all the realizations
+        # sharing the same GSIM; the GMFs of a GSIM are discarded after
+        # the last realization using it, and GSIMs used by a single
+        # realization are not cached at all
+        if rlzs is None:
+            self.uses = collections.Counter(str(gsim) for gsim in self.gsims)
+        else:
+            self.uses = collections.Counter(
+                str(self.gsims[rlzi]) for rlzi in rlzs)
+        self.cache = {}
+        self.cache_size = 0  # current size of the cache
+        self.cache_bytes = 0  # peak size of the cache
         self.gmfbytes = 0
 
-    def __call__(self, rlz):
-        gsim = self.gsims[rlz.ordinal]
+    def compute(self, serial, gsim, num_events):
+        """
+        :param serial: the serial of a rupture
+        :param gsim: a GSIM instance
+        :param num_events: the number of events of the rupture
+        :returns: an array of GMFs of shape (I, N, E), possibly cached
+        """
+        key = str(gsim)
+        try:
+            return self.cache[key][serial, num_events]
+        except KeyError:
+            array = self.computers[serial].compute(gsim, num_events)
+            if self.uses[key] > 1:  # other realizations will use it
+                self.cache.setdefault(key, {})[serial, num_events] = array
+                self.cache_size += array.nbytes
+                self.cache_bytes = max(self.cache_bytes, self.cache_size)
+            return array
+
+    def release(self, gsim):
+        """
+        Record that a realization has finished using the given GSIM and
+        discard the cached GMFs of the GSIM after its last use.
+        """
+        key = str(gsim)
+        self.uses[key] -= 1
+        if self.uses[key] <= 0 and key in self.cache:
+            self.cache_size -= sum(
+                array.nbytes for array in self.cache.pop(key).values())
+
+    def __call__(self, rlzi):
+        gsim = self.gsims[rlzi]
         gmfdict = collections.defaultdict(dict)
-        for computer in self.computers:
+        for serial, computer in self.computers.items():
             rup = computer.rupture
-            if self.samples > 1:
-                eids = get_array(rup.events, sample=rlz.sampleid)['eid']
+            if self.sampleids:
+                eids = get_array(
+                    rup.events, sample=self.sampleids[rlzi])['eid']
             else:
                 eids = rup.events['eid']
-            array = computer.compute(gsim, len(eids))  # (i, n, e)
+            array = self.compute(serial, gsim, len(eids))  # (i, n, e)
             for imti, imt in enumerate(self.imts):
                 min_gmv = self.min_iml[imti]
                 for eid, gmf in zip(eids, array[imti].T):
@@ -534,6 +622,7 @@ class GmfGetter(object):
                                 dic[imt].append((gmv, eid))
                             else:
                                 dic[imt] = [(gmv, eid)]
+        self.release(gsim)
         for sid in self.sids:
             dic = gmfdict[sid]
             for imt in dic:
@@ -541,10 +630,10 @@ class GmfGetter(object):
                 self.gmfbytes += arr.nbytes
             yield dic
 
-    def get(self, rlz):
+    def get(self, rlzi):
         """:returns: array of dtype gmv_dt"""
         gmfcoll = []
-        for i, gmvdict in enumerate(self(rlz)):
+        for i, gmvdict in enumerate(self(rlzi)):
             if gmvdict:
                 sid = self.sids[i]
                 for imti, imt in enumerate(self.imts):
@@ -562,13 +651,16 @@ class RiskInput(object):
     :param imt_taxonomies: a pair (IMT, taxonomies)
     :param hazard_by_site: array of hazards, one per site
     :param assets_by_site: array of assets, one per site
-    :param eps_dict: dictionary of epsilons
+    :param epsgen: an EpsilonGenerator instance or None
+    :param num_events: the number of events, if the hazard is made of GMFs
     """
-    def __init__(self, rlzs, hazard_by_site, assets_by_site, eps_dict):
+    def __init__(self, rlzs, hazard_by_site, assets_by_site, epsgen=None,
+                 num_events=None):
         self.rlzs = rlzs
         self.hazard_by_site = hazard_by_site
+        self.num_events = num_events
         self.assets_by_site = assets_by_site
-        self.eps = eps_dict
+        self.epsgen = epsgen
         taxonomies_set = set()
         aids = []
         for assets in self.assets_by_site:
@@ -590,9 +682,11 @@ class RiskInput(object):
         :param asset_ordinals: list of ordinals of the assets
         :returns: a closure returning an array of epsilons from the event IDs
         """
-        return lambda dummy1, dummy2: (
-            [self.eps[aid] for aid in asset_ordinals]
-            if self.eps else None)
+        if self.epsgen is None:
+            return lambda dummy1, dummy2: None
+        # the event IDs of a scenario are 0, 1, ... num_events - 1
+        eids = numpy.arange(self.num_events)
+        return lambda dummy1, dummy2: self.epsgen(asset_ordinals, eids)
 
     def hazard_getter(self, monitor=Monitor()):
         """
@@ -601,6 +695,8 @@ class RiskInput(object):
         :returns:
             list of hazard dictionaries imt -> rlz -> haz per each site
         """
+        if self.num_events:
+            return GmvGetter(self.hazard_by_site, self.num_events)
         return PoeGetter(self.hazard_by_site)
 
     def __repr__(self):
@@ -632,6 +728,33 @@ def make_eps(assets_by_site, num_samples, seed, correlation):
     return eps
 
 
+class EpsilonMatrix(object):
+    """
+    Wrapper over the rows of a matrix of epsilons built by
+    :func:`make_eps`, with the same interface of a
+    :class:`openquake.risklib.scientific.EpsilonGenerator`.
+
+    :param eps: a matrix A x E or a dictionary asset ordinal -> row
+    """
+    def __init__(self, eps):
+        self.eps = eps
+
+    def reduce(self, aids):
+        """
+        :param aids: asset ordinals
+        :returns: a new EpsilonMatrix with the rows of the given assets only
+        """
+        return self.__class__({aid: self.eps[aid] for aid in aids})
+
+    def __call__(self, aids, eids):
+        """
+        :param aids: an array of A asset ordinals
+        :param eids: an array of E event indices
+        :returns: a matrix of A x E epsilons
+        """
+        return numpy.array([self.eps[aid][eids] for aid in aids], F32)
+
+
 def str2rsi(key):
     """
     Convert a string of the form 'rlz-XXXX/sid-YYYY/ZZZ'
@@ -662,10 +785,10 @@ class RiskInputFromRuptures(object):
     :param trunc_level: truncation level for the GSIMs
     :param correl_model: correlation model for the GSIMs
     :param min_iml: an array with the minimum intensity per IMT
-    :params epsilons: a matrix of epsilons (or None)
+    :params epsgen: an EpsilonGenerator instance (or None)
     """
     def __init__(self, trt, rlzs_assoc, imts, sitecol, ses_ruptures,
-                 trunc_level, correl_model, min_iml, epsilons=None):
+                 trunc_level, correl_model, min_iml, epsgen=None):
         assert sitecol is sitecol.complete
         self.imts = imts
         self.sitecol = sitecol
@@ -675,26 +798,21 @@ class RiskInputFromRuptures(object):
         self.trunc_level = trunc_level
         self.correl_model = correl_model
         self.min_iml = min_iml
-        self.gsims = [dic[trt] for dic in rlzs_assoc.gsim_by_trt]
-        self.samples = rlzs_assoc.samples[grp_id]
-        self.rlzs = rlzs_assoc.get_rlzs_by_grp_id()[grp_id]
+        self.gsims = rlzs_assoc.get_gsims(trt)
+        self.sampleids = rlzs_assoc.get_sampleids(grp_id)
+        self.rlzs = rlzs_assoc.get_rlzs_by_grp_id()[grp_id].tolist()
         self.weight = sum(sr.weight for sr in ses_ruptures)
         self.eids = numpy.concatenate([r.events['eid'] for r in ses_ruptures])
-        if epsilons is not None:
-            self.eps = epsilons  # matrix N x E, events in this block
-            self.eid2idx = dict(zip(self.eids, range(len(self.eids))))
+        self.epsgen = epsgen
 
     def epsilon_getter(self, asset_ordinals):
         """
         :param asset_ordinals: ordinals of the assets
         :returns: a closure returning an array of epsilons from the event IDs
         """
-        if not hasattr(self, 'eps'):
+        if self.epsgen is None:
             return lambda aid, eids: None
-
-        def geteps(aid, eids):
-            return self.eps[aid, [self.eid2idx[eid] for eid in eids]]
-        return geteps
+        return lambda aid, eids: self.epsgen([aid], eids)[0]
 
     def hazard_getter(self, monitor=Monitor()):
         """
@@ -705,7 +823,7 @@ class RiskInputFromRuptures(object):
         """
         return GmfGetter(self.gsims, self.ses_ruptures, self.sitecol,
                          self.imts, self.min_iml, self.trunc_level,
-                         self.correl_model, self.samples)
+                         self.correl_model, self.sampleids)
 
     def __repr__(self):
         return '<%s imts=%s, weight=%d>' % (
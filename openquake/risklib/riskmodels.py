@@ -275,9 +275,9 @@ def rescale(curves, values):
     """
     n = len(curves)
     assert n == len(values), (n, len(values))
-    losses = [curves[i, 0] * values[i] for i in range(n)]
-    poes = curves[:, 1]
-    return numpy.array([[losses[i], poes[i]] for i in range(n)])
+    curves = numpy.array(curves)  # shape (n, 2, C)
+    curves[:, 0] *= numpy.array(values)[:, None]
+    return curves
 
 
 @registry.add('classical_risk', 'classical', 'disaggregation')
@@ -321,6 +321,23 @@ class Classical(RiskModel):
         self.loss_ratios = {
             lt: vf.mean_loss_ratios_with_steps(self.lrem_steps_per_interval)
             for lt, vf in self.risk_functions.items()}
+        self.cache = {}  # (loss_type, hazard curve) -> loss ratio curve
+
+    def loss_ratio_curve(self, loss_type, hazard_curve):
+        """
+        :param loss_type: the loss type considered
+        :param hazard_curve: an array of poes
+        :returns: the loss ratio curve, computed once per hazard curve
+        """
+        key = loss_type, numpy.asarray(hazard_curve).tobytes()
+        try:
+            return self.cache[key]
+        except KeyError:
+            vf = self.risk_functions[loss_type]
+            curve = self.cache[key] = scientific.classical(
+                vf, self.hazard_imtls[vf.imt], hazard_curve,
+                self.lrem_steps_per_interval)
+            return curve
 
     def __call__(self, loss_type, assets, hazard_curve, _eps=None):
         """
@@ -337,12 +354,9 @@ class Classical(RiskModel):
             a :class:`openquake.risklib.scientific.Classical.Output` instance.
         """
         n = len(assets)
-        vf = self.risk_functions[loss_type]
-        imls = self.hazard_imtls[vf.imt]
         values = get_values(loss_type, assets)
         lrcurves = numpy.array(
-            [scientific.classical(
-                vf, imls, hazard_curve, self.lrem_steps_per_interval)] * n)
+            [self.loss_ratio_curve(loss_type, hazard_curve)] * n)
 
         if self.insured_losses:
             deductibles = [a.deductible(loss_type) for a in assets]
@@ -496,10 +510,11 @@ class Scenario(RiskModel):
         missing_value = not ok.all()
         if missing_value:
             assets = assets[ok]
-            epsilons = epsilons[ok]
+            if epsilons is not None:
+                epsilons = epsilons[ok]
 
         # a matrix of N x E x I elements
-        E = len(epsilons[0])
+        E = len(ground_motion_values)
         I = self.insured_losses + 1
         loss_matrix = numpy.empty((len(assets), E, I))
         loss_matrix.fill(numpy.nan)
@@ -507,8 +522,11 @@ class Scenario(RiskModel):
         vf = self.risk_functions[loss_type]
         means, covs, idxs = vf.interpolate(ground_motion_values)
         loss_ratio_matrix = numpy.zeros((len(assets), E))
-        for i, eps in enumerate(epsilons):
-            loss_ratio_matrix[i, idxs] = vf.sample(means, covs, idxs, eps)
+        if epsilons is None:  # ignore_covs is set
+            loss_ratio_matrix[:, idxs] = means
+        else:
+            for i, eps in enumerate(epsilons):
+                loss_ratio_matrix[i, idxs] = vf.sample(means, covs, idxs, eps)
 
         loss_matrix[:, :, 0] = (loss_ratio_matrix.T * values).T
 
@@ -547,8 +565,15 @@ class Damage(RiskModel):
         """
         n = len(assets)
         ffs = self.risk_functions[loss_type]
-        damages = numpy.array(
-            [scientific.scenario_damage(ffs, gmv) for gmv in gmvs])
+        gmvs = numpy.array(gmvs)
+        # the zero ground motion values (i.e. the values below the minimum
+        # intensity in sparse GMFs) have all the same damage distribution
+        ok = gmvs > 0
+        damages = numpy.empty((len(gmvs), len(ffs) + 1))
+        damages[~ok] = scientific.scenario_damage(ffs, 0.)
+        if ok.any():
+            damages[ok] = [scientific.scenario_damage(ffs, gmv)
+                           for gmv in gmvs[ok]]
         return [damages] * n
 
 
@@ -567,6 +592,7 @@ class ClassicalDamage(Damage):
         self.hazard_imtls = hazard_imtls
         self.investigation_time = investigation_time
         self.risk_investigation_time = risk_investigation_time
+        self.cache = {}  # (loss_type, hazard curve) -> damage distribution
 
     def __call__(self, loss_type, assets, hazard_curve, _eps=None):
         """
@@ -577,12 +603,15 @@ class ClassicalDamage(Damage):
 
         where N is the number of points and D the number of damage states.
         """
-        ffl = self.risk_functions[loss_type]
-        hazard_imls = self.hazard_imtls[ffl.imt]
-        damage = scientific.classical_damage(
-            ffl, hazard_imls, hazard_curve,
-            investigation_time=self.investigation_time,
-            risk_investigation_time=self.risk_investigation_time)
+        key = loss_type, numpy.asarray(hazard_curve).tobytes()
+        try:
+            damage = self.cache[key]
+        except KeyError:
+            ffl = self.risk_functions[loss_type]
+            damage = self.cache[key] = scientific.classical_damage(
+                ffl, self.hazard_imtls[ffl.imt], hazard_curve,
+                investigation_time=self.investigation_time,
+                risk_investigation_time=self.risk_investigation_time)
         return [a.number * damage for a in assets]
 
 
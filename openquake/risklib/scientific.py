@@ -34,6 +34,7 @@ from openquake.risklib import utils
 from openquake.baselib.python3compat import with_metaclass
 
 F32 = numpy.float32
+F64 = numpy.float64
 U32 = numpy.uint32
 
 
@@ -784,6 +785,83 @@ def make_epsilons(matrix, seed, correlation):
         means_vector, covariance_matrix, samples).transpose()
 
 
+# constants of the SplitMix64 generator
+_GOLDEN = numpy.uint64(0x9E3779B97F4A7C15)
+_MIX1 = numpy.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = numpy.uint64(0x94D049BB133111EB)
+# key used for the component of the epsilons common to all assets
+_COMMON = numpy.uint64(2 ** 64 - 1)
+
+
+def _mix64(x):
+    # SplitMix64 finalizer, a bijection of the 64 bit integers with
+    # good avalanche properties; the products are computed modulo 2^64
+    x = (x ^ (x >> numpy.uint64(30))) * _MIX1
+    x = (x ^ (x >> numpy.uint64(27))) * _MIX2
+    return x ^ (x >> numpy.uint64(31))
+
+
+class EpsilonGenerator(object):
+    """
+    Stateless counter-based generator of standard normal epsilons.
+    The epsilon associated to the pair (asset ordinal, event ID) is
+    obtained by hashing the triple (seed, aid, eid) and does not depend
+    on the other assets and events, so that the same numbers are
+    generated for any splitting of the assets and events in tasks and
+    no (A, E) matrix of epsilons has to be kept in memory. An asset
+    correlation coefficient rho is obtained with a one-factor model
+    `sqrt(rho) * eps(eid) + sqrt(1 - rho) * eps(aid, eid)`, which has
+    the same covariance matrix used by :func:`make_epsilons`.
+
+    >>> gen = EpsilonGenerator(42)
+    >>> eps = gen([0, 1, 2], [10, 11])
+    >>> eps.shape
+    (3, 2)
+    >>> bool((eps[1:] == gen([1, 2], [10, 11])).all())
+    True
+
+    :param seed: the master seed
+    :param correlation: the asset correlation, a number between 0 and 1
+    """
+    def __init__(self, seed, correlation=0):
+        self.seed = seed
+        self.correlation = correlation
+        with numpy.errstate(over='ignore'):
+            self.key = _mix64(numpy.array([seed], numpy.uint64) ^ _GOLDEN)
+
+    def _normal(self, aids, eids):
+        # Box-Muller transform of two uniforms extracted from the hash
+        h = _mix64(_mix64(self.key ^ aids[:, None]) ^ eids[None, :])
+        u1 = ((h >> numpy.uint64(11)) + numpy.uint64(1)) * 2. ** -53
+        u2 = (_mix64(h + _GOLDEN) >> numpy.uint64(11)) * 2. ** -53
+        return numpy.sqrt(-2 * numpy.log(u1)) * numpy.cos(2 * numpy.pi * u2)
+
+    def __call__(self, aids, eids):
+        """
+        :param aids: an array of A asset ordinals
+        :param eids: an array of E event IDs
+        :returns: a matrix of A x E epsilons in single precision
+        """
+        aids = numpy.array(aids, numpy.uint64).reshape(-1)
+        eids = numpy.array(eids, numpy.uint64).reshape(-1)
+        rho = self.correlation
+        with numpy.errstate(over='ignore'):
+            if rho == 1:  # the epsilons are equal for all assets
+                common = self._normal(numpy.array([_COMMON]), eids)
+                eps = numpy.repeat(common, len(aids), axis=0)
+            elif rho:
+                common = self._normal(numpy.array([_COMMON]), eids)
+                eps = (numpy.sqrt(rho) * common +
+                       numpy.sqrt(1 - rho) * self._normal(aids, eids))
+            else:
+                eps = self._normal(aids, eids)
+        return eps.astype(F32)
+
+    def __repr__(self):
+        return '<%s seed=%s correlation=%s>' % (
+            self.__class__.__name__, self.seed, self.correlation)
+
+
 @DISTRIBUTIONS.add('LN')
 class LogNormalDistribution(Distribution):
     """
@@ -896,46 +974,77 @@ class CurveBuilder(object):
         self.agg_curve_dt = numpy.dtype([('losses', (F32, C)),
                                          ('poes', (F32, C)),
                                          ('avg', F32)])
+        # the ratios are not necessarily sorted
+        order = numpy.argsort(self.ratios, kind='mergesort')
+        self.sorted_ratios = self.ratios[order]
+        self.rank = numpy.argsort(order)
+
+    def _bins(self, loss_ratios):
+        # the bin k of a loss ratio is the number of sorted ratios <= it;
+        # NaNs are in the bin 0, since they are not >= of any ratio
+        bins = numpy.searchsorted(self.sorted_ratios, loss_ratios, 'right')
+        bins[numpy.isnan(loss_ratios)] = 0
+        return bins
+
+    def _counts(self, nums):
+        # the loss ratios >= the j-th sorted ratio are the ones in the
+        # bins > j; returns the counts in the order of self.ratios
+        counts = nums[..., ::-1].cumsum(axis=-1)[..., -2::-1]
+        return counts[..., self.rank]
+
+    def build_counts(self, loss_ratios):
+        """
+        :param loss_ratios: an array of loss ratios of shape (E, ...)
+        :returns: an array of shape (C, ...) with the number of loss
+                  ratios greater or equal than each of the C ratios
 
-    def __call__(self, assets, ratios_by_aid):
+        >>> cb = CurveBuilder('structural', 3, [.1, .2, .3], 1, True)
+        >>> cb.build_counts(numpy.array([.05, .15, .25, .35, .5]))
+        array([4, 3, 2])
+        """
+        lrs = numpy.asarray(loss_ratios)
+        bins = self._bins(lrs).reshape(len(lrs), -1)
+        C = len(self.ratios)
+        nums = numpy.array([numpy.bincount(col, minlength=C + 1)
+                            for col in bins.T])  # shape (K, C + 1)
+        return self._counts(nums).T.reshape((C,) + lrs.shape[1:])
+
+    def __call__(self, assets, data):
         """"
         :param assets: a list of assets
-        :param ratios_by_aid: a dictionary of loss ratios by asset ordinal
+        :param data: an array with fields `aid` and `loss` of shape (L, I)
         :returns:
            two arrays, `aids` of size A, and `all_poes` of shape (A, I, C)
         """
-        aids = []
-        all_poes = []
-        for asset in assets:
-            aid = asset.ordinal
-            try:
-                loss_ratios = ratios_by_aid[aid]['loss']
-            except KeyError:   # no loss ratios
-                continue
-            # loss_ratios has shape (E, L, I)
-            lrs = loss_ratios[:, self.index]
-            counts = numpy.array([(lrs >= ratio).sum(axis=0)
-                                  for ratio in self.ratios])
-            poes = build_poes(counts, 1. / self.ses_ratio)
-            if len(poes.shape) == 1:
-                poes = poes[:, None]
-            # for instance the ratios can have shape (21,), the loss_ratios
-            # (3, 2), the counts (21, 2) and the transposed poes (2, 21)
-            all_poes.append(poes.T)
-            aids.append(aid)
-        return numpy.array(aids), numpy.array(all_poes)
+        aids = numpy.unique(data['aid'])
+        aids = aids[numpy.in1d(aids, [asset.ordinal for asset in assets])]
+        if len(aids) == 0:  # no loss ratios
+            return aids, numpy.zeros((0, self.insured_losses + 1,
+                                      len(self.ratios)), F32)
+        data = data[numpy.in1d(data['aid'], aids)]
+        # loss ratios for all the events of all the assets, shape (N, I)
+        lrs = data['loss'][:, self.index]
+        C1 = len(self.ratios) + 1
+        # bin all the loss ratios at once by (asset, bin)
+        idx = (numpy.searchsorted(aids, data['aid'])[:, None] * C1 +
+               self._bins(lrs))
+        nums = numpy.array([numpy.bincount(col, minlength=len(aids) * C1)
+                            for col in idx.T])  # shape (I, A * C1)
+        nums = nums.reshape(len(nums), len(aids), C1).transpose(1, 0, 2)
+        return aids, build_poes(self._counts(nums), 1. / self.ses_ratio)
 
     def calc_agg_curve(self, losses):
         """
         :param losses: array of length E
         :returns: curve of dtype agg_curve_dt
         """
+        # counts how many loss_values are bigger than the reference loss,
+        # by comparing them in double precision
+        losses = numpy.sort(numpy.array(losses, F64))
         reference_losses = numpy.linspace(
-            0, numpy.max(losses), self.curve_resolution)
-        # counts how many loss_values are bigger than the reference loss
-        counts = [(losses > loss).sum() for loss in reference_losses]
-        # NB: (loss_values > loss).sum() is MUCH more efficient than
-        # sum(loss_values > loss). Incredibly more efficient in memory.
+            0, losses[-1], self.curve_resolution)
+        counts = len(losses) - numpy.searchsorted(
+            losses, reference_losses, 'right')
         curve = numpy.zeros(1, self.agg_curve_dt)
         curve['losses'][0] = reference_losses
         curve['poes'][0] = poes = build_poes(counts, 1. / self.ses_ratio)
@@ -1047,23 +1156,17 @@ def classical(vulnerability_function, hazard_imls, hazard_poes, steps=10):
     assert len(hazard_imls) == len(hazard_poes), (
         len(hazard_imls), len(hazard_poes))
     vf = vulnerability_function
-    imls = vf.mean_imls()
+    # saturate imls to hazard imls; NB: mean_imls is memoized, do not
+    # change it in place
+    imls = numpy.clip(vf.mean_imls(), hazard_imls[0], hazard_imls[-1])
     loss_ratios, lrem = vf.loss_ratio_exceedance_matrix(steps)
 
-    # saturate imls to hazard imls
-    min_val, max_val = hazard_imls[0], hazard_imls[-1]
-    numpy.putmask(imls, imls < min_val, min_val)
-    numpy.putmask(imls, imls > max_val, max_val)
-
     # interpolate the hazard curve
     poes = interpolate.interp1d(hazard_imls, hazard_poes)(imls)
 
     # compute the poos
     pos = pairwise_diff(poes)
-    lrem_po = numpy.empty(lrem.shape)
-    for idx, po in enumerate(pos):
-        lrem_po[:, idx] = lrem[:, idx] * po  # column * po
-    return numpy.array([loss_ratios, lrem_po.sum(axis=1)])
+    return numpy.array([loss_ratios, (lrem * pos).sum(axis=1)])
 
 
 def conditional_loss_ratio(loss_ratios, poes, probability):
@@ -20,7 +20,7 @@ import unittest
 import numpy
 from scipy.interpolate import interp1d
 
-from openquake.risklib import scientific
+from openquake.risklib import scientific, riskmodels
 
 
 class ClassicalTestCase(unittest.TestCase):
@@ -192,3 +192,21 @@ class ClassicalTestCase(unittest.TestCase):
         for loss, poe in expected_curve:
             numpy.testing.assert_allclose(
                 poe, actual_poes_interp(loss), atol=0.005)
+
+    def test_loss_ratio_curve_cache(self):
+        hazard_imls = [0.15, 0.3, 0.5]
+        vf = scientific.VulnerabilityFunction(
+            'VF', 'PGA', [0.1, 0.2, 0.4, 0.6], [0.05, 0.08, 0.2, 0.4],
+            [0.5, 0.3, 0.2, 0.1], "LN")
+        mean_imls = vf.mean_imls().copy()
+        rm = riskmodels.Classical('VF', {'structural': vf},
+                                  {'PGA': hazard_imls}, 2, [], [])
+        curve1 = rm.loss_ratio_curve('structural', numpy.array([.9, .5, .1]))
+        curve2 = rm.loss_ratio_curve('structural', numpy.array([.9, .5, .1]))
+        curve3 = rm.loss_ratio_curve('structural', numpy.array([.8, .4, .1]))
+        self.assertIs(curve1, curve2)
+        self.assertEqual(len(rm.cache), 2)
+        numpy.testing.assert_allclose(curve3, scientific.classical(
+            vf, hazard_imls, [.8, .4, .1], 2))
+        # the memoized mean_imls are not changed by the saturation
+        numpy.testing.assert_equal(vf.mean_imls(), mean_imls)
@@ -17,6 +17,7 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+import collections
 import mock
 import pickle
 
@@ -24,6 +25,7 @@ import numpy
 from openquake.risklib import utils, scientific
 
 aaae = numpy.testing.assert_array_almost_equal
+F32 = numpy.float32
 
 
 class DegenerateDistributionTest(unittest.TestCase):
@@ -362,6 +364,40 @@ class LogNormalDistributionTestCase(unittest.TestCase):
         numpy.testing.assert_allclose([0., 0., 0.1, 0.10228396], samples)
 
 
+class EpsilonGeneratorTestCase(unittest.TestCase):
+
+    def test_independent_from_the_split(self):
+        gen = scientific.EpsilonGenerator(42)
+        aids = numpy.arange(100)
+        eids = numpy.arange(1000, 3000)
+        eps = gen(aids, eids)
+        self.assertEqual(eps.shape, (100, 2000))
+        self.assertEqual(eps.dtype, numpy.float32)
+        # the same epsilons are generated block by block
+        numpy.testing.assert_equal(gen(aids[10:20], eids[500:]),
+                                   eps[10:20, 500:])
+        numpy.testing.assert_equal(gen([7], [1999, 1000])[0],
+                                   eps[7, [999, 0]])
+        # and the seed matters
+        other = scientific.EpsilonGenerator(43)(aids, eids)
+        self.assertFalse((other == eps).any())
+        numpy.testing.assert_allclose(eps.mean(), 0, atol=.01)
+        numpy.testing.assert_allclose(eps.std(), 1, atol=.01)
+
+    def test_correlation(self):
+        aids = numpy.arange(20)
+        eids = numpy.arange(10000)
+        eps = scientific.EpsilonGenerator(17, 0.37)(aids, eids)
+        coeffs = numpy.corrcoef(eps)[numpy.triu_indices(20, 1)]
+        numpy.testing.assert_allclose(coeffs.mean(), 0.37, atol=.02)
+        numpy.testing.assert_allclose(eps.std(axis=1), 1, atol=.05)
+
+        # full correlation: the epsilons are the same for all assets
+        eps = scientific.EpsilonGenerator(17, 1)(aids, eids)
+        for row in eps[1:]:
+            numpy.testing.assert_equal(row, eps[0])
+
+
 class VulnerabilityLossRatioStepsTestCase(unittest.TestCase):
     IMT = 'PGA'
 
@@ -600,6 +636,57 @@ class LossMapMatrixTest(unittest.TestCase):
             scientific.loss_map_matrix([0.55, 0.5], self.curves))
 
 
+class CurveBuilderTestCase(unittest.TestCase):
+    def setUp(self):
+        # unsorted ratios with a duplicate
+        self.ratios = [0.1, 0.5, 0.3, 0.3, 0.9]
+        self.cb = scientific.CurveBuilder(
+            'structural', 5, self.ratios, 0.5, True, insured_losses=True)
+        self.cb.index = 0
+        rng = numpy.random.RandomState(42)
+        dt = numpy.dtype([('aid', numpy.uint32), ('loss', (F32, (1, 2)))])
+        self.data = numpy.zeros(300, dt)
+        self.data['aid'] = rng.randint(0, 10, 300)
+        self.data['loss'] = rng.choice(
+            numpy.array(self.ratios + [0, 1], F32), (300, 1, 2))
+        self.data['loss'][::10, 0, 0] = numpy.nan
+
+    def brute_counts(self, lrs):
+        return numpy.array([(lrs >= ratio).sum(axis=0)
+                            for ratio in self.cb.ratios])
+
+    def test_build_counts(self):
+        lrs = self.data['loss'][:, 0]  # shape (E, I)
+        numpy.testing.assert_equal(
+            self.cb.build_counts(lrs), self.brute_counts(lrs))
+        numpy.testing.assert_equal(
+            self.cb.build_counts(lrs[:, 1]), self.brute_counts(lrs[:, 1]))
+
+    def test_call(self):
+        Asset = collections.namedtuple('Asset', 'ordinal')
+        assets = [Asset(aid) for aid in (7, 2, 5, 11)]
+        aids, poes = self.cb(assets, self.data)
+        numpy.testing.assert_equal(aids, [2, 5, 7])
+        self.assertEqual(poes.shape, (3, 2, 5))
+        for aid, curves in zip(aids, poes):
+            lrs = self.data[self.data['aid'] == aid]['loss'][:, 0]
+            expected = scientific.build_poes(self.brute_counts(lrs), 2.)
+            numpy.testing.assert_equal(curves, expected.T)
+
+    def test_calc_agg_curve(self):
+        losses = numpy.array([0, 10, 20, 20, 40, 50, 90, 100], F32)
+        curve = self.cb.calc_agg_curve(losses)
+        aaae(curve['losses'], [0, 25, 50, 75, 100])
+        numpy.testing.assert_equal(
+            curve['poes'], scientific.build_poes([7, 4, 2, 2, 0], 2.))
+
+        # float32(1/3) is above the reference loss 1/3 in double precision
+        cb = scientific.CurveBuilder('structural', 4, self.ratios, 0.5, True)
+        curve = cb.calc_agg_curve(numpy.array([0, 1. / 3, 1], F32))
+        numpy.testing.assert_equal(
+            curve['poes'], scientific.build_poes([2, 2, 1, 0], 2.))
+
+
 class ClassicalDamageTestCase(unittest.TestCase):
     def test_discrete(self):
         hazard_imls = [0.05, 0.2, 0.4, 0.6, 0.8, 1, 1.2, 1.4]
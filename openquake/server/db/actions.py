@@ -18,6 +18,7 @@
 from __future__ import print_function
 import os
 import glob
+import shutil
 import operator
 from datetime import datetime, timedelta
 
@@ -291,7 +292,10 @@ def del_calc(db, job_id, user):
     fnames = []
     for fname in glob.glob(path + '.*'):
         try:
-            os.remove(fname)
+            if os.path.isdir(fname):  # the cache of the exported outputs
+                shutil.rmtree(fname)
+            else:
+                os.remove(fname)
         except OSError as exc:  # permission error
             print('Could not remove %s: %s' % (fname, exc))
         else:
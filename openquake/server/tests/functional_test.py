@@ -186,6 +186,28 @@ class EngineServerTestCase(unittest.TestCase):
         self.assertEqual(
             contentdisp, 'attachment; filename=output--hmaps-csv.zip')
 
+        # download the hmaps twice, the second time from the export cache
+        url = 'http://%s/v1/calc/result/%s' % (self.hostport, hmaps_id)
+        full = requests.get(url, params=dict(export_type='csv'))
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual(full.headers['Accept-Ranges'], 'bytes')
+        again = requests.get(url, params=dict(export_type='csv'))
+        self.assertEqual(again.content, full.content)
+
+        # download a range of bytes
+        part = requests.get(url, params=dict(export_type='csv'),
+                            headers=dict(Range='bytes=10-19'))
+        self.assertEqual(part.status_code, 206)
+        self.assertEqual(part.content, full.content[10:20])
+        self.assertEqual(part.headers['Content-Range'],
+                         'bytes 10-19/%d' % len(full.content))
+
+        # requesting a range outside of the file
+        rng = 'bytes=%d-' % len(full.content)
+        resp = requests.get(url, params=dict(export_type='csv'),
+                            headers=dict(Range=rng))
+        self.assertEqual(resp.status_code, 416)
+
     def test_err_1(self):
         # the rupture XML file has a syntax error
         job_id = self.postzip('archive_err_1.zip')
@@ -25,6 +25,7 @@ urlpatterns = [
     url(r'^list$', views.calc),
     url(r'^(\d+)$', views.calc_info),
     url(r'^(\d+)/datastore$', views.get_datastore),
+    url(r'^(\d+)/extract/([\w-]+)$', views.extract_data),
     url(r'^(\d+)/status$', views.calc),
     url(r'^(\d+)/results$', views.calc_results),
     url(r'^(\d+)/traceback$', views.get_traceback),
@@ -30,7 +30,8 @@ import re
 
 from xml.parsers.expat import ExpatError
 from django.http import (
-    HttpResponse, HttpResponseNotFound, HttpResponseBadRequest)
+    HttpResponse, HttpResponseNotFound, HttpResponseBadRequest,
+    StreamingHttpResponse)
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.shortcuts import render
@@ -41,8 +42,10 @@ from openquake.baselib.parallel import Starmap, safely_call
 from openquake.hazardlib import nrml
 from openquake.risklib import read_nrml
 
-from openquake.commonlib import readinput, oqvalidation, logs
+from openquake.commonlib import readinput, oqvalidation, logs, datastore
 from openquake.calculators.export import export
+from openquake.calculators.extract import (
+    extract, parse_selection, to_npy, to_json)
 from openquake.engine import __version__ as oqversion
 from openquake.engine.export import core
 from openquake.engine import engine
@@ -52,23 +55,24 @@ from openquake.server import executor, utils, dbapi
 from django.conf import settings
 if settings.LOCKDOWN:
     from django.contrib.auth import authenticate, login, logout
-try:
-    from django.http import FileResponse  # Django >= 1.8
-except ImportError:
-    from django.http import StreamingHttpResponse as FileResponse
-try:
-    from wsgiref.util import FileWrapper  # Django >= 1.9
-except ImportError:
-    from django.core.servers.basehttp import FileWrapper
 
 read_nrml.update_validators()  # update risk validators
 
 METHOD_NOT_ALLOWED = 405
 NOT_IMPLEMENTED = 501
+PARTIAL_CONTENT = 206
+RANGE_NOT_SATISFIABLE = 416
+
+#: Size in bytes of the blocks sent to the client when streaming a file
+CHUNK_SIZE = 1024 * 1024
+
+#: Regular expression matching a single byte range, like bytes=0-1023
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
 
 XML = 'application/xml'
 JSON = 'application/json'
 HDF5 = 'application/x-hdf'
+NPY = 'application/octet-stream'
 
 DEFAULT_LOG_LEVEL = 'info'
 
@@ -484,7 +488,9 @@ def get_traceback(request, calc_id):
 @require_http_methods(['GET', 'HEAD'])
 def get_result(request, result_id):
     """
-    Download a specific result, by ``result_id``.
+    Download a specific result, by ``result_id``. The result is exported
+    only the first time it is requested in a given format and then it is
+    streamed from the export cache; HTTP Range requests are supported.
 
     The common abstracted functionality for getting hazard or risk results.
 
@@ -497,8 +503,8 @@ def get_result(request, result_id):
         If the requested ``result_id`` is not available in the format
         designated by the `export_type`.
 
-        Otherwise, return a `django.http.HttpResponse` containing the content
-        of the requested artifact.
+        Otherwise, return a `django.http.StreamingHttpResponse` containing
+        the content of the requested artifact.
 
     Parameters for the GET request can include an `export_type`, such as 'xml',
     'geojson', 'csv', etc.
@@ -517,10 +523,9 @@ def get_result(request, result_id):
     etype = request.GET.get('export_type')
     export_type = etype or DEFAULT_EXPORT_TYPE
 
-    tmpdir = tempfile.mkdtemp()
     try:
-        exported = core.export_from_db(
-            (ds_key, export_type), job_id, datadir, tmpdir)
+        exported = _export_cached(
+            result_id, ds_key, export_type, job_id, datadir)
     except DataStoreExportError as exc:
         # TODO: there should be a better error page
         return HttpResponse(content='%s: %s' % (exc.__class__.__name__, exc),
@@ -532,25 +537,132 @@ def get_result(request, result_id):
 
     content_type = EXPORT_CONTENT_TYPE_MAP.get(
         export_type, DEFAULT_CONTENT_TYPE)
+    bname = os.path.basename(exported)
+    if bname.startswith('.'):
+        # the "." is added by `export_from_db`, strip it
+        bname = bname[1:]
+    fname = 'output-%s-%s' % (result_id, bname)
+    return _stream_file(request, exported, content_type, fname)
+
+
+def _export_cached(result_id, ds_key, export_type, job_id, datadir):
+    """
+    Export the given output in the directory <datadir>/calc_XXX.exports,
+    unless a previous export of the same output in the same format is
+    there and it is more recent than the datastore.
+
+    :returns: the path of the exported file (or None)
+    """
+    cachedir = os.path.join(datadir, 'calc_%s.exports' % job_id)
+    keydir = os.path.join(cachedir, '%s-%s' % (result_id, export_type))
+    hdf5 = os.path.join(datadir, 'calc_%s.hdf5' % job_id)
+    if os.path.exists(keydir):
+        for cached in os.listdir(keydir):  # there is a single file
+            cached = os.path.join(keydir, cached)
+            if os.path.getmtime(cached) >= os.path.getmtime(hdf5):
+                return cached
+        shutil.rmtree(keydir, ignore_errors=True)  # stale export
+    core.makedirs(cachedir)
+    tmpdir = tempfile.mkdtemp(dir=cachedir)
     try:
-        bname = os.path.basename(exported)
-        if bname.startswith('.'):
-            # the "." is added by `export_from_db`, strip it
-            bname = bname[1:]
-        fname = 'output-%s-%s' % (result_id, bname)
-        # 'b' is needed when running the WebUI on Windows
-        data = open(exported, 'rb').read()
-        response = HttpResponse(data, content_type=content_type)
-        response['Content-Length'] = len(data)
-        response['Content-Disposition'] = (
-            'attachment; filename=%s' % os.path.basename(fname))
-        return response
+        exported = core.export_from_db(
+            (ds_key, export_type), job_id, datadir, tmpdir)
+        if exported is None:
+            return
+        # keep only the exported file (the archive in case of many files)
+        # and move it in place atomically, so that concurrent downloads
+        # never see a partially exported file
+        outdir = tempfile.mkdtemp(dir=cachedir)
+        shutil.move(exported, outdir)
+        try:
+            os.rename(outdir, keydir)
+        except OSError:  # another request exported the same output
+            shutil.rmtree(outdir, ignore_errors=True)
+        return os.path.join(keydir, os.path.basename(exported))
     finally:
-        shutil.rmtree(tmpdir)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def _parse_range(header, size):
+    """
+    Parse a HTTP Range header containing a single byte range.
+
+    :param header: a string like 'bytes=0-1023', 'bytes=1024-' or 'bytes=-512'
+    :param size: the size of the file in bytes
+    :returns: a pair (start, stop) or None if the range is not satisfiable
+    """
+    mo = RANGE_RE.match(header.strip())
+    if mo is None:
+        return
+    first, last = mo.groups()
+    if first:
+        start = int(first)
+        stop = min(int(last) + 1, size) if last else size
+    elif last:  # suffix range, i.e. the last bytes of the file
+        start = max(size - int(last), 0)
+        stop = size
+    else:
+        return
+    if start >= stop:
+        return
+    return start, stop
+
+
+def _read_chunks(fname, start, stop, chunksize=CHUNK_SIZE):
+    """
+    Yield the bytes of the file in the range [start, stop), in chunks
+    """
+    with open(fname, 'rb') as f:  # 'b' is needed on Windows
+        f.seek(start)
+        nbytes = stop - start
+        while nbytes > 0:
+            data = f.read(min(chunksize, nbytes))
+            if not data:
+                break
+            nbytes -= len(data)
+            yield data
+
+
+def _stream_file(request, fname, content_type, attachment):
+    """
+    Send a file to the client in chunks, without reading it in memory.
+    A single byte range can be requested with the Range header.
+
+    :param request: `django.http.HttpRequest` object
+    :param fname: the path of the file to send
+    :param content_type: the content type of the response
+    :param attachment: the file name suggested to the client
+    :returns: a `django.http.StreamingHttpResponse` object
+    """
+    size = os.path.getsize(fname)
+    start, stop = 0, size
+    status = 200
+    header = request.META.get('HTTP_RANGE')
+    if header:
+        rng = _parse_range(header, size)
+        if rng is None:
+            response = HttpResponse(status=RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+        start, stop = rng
+        status = PARTIAL_CONTENT
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type, status=status)
+    else:
+        response = StreamingHttpResponse(
+            _read_chunks(fname, start, stop), content_type=content_type,
+            status=status)
+    if status == PARTIAL_CONTENT:
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1, size)
+    response['Content-Length'] = stop - start
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = (
+        'attachment; filename=%s' % os.path.basename(attachment))
+    return response
 
 
 @cross_domain_ajax
-@require_http_methods(['GET'])
+@require_http_methods(['GET', 'HEAD'])
 def get_datastore(request, job_id):
     """
     Download a full datastore file.
@@ -560,7 +672,7 @@ def get_datastore(request, job_id):
     :param job_id:
         The id of the requested datastore
     :returns:
-        A `django.http.HttpResponse` containing the content
+        A `django.http.StreamingHttpResponse` containing the content
         of the requested artifact, if present, else throws a 404
     """
     try:
@@ -569,10 +681,49 @@ def get_datastore(request, job_id):
         return HttpResponseNotFound()
 
     fname = job.ds_calc_dir + '.hdf5'
-    response = FileResponse(
-        FileWrapper(open(fname, 'rb')), content_type=HDF5)
+    return _stream_file(request, fname, HDF5, fname)
+
+
+@cross_domain_ajax
+@require_http_methods(['GET'])
+def extract_data(request, job_id, what):
+    """
+    Extract a slice of a datastore array, by reading only the requested
+    part of the underlying HDF5 dataset.
+
+    :param request:
+        `django.http.HttpRequest` object. Can contain the GET parameters
+        `sids`, `aids`, `eids` (comma-separated indices or a range
+        start:stop), `rlz`, `kind` and `format` ('npy' or 'json').
+    :param job_id:
+        The id of the requested datastore
+    :param what:
+        The name of the extractor, for instance 'hcurves' or 'gmf_data'
+    :returns:
+        A `django.http.HttpResponse` containing the array in .npy format,
+        or as a JSON list, if present, else throws a 404
+    """
+    try:
+        job = logs.dbcmd('get_job', int(job_id), getpass.getuser())
+    except dbapi.NotFound:
+        return HttpResponseNotFound()
+    if what not in extract:
+        return HttpResponseNotFound('There is no extractor for %s' % what)
+    fmt = request.GET.get('format', 'npy')
+    if fmt not in ('npy', 'json'):
+        return HttpResponseBadRequest('Unknown format %s' % fmt)
+    try:
+        kw = parse_selection(request.GET)
+        with datastore.read(job.id, datadir=os.path.dirname(
+                job.ds_calc_dir)) as dstore:
+            array = extract(what, dstore, **kw)
+    except (KeyError, TypeError, ValueError) as exc:
+        return HttpResponseBadRequest('%s: %s' % (exc.__class__.__name__, exc))
+    if fmt == 'json':
+        return HttpResponse(content=to_json(array), content_type=JSON)
+    response = HttpResponse(content=to_npy(array), content_type=NPY)
     response['Content-Disposition'] = (
-        'attachment; filename=%s' % os.path.basename(fname))
+        'attachment; filename=%s-%s.npy' % (what, job.id))
     return response
 
 